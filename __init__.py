@@ -6,6 +6,10 @@ from .particle import custom_prop
 from .particle import utils
 from .particle import constraint
 from .particle import collision
+from .particle import kernels
+from .particle import emitter
+from .particle import cache
+from .particle import bake_queue
 from bpy.props import BoolProperty, EnumProperty
 from mathutils import Vector, Matrix
 import subprocess
@@ -46,6 +50,7 @@ class DeleteParticleSystemOperator(bpy.types.Operator):
     bl_description = "delete current custom particle system"
 
     def execute(self, context):
+        particle_system.AnimationPlayback.stop()
         p_system = particle_system.ParticleSystem.get_instance()
         p_system.delete_instance()
         current_collection = bpy.data.collections.get("Custom Particle System")
@@ -90,6 +95,30 @@ class ApplySpringForceOperator(bpy.types.Operator):
         p_system.add_force(spring_force)
         return {'FINISHED'}
 
+class ApplyNBodyForceOperator(bpy.types.Operator):
+    bl_idname = "apply_n_body_force.particle"
+    bl_label = "apply n-body force on particle system"
+    bl_description = "let every particle attract every other one"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        n_body_force = apply_force.NBodyForce(strength=context.scene.n_body_strength, theta=context.scene.n_body_theta,
+                                              softening=context.scene.n_body_softening, method=context.scene.n_body_method.lower())
+        p_system.add_coherent_force(n_body_force)
+        return {'FINISHED'}
+
+class ApplySPHFluidForceOperator(bpy.types.Operator):
+    bl_idname = "apply_sph_fluid_force.particle"
+    bl_label = "apply sph fluid force on particle system"
+    bl_description = "make the particles behave like a viscous fluid"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        fluid_force = apply_force.SPHFluidForce(smoothing_length=context.scene.fluid_smoothing_length, rest_density=context.scene.fluid_rest_density,
+                                                stiffness=context.scene.fluid_stiffness, viscosity=context.scene.fluid_viscosity)
+        p_system.add_coherent_force(fluid_force)
+        return {'FINISHED'}
+
 class CalculateFrameOperator(bpy.types.Operator):
     bl_idname = "particle.calculate_frame"
     bl_label = "Calculate frame on blender particle system"
@@ -97,6 +126,7 @@ class CalculateFrameOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
+        sync_profiler(p_system, context)
         p_system.update_to_object(context, calculate_frame=True)
         return {'FINISHED'}
 
@@ -107,12 +137,13 @@ class AddParticleOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
+        # A row along x continuing from the last particle
+        offset_list = [(2.0 * i, 0.0, 0.0) for i in range(context.scene.add_particle_count)]
         if len(p_system.particle_list) == 0:
-            p_system.add_particle()
+            p_system.add_particles(offset_list)
         else:
             latest_location = p_system.particle_list[-1].location
-            p_system.add_particle(latest_location + Vector((2.0, 0.0, 0.0)))
-        p_system = particle_system.ParticleSystem.get_instance()
+            p_system.add_particles(latest_location + (2.0, 0.0, 0.0) + offset_list)
         p_system.update_to_object(context)
         return {'FINISHED'}
 
@@ -123,10 +154,30 @@ class RemoveParticleOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
-        p_system.remove_particle(int(context.scene.select_particle_idx))
+        if context.scene.select_particle_idx >= len(p_system.init_particle_list):
+            self.report({'ERROR'}, "No particle " + str(context.scene.select_particle_idx))
+            return {'CANCELLED'}
+        p_system.remove_particle(context.scene.select_particle_idx)
         p_system.update_to_object(context)
         return {'FINISHED'}
 
+class PickParticleOperator(bpy.types.Operator):
+    bl_idname = "particle.pick"
+    bl_label = "Pick particle from active object"
+    bl_description = "set the particle index from the active particle object"
+
+    target = bpy.props.StringProperty(default="select_particle_idx")
+
+    def execute(self, context):
+        ob = context.active_object
+        current_collection = bpy.data.collections.get("Custom Particle System")
+        # Particle objects are named by their index
+        if ob == None or current_collection == None or current_collection.objects.get(ob.name) != ob or not ob.name.isdigit():
+            self.report({'ERROR'}, "Active object is not a particle")
+            return {'CANCELLED'}
+        setattr(context.scene, self.target, int(ob.name))
+        return {'FINISHED'}
+
 class SyncParticleInitOperator(bpy.types.Operator):
     bl_idname = "particle.sync_init"
     bl_label = "Sync particle initial state"
@@ -134,16 +185,45 @@ class SyncParticleInitOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
-        particle_idx = int(context.scene.select_particle_idx)
-        new_location = p_system.init_particle_list[particle_idx].location
-        new_mass = p_system.init_particle_list[particle_idx].mass
-        particle_ob = bpy.data.objects.get(str(particle_idx))
-        bpy.ops.object.select_all(action='DESELECT')
-        particle_ob.select = True
-        context.view_layer.objects.active = particle_ob
-        particle_ob.location = Vector(new_location)
-        particle_ob.scale = Vector(
-            (new_mass, new_mass, new_mass))
+        particle_idx = context.scene.select_particle_idx
+        if particle_idx >= len(p_system.init_particle_list):
+            self.report({'ERROR'}, "No particle " + str(particle_idx))
+            return {'CANCELLED'}
+        p_system.update_init_objects([particle_idx])
+        return {'FINISHED'}
+
+def get_selected_particle_idx(context):
+    # Indices of the selected particle objects, which are named by their index
+    current_collection = bpy.data.collections.get("Custom Particle System")
+    if current_collection == None:
+        return []
+    return [int(ob.name) for ob in context.selected_objects if ob.name.isdigit() and current_collection.objects.get(ob.name) == ob]
+
+class BatchEditParticleOperator(bpy.types.Operator):
+    bl_idname = "particle.batch_edit"
+    bl_label = "Batch edit particle initial state"
+    bl_description = "set, scale or offset the initial state of the selected particles or an index range at once"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        scene = context.scene
+        if scene.batch_particle_source == 'RANGE':
+            try:
+                particle_idx_array = particle_system.parse_index_ranges(scene.batch_particle_range, len(p_system.init_particle_list))
+            except ValueError:
+                self.report({'ERROR'}, "Index ranges look like 0-9, 20, 30-")
+                return {'CANCELLED'}
+        else:
+            particle_idx_array = get_selected_particle_idx(context)
+        location = tuple(scene.batch_location) if scene.batch_edit_location else None
+        velocity = tuple(scene.batch_velocity) if scene.batch_edit_velocity else None
+        mass = scene.batch_mass if scene.batch_edit_mass else None
+        particle_idx_array = p_system.edit_init_particles(particle_idx_array, location, velocity, mass, scene.batch_edit_mode.lower())
+        if len(particle_idx_array) == 0:
+            self.report({'WARNING'}, "No particles to edit")
+            return {'CANCELLED'}
+        p_system.update_init_objects(particle_idx_array)
+        self.report({'INFO'}, "Edited " + str(len(particle_idx_array)) + " particles")
         return {'FINISHED'}
 
 class ApplySolverOperator(bpy.types.Operator):
@@ -169,13 +249,45 @@ class ApplySolverOperator(bpy.types.Operator):
             p_system.solver = solver.BackwardEulerSolver()
         return {'FINISHED'}
 
+class ApplyBackendOperator(bpy.types.Operator):
+    bl_idname = "apply.backend"
+    bl_label = "Apply kernel backend to custom particle system"
+    bl_description = "apply kernel backend custom particle system"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        p_system.set_backend(context.scene.backend_name.lower())
+        p_system.set_num_threads(context.scene.num_threads)
+        p_system.neighbor_search.skin = context.scene.neighbor_skin
+        p_system.set_precision(context.scene.precision_name.lower())
+        p_system.set_deterministic(context.scene.deterministic)
+        p_system.set_num_processes(context.scene.num_processes)
+        p_system.neighbor_search.reset_neighbor()
+        if p_system.kernels.name != p_system.backend:
+            self.report({'WARNING'}, "numba is not installed, falling back to numpy")
+        return {'FINISHED'}
+
+class ApplySleepOperator(bpy.types.Operator):
+    bl_idname = "apply.sleep"
+    bl_label = "Apply sleep settings to custom particle system"
+    bl_description = "let particles that stay still sleep until something touches them"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        p_system.sleep.enabled = context.scene.sleep_enabled
+        p_system.sleep.velocity_threshold = context.scene.sleep_velocity_threshold
+        p_system.sleep.sleep_frames = context.scene.sleep_frames
+        p_system.sleep.reset_sleep()
+        return {'FINISHED'}
+
 class MassSpringSystemOperator(bpy.types.Operator):
     bl_idname = "particle_system.mass_spring_system"
     bl_label = "Create mass spring system"
     bl_description = "create mass spring system"
 
     def execute(self, context):
-        mass_spring_system = particle_system.MassSpringSystem()
+        mass_spring_system = particle_system.MassSpringSystem(row=context.scene.grid_row, col=context.scene.grid_col,
+                                                              pin_pattern=context.scene.grid_pin_pattern.lower())
         return {'FINISHED'}
 
 class ClothMassSpringSystemOperator(bpy.types.Operator):
@@ -184,7 +296,36 @@ class ClothMassSpringSystemOperator(bpy.types.Operator):
     bl_description = "create cloth mass spring system"
 
     def execute(self, context):
-        mass_spring_system = particle_system.MassSpringSystem(advance=True)
+        mass_spring_system = particle_system.MassSpringSystem(advance=True, row=context.scene.grid_row, col=context.scene.grid_col,
+                                                              pin_pattern=context.scene.grid_pin_pattern.lower())
+        return {'FINISHED'}
+
+class MeshSpringSystemOperator(bpy.types.Operator):
+    bl_idname = "particle_system.mesh_spring_system"
+    bl_label = "Create mass spring system from mesh"
+    bl_description = "create mass spring system from the active mesh object"
+
+    def execute(self, context):
+        ob = context.active_object
+        if ob == None or ob.type != 'MESH':
+            self.report({'ERROR'}, "Active object is not a mesh")
+            return {'CANCELLED'}
+        mesh_spring_system = particle_system.MeshSpringSystem(ob, pin_group_name=context.scene.pin_vertex_group)
+        return {'FINISHED'}
+
+class ProxyMeshSpringSystemOperator(bpy.types.Operator):
+    bl_idname = "particle_system.proxy_mesh_spring_system"
+    bl_label = "Create coarse proxy system from mesh"
+    bl_description = "simulate a coarse proxy of the active mesh object, playback moves the mesh with it"
+
+    def execute(self, context):
+        ob = context.active_object
+        if ob == None or ob.type != 'MESH':
+            self.report({'ERROR'}, "Active object is not a mesh")
+            return {'CANCELLED'}
+        proxy_spring_system = particle_system.ProxyMeshSpringSystem(ob, cell_size=context.scene.proxy_cell_size,
+                                                                    pin_group_name=context.scene.pin_vertex_group)
+        self.report({'INFO'}, "{} vertices simulated with {} particles".format(len(ob.data.vertices), len(proxy_spring_system.cloth_proxy.location)))
         return {'FINISHED'}
 
 class RemoveForceOperator(bpy.types.Operator):
@@ -195,7 +336,7 @@ class RemoveForceOperator(bpy.types.Operator):
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
         force_idx = int(context.scene.force_name)
-        p_system.force_list.pop(force_idx)
+        p_system.remove_force(force_idx)
         return {'FINISHED'}
 
 class RemoveConstraintOperator(bpy.types.Operator):
@@ -206,7 +347,7 @@ class RemoveConstraintOperator(bpy.types.Operator):
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
         constraint_idx = int(context.scene.constraint_name)
-        p_system.constraint_list.pop(constraint_idx)
+        p_system.remove_constraint(constraint_idx)
         return {'FINISHED'}
 
 
@@ -221,7 +362,7 @@ class AddWallCollisionOperator(bpy.types.Operator):
         if current_collection == None:
             current_collection = utils.create_collection(context.scene.collection, "Collision")
         plane_ob = utils.create_plane(current_collection, 'Wall collision', Vector((0.0, 0.0, -4.0)))
-        wall_collision = collision.WallCollision(plane_ob)
+        wall_collision = collision.WallCollision(plane_ob, context.scene.collision_continuous)
         p_system.add_collision(wall_collision)
         return {'FINISHED'}
 
@@ -232,7 +373,55 @@ class AddParticleCollisionOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
-        p_system.add_collision(collision.ParticleCollision())
+        p_system.add_collision(collision.ParticleCollision(context.scene.collision_continuous))
+        return {'FINISHED'}
+
+class AddMeshCollisionOperator(bpy.types.Operator):
+    bl_idname = "collision.mesh"
+    bl_label = "Add mesh collision"
+    bl_description = "add collision with the surface of the active mesh"
+
+    def execute(self, context):
+        ob = context.active_object
+        if ob == None or ob.type != 'MESH':
+            self.report({'ERROR'}, "Active object is not a mesh")
+            return {'CANCELLED'}
+        p_system = particle_system.ParticleSystem.get_instance()
+        p_system.add_collision(collision.MeshCollision(ob, context.scene.mesh_collision_thickness))
+        return {'FINISHED'}
+
+class AddEmitterOperator(bpy.types.Operator):
+    bl_idname = "emitter.add"
+    bl_label = "Add emitter"
+    bl_description = "add particle emitter at the 3D cursor or on the active mesh"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        scene = context.scene
+        emitter_kwargs = {'rate': scene.emitter_rate, 'lifetime': scene.emitter_lifetime, 'velocity': tuple(scene.emitter_velocity),
+                          'velocity_spread': scene.emitter_velocity_spread}
+        if scene.emitter_type == 'POINT':
+            p_system.add_emitter(emitter.PointEmitter(tuple(scene.cursor.location), **emitter_kwargs))
+        elif scene.emitter_type == 'VOLUME':
+            p_system.add_emitter(emitter.VolumeEmitter(tuple(scene.cursor.location), (2.0, 2.0, 2.0), **emitter_kwargs))
+        elif scene.emitter_type == 'MESH':
+            ob = context.active_object
+            if ob == None or ob.type != 'MESH':
+                self.report({'ERROR'}, "Active object is not a mesh")
+                return {'CANCELLED'}
+            p_system.add_emitter(emitter.MeshSurfaceEmitter(ob, **emitter_kwargs))
+        if p_system.pool.capacity != scene.pool_capacity:
+            p_system.set_pool_capacity(scene.pool_capacity)
+        return {'FINISHED'}
+
+class ClearEmittersOperator(bpy.types.Operator):
+    bl_idname = "emitter.clear"
+    bl_label = "Clear emitters"
+    bl_description = "remove every emitter"
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        p_system.emitter_list = []
         return {'FINISHED'}
 
 class AddAngularConstraintOperator(bpy.types.Operator):
@@ -242,9 +431,12 @@ class AddAngularConstraintOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
-        axis_particle_idx = int(bpy.context.scene.axis_particle_idx)
-        pair_particle_1_idx = int(bpy.context.scene.pair_particle_1_idx)
-        pair_particle_2_idx = int(bpy.context.scene.pair_particle_2_idx)
+        axis_particle_idx = bpy.context.scene.axis_particle_idx
+        pair_particle_1_idx = bpy.context.scene.pair_particle_1_idx
+        pair_particle_2_idx = bpy.context.scene.pair_particle_2_idx
+        if max(axis_particle_idx, pair_particle_1_idx, pair_particle_2_idx) >= len(p_system.init_particle_list):
+            self.report({'ERROR'}, "Angular constraint particles out of range")
+            return {'CANCELLED'}
         angular_constraint = constraint.AngularConstraint()
         angular_constraint.axis_particle_idx = axis_particle_idx
         angular_constraint.pair_particle_idx = pair_particle_1_idx, pair_particle_2_idx
@@ -258,9 +450,10 @@ class SaveInitParticleSystemOperator(bpy.types.Operator):
     bl_description = "save init particle system"
 
     filepath = bpy.props.StringProperty(subtype="FILE_PATH")
+    compact = bpy.props.BoolProperty(name="Compact", default=True, description="Store particles and index tables in a .npz next to the json")
 
     def execute(self, context):
-        particle_system.ParticleSystem.save_init_system(self.filepath)
+        particle_system.ParticleSystem.save_init_system(self.filepath, self.compact)
         return {'FINISHED'}
 
     def invoke(self, context, event): # See comments at end  [1]
@@ -291,6 +484,7 @@ class SaveParticleSystemAnimationOperator(bpy.types.Operator):
 
     def execute(self, context):
         p_system = particle_system.ParticleSystem.get_instance()
+        sync_profiler(p_system, context)
         p_system.save_animation(self.directory)
         return {'FINISHED'}
 
@@ -314,6 +508,126 @@ class LoadParticleSystemAnimationOperator(bpy.types.Operator):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
 
+class PlaybackParticleSystemAnimationOperator(bpy.types.Operator):
+    bl_idname = "particle_system.playback_animation"
+    bl_label = "Playback particle system animation"
+    bl_description = "stream particle system animation from cache while scrubbing"
+
+    directory = bpy.props.StringProperty(subtype="DIR_PATH")
+
+    def execute(self, context):
+        particle_system.AnimationPlayback.start(self.directory)
+        return {'FINISHED'}
+
+    def invoke(self, context, event): # See comments at end  [1]
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class StopParticleSystemPlaybackOperator(bpy.types.Operator):
+    bl_idname = "particle_system.stop_playback"
+    bl_label = "Stop particle system playback"
+    bl_description = "stop streaming particle system animation from cache"
+
+    def execute(self, context):
+        particle_system.AnimationPlayback.stop()
+        return {'FINISHED'}
+
+class ResetProfileOperator(bpy.types.Operator):
+    bl_idname = "particle_system.reset_profile"
+    bl_label = "Reset simulation profile"
+    bl_description = "clear accumulated simulation stage timings"
+
+    def execute(self, context):
+        particle_system.ParticleSystem.get_instance().profiler.reset()
+        return {'FINISHED'}
+
+class SaveProfileOperator(bpy.types.Operator):
+    bl_idname = "particle_system.save_profile"
+    bl_label = "Save simulation profile"
+    bl_description = "dump simulation stage timings to json"
+
+    filepath = bpy.props.StringProperty(subtype="FILE_PATH")
+
+    def execute(self, context):
+        particle_system.ParticleSystem.get_instance().profiler.save(self.filepath)
+        return {'FINISHED'}
+
+    def invoke(self, context, event): # See comments at end  [1]
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class SaveFrameHashOperator(bpy.types.Operator):
+    bl_idname = "particle_system.save_frame_hash"
+    bl_label = "Save frame hashes"
+    bl_description = "save the state hash of every frame of the last bake or frame calculation"
+
+    filepath = bpy.props.StringProperty(subtype="FILE_PATH")
+
+    def execute(self, context):
+        particle_system.ParticleSystem.get_instance().save_frame_hash(self.filepath)
+        return {'FINISHED'}
+
+    def invoke(self, context, event): # See comments at end  [1]
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class CompareFrameHashOperator(bpy.types.Operator):
+    bl_idname = "particle_system.compare_frame_hash"
+    bl_label = "Compare frame hashes"
+    bl_description = "compare the frames of the last bake or frame calculation with saved frame hashes or a bake directory"
+
+    filepath = bpy.props.StringProperty(subtype="FILE_PATH")
+
+    def execute(self, context):
+        p_system = particle_system.ParticleSystem.get_instance()
+        mismatch_list = cache.compare_frame_hash(p_system.frame_hash_list, cache.read_frame_hash(self.filepath))
+        if len(mismatch_list) == 0:
+            self.report({'INFO'}, "all " + str(len(p_system.frame_hash_list)) + " frames match")
+        else:
+            self.report({'WARNING'}, str(len(mismatch_list)) + " frames differ, first at frame " + str(mismatch_list[0][0]))
+        return {'FINISHED'}
+
+    def invoke(self, context, event): # See comments at end  [1]
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class SubmitBakeJobOperator(bpy.types.Operator):
+    bl_idname = "particle_system.submit_bake_job"
+    bl_label = "Submit bake job"
+    bl_description = "save the particle system to the bake queue to be baked by a worker process"
+
+    def execute(self, context):
+        if context.scene.bake_queue_dir == '':
+            self.report({'WARNING'}, "set a bake queue directory first")
+            return {'CANCELLED'}
+        if particle_system.ParticleSystem.instance == None:
+            self.report({'WARNING'}, "no particle system to bake")
+            return {'CANCELLED'}
+        queue = bake_queue.BakeQueue(bpy.path.abspath(context.scene.bake_queue_dir))
+        job_id = queue.new_job_id()
+        particle_system.ParticleSystem.save_init_system(queue.get_scene_filepath(job_id))
+        queue.submit(queue.get_scene_filepath(job_id), None, context.scene.frame_start, context.scene.frame_end,
+                     profile=context.scene.profile_simulation, job_id=job_id)
+        self.report({'INFO'}, "submitted bake job " + job_id)
+        return {'FINISHED'}
+
+class StartBakeWorkersOperator(bpy.types.Operator):
+    bl_idname = "particle_system.start_bake_workers"
+    bl_label = "Start bake workers"
+    bl_description = "start worker processes that bake the queued jobs, they exit when the queue is empty"
+
+    # Kept so finished workers are reaped
+    worker_process_list = []
+
+    def execute(self, context):
+        if context.scene.bake_queue_dir == '':
+            self.report({'WARNING'}, "set a bake queue directory first")
+            return {'CANCELLED'}
+        StartBakeWorkersOperator.worker_process_list = [process for process in StartBakeWorkersOperator.worker_process_list if process.poll() == None]
+        StartBakeWorkersOperator.worker_process_list += bake_queue.start_workers(bpy.path.abspath(context.scene.bake_queue_dir),
+                                                                                 context.scene.bake_worker_count)
+        return {'FINISHED'}
+
 class ParticleSimulationPanel(bpy.types.Panel):
     bl_idname = "PARTICLE_PT_SIMULATION"
     bl_label = "particle simulation panel"
@@ -330,6 +644,19 @@ class ParticleSimulationPanel(bpy.types.Panel):
         row.prop(context.scene, "solver_name", text="Solver")
         row.operator('apply.solver', text="Apply")
         row.separator()
+        row = layout.row()
+        row.prop(context.scene, "backend_name", text="Backend")
+        row.prop(context.scene, "num_threads", text="Threads")
+        row.prop(context.scene, "num_processes", text="Processes")
+        row.prop(context.scene, "neighbor_skin", text="Skin")
+        row.prop(context.scene, "precision_name", text="")
+        row.prop(context.scene, "deterministic", text="Deterministic")
+        row.operator('apply.backend', text="Apply")
+        row = layout.row()
+        row.prop(context.scene, "sleep_enabled", text="Sleep")
+        row.prop(context.scene, "sleep_velocity_threshold", text="Speed")
+        row.prop(context.scene, "sleep_frames", text="Frames")
+        row.operator('apply.sleep', text="Apply")
 
         row = layout.row()
         row.operator('delete_system.particle', text="Delete particle system")
@@ -341,12 +668,27 @@ class ParticleSimulationPanel(bpy.types.Panel):
         row.label(text='Particle system animation')
         row.operator('particle_system.save_animation', text="Save animation")
         row.operator('particle_system.load_animation', text="Load animation")
+        row = layout.row()
+        if particle_system.AnimationPlayback.is_playing():
+            row.operator('particle_system.stop_playback', text="Stop playback")
+        else:
+            row.operator('particle_system.playback_animation', text="Playback from cache")
 
         row = layout.row()
         row.operator('particle.calculate_frame', text="Calculate animation")
         row = layout.row()
+        row.prop(context.scene, "grid_row", text="Rows")
+        row.prop(context.scene, "grid_col", text="Cols")
+        row.prop(context.scene, "grid_pin_pattern", text="Pins")
+        row = layout.row()
         row.operator('particle_system.mass_spring_system', text="Mass spring system")
         row.operator('particle_system.cloth_mass_spring_system', text="Cloth system")
+        row = layout.row()
+        row.prop(context.scene, "pin_vertex_group", text="Pin group")
+        row.operator('particle_system.mesh_spring_system', text="Mesh system")
+        row = layout.row()
+        row.prop(context.scene, "proxy_cell_size", text="Proxy cell")
+        row.operator('particle_system.proxy_mesh_spring_system', text="Proxy mesh system")
 
 class ParticleManagePanel(bpy.types.Panel):
     bl_parent_id = "PARTICLE_PT_SIMULATION"
@@ -360,16 +702,36 @@ class ParticleManagePanel(bpy.types.Panel):
         # scene = context.scene
 
         row = layout.row()
+        row.prop(context.scene, 'add_particle_count', text="Count")
         row.operator('add.particle', text="add particle")
         row = layout.row()
         row.separator()
         row.prop(context.scene, 'select_particle_idx', text="Particle")
-        if context.scene.select_particle_idx != "None":
-            p_system = particle_system.ParticleSystem.get_instance()
-            particle_idx = int(context.scene.select_particle_idx)
-            if particle_idx < len(p_system.init_particle_list):
-                p_system.draw(context, layout, particle_idx)
-                row.operator('remove.particle', text="remove particle")
+        row.operator('particle.pick', text="", icon='EYEDROPPER').target = 'select_particle_idx'
+        p_system = particle_system.ParticleSystem.get_instance()
+        particle_idx = context.scene.select_particle_idx
+        if particle_idx < len(p_system.init_particle_list):
+            p_system.draw(context, layout, particle_idx)
+            row.operator('remove.particle', text="remove particle")
+
+        box = layout.box()
+        row = box.row()
+        row.label(text="Batch edit")
+        row.prop(context.scene, 'batch_particle_source', text="")
+        if context.scene.batch_particle_source == 'RANGE':
+            row.prop(context.scene, 'batch_particle_range', text="")
+        row = box.row()
+        row.prop(context.scene, 'batch_edit_location', text="")
+        row.prop(context.scene, 'batch_location', text="Location")
+        row = box.row()
+        row.prop(context.scene, 'batch_edit_velocity', text="")
+        row.prop(context.scene, 'batch_velocity', text="Velocity")
+        row = box.row()
+        row.prop(context.scene, 'batch_edit_mass', text="")
+        row.prop(context.scene, 'batch_mass', text="Mass")
+        row = box.row()
+        row.prop(context.scene, 'batch_edit_mode', text="")
+        row.operator('particle.batch_edit', text="Apply")
 
 
 class ForceManagePanel(bpy.types.Panel):
@@ -389,8 +751,23 @@ class ForceManagePanel(bpy.types.Panel):
         row.operator('apply_damping_force.particle', text="Add damping force")
         row = layout.row()
         row.prop(context.scene, 'spring_particle_idx', text="spring particle")
+        row.operator('particle.pick', text="", icon='EYEDROPPER').target = 'spring_particle_idx'
         row.operator('apply_spring_force.particle', text="Add spring force")
         row = layout.row()
+        row.prop(context.scene, 'n_body_strength', text="Strength")
+        row.prop(context.scene, 'n_body_softening', text="Softening")
+        row = layout.row()
+        row.prop(context.scene, 'n_body_method', text="")
+        row.prop(context.scene, 'n_body_theta', text="Theta")
+        row.operator('apply_n_body_force.particle', text="Add n-body force")
+        row = layout.row()
+        row.prop(context.scene, 'fluid_smoothing_length', text="Radius")
+        row.prop(context.scene, 'fluid_rest_density', text="Density")
+        row = layout.row()
+        row.prop(context.scene, 'fluid_stiffness', text="Stiffness")
+        row.prop(context.scene, 'fluid_viscosity', text="Viscosity")
+        row.operator('apply_sph_fluid_force.particle', text="Add fluid force")
+        row = layout.row()
         row.separator()
         row.prop(context.scene, 'force_name', text="force list")
         if context.scene.force_name != "None":
@@ -414,6 +791,105 @@ class CollisionManagePanel(bpy.types.Panel):
         row = layout.row()
         row.operator('collision.wall', text="Wall collision")
         row.operator('collision.particle', text="Particle collision")
+        row.prop(context.scene, "collision_continuous", text="Continuous")
+        row = layout.row()
+        row.operator('collision.mesh', text="Mesh collision")
+        row.prop(context.scene, "mesh_collision_thickness", text="Thickness")
+
+class EmitterManagePanel(bpy.types.Panel):
+    bl_parent_id = "PARTICLE_PT_SIMULATION"
+    bl_label = "Emitter management"
+    bl_category = "Particle System"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+
+    def draw(self, context):
+        layout = self.layout
+        p_system = particle_system.ParticleSystem.get_instance()
+
+        row = layout.row()
+        row.prop(context.scene, "emitter_type", text="Type")
+        row.prop(context.scene, "pool_capacity", text="Pool")
+        row = layout.row()
+        row.prop(context.scene, "emitter_rate", text="Rate")
+        row.prop(context.scene, "emitter_lifetime", text="Lifetime")
+        row = layout.row()
+        row.prop(context.scene, "emitter_velocity", text="Velocity")
+        row.prop(context.scene, "emitter_velocity_spread", text="Spread")
+        row = layout.row()
+        row.operator('emitter.add', text="Add emitter")
+        row.operator('emitter.clear', text="Clear emitters")
+        for emitter_item in p_system.emitter_list:
+            emitter_item.draw(context, layout)
+
+class ProfilePanel(bpy.types.Panel):
+    bl_parent_id = "PARTICLE_PT_SIMULATION"
+    bl_label = "Simulation profile"
+    bl_category = "Particle System"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+
+    def draw(self, context):
+        layout = self.layout
+        p_system = particle_system.ParticleSystem.get_instance()
+
+        row = layout.row()
+        row.prop(context.scene, 'profile_simulation', text="Profile bake")
+        row.operator('particle_system.reset_profile', text="Reset")
+        row.operator('particle_system.save_profile', text="Save")
+        row = layout.row()
+        row.label(text="Frame hashes: " + str(len(p_system.frame_hash_list)))
+        row.operator('particle_system.save_frame_hash', text="Save")
+        row.operator('particle_system.compare_frame_hash', text="Compare")
+
+        if p_system.sleep.enabled and len(p_system.sleep.awake_count_list) > 0:
+            row = layout.row()
+            row.label(text="Awake particles: " + str(p_system.sleep.awake_count_list[-1]) + " / " + str(len(p_system.particle_list)))
+
+        stage_table = p_system.profiler.get_table()
+        if len(stage_table) == 0:
+            return
+        column = layout.column(align=True)
+        row = column.row()
+        row.label(text="Stage")
+        row.label(text="Calls")
+        row.label(text="Total ms")
+        row.label(text="Mean ms")
+        for name, calls, seconds, mean_seconds in stage_table:
+            row = column.row()
+            row.label(text=name)
+            row.label(text=str(calls))
+            row.label(text="{:.2f}".format(seconds * 1000.0))
+            row.label(text="{:.4f}".format(mean_seconds * 1000.0))
+
+class BakeQueuePanel(bpy.types.Panel):
+    bl_parent_id = "PARTICLE_PT_SIMULATION"
+    bl_label = "Bake queue"
+    bl_category = "Particle System"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row()
+        row.prop(context.scene, 'bake_queue_dir', text="Queue")
+        row = layout.row()
+        row.operator('particle_system.submit_bake_job', text="Submit")
+        row.prop(context.scene, 'bake_worker_count', text="Workers")
+        row.operator('particle_system.start_bake_workers', text="Start")
+
+        queue_dir = bpy.path.abspath(context.scene.bake_queue_dir)
+        if context.scene.bake_queue_dir == '' or not os.path.isdir(os.path.join(queue_dir, 'pending')):
+            return
+        queue = bake_queue.BakeQueue(queue_dir)
+        row = layout.row()
+        for job_state, job_count in queue.get_status().items():
+            row.label(text=job_state + " " + str(job_count))
+        for job_id in queue.list_jobs('running'):
+            job = queue.get_job('running', job_id)
+            if job != None:
+                row = layout.row()
+                row.label(text=job_id + ": frame " + str(job.get('frame_done', 0)) + " / " + str(job.get('frame_count', '?')))
 
 class ConstraintManagePanel(bpy.types.Panel):
     bl_parent_id = "PARTICLE_PT_SIMULATION"
@@ -428,8 +904,11 @@ class ConstraintManagePanel(bpy.types.Panel):
 
         row = layout.row()
         row.prop(context.scene, 'pair_particle_1_idx', text="Pair particle 1")
+        row.operator('particle.pick', text="", icon='EYEDROPPER').target = 'pair_particle_1_idx'
         row.prop(context.scene, 'axis_particle_idx', text="Axis particle")
+        row.operator('particle.pick', text="", icon='EYEDROPPER').target = 'axis_particle_idx'
         row.prop(context.scene, 'pair_particle_2_idx', text="Pair particle 2")
+        row.operator('particle.pick', text="", icon='EYEDROPPER').target = 'pair_particle_2_idx'
         row.operator('constraint.angular', text="Angular constraint")
 
         row = layout.row()
@@ -443,32 +922,34 @@ class ConstraintManagePanel(bpy.types.Panel):
                 row.operator('constraint.remove', text="remove current constraint")
 
 
-def particle_item_callback(self, context):
+# name -> ((particle system id, revision), items) of the list enums
+enum_item_cache = {}
+
+def get_cached_items(name, item_list_func):
+    # Blender calls item callbacks on every redraw and the strings must outlive the call, the items are
+    # rebuilt only when the particle system revision changed
     p_system = particle_system.ParticleSystem.get_instance()
-    enum_prop_list = []
-    for i, force in enumerate(p_system.init_particle_list):
-        enum_prop_list.append((str(i), str(i), str(i)))
-    if len(enum_prop_list) == 0:
-        enum_prop_list.append(("None", "None", "None"))
-    return enum_prop_list
+    cache_key = (id(p_system), p_system.revision)
+    cache_entry = enum_item_cache.get(name)
+    if cache_entry == None or cache_entry[0] != cache_key:
+        enum_prop_list = item_list_func(p_system)
+        if len(enum_prop_list) == 0:
+            enum_prop_list.append(("None", "None", "None"))
+        cache_entry = (cache_key, enum_prop_list)
+        enum_item_cache[name] = cache_entry
+    return cache_entry[1]
+
+def force_item_list(p_system):
+    return [(str(i), str(i) + " " + type(force).__name__, str(i) + " " + type(force).__name__) for i, force in enumerate(p_system.force_list)]
+
+def constraint_item_list(p_system):
+    return [(str(i), str(i) + " " + type(constraint).__name__, str(i) + " " + type(constraint).__name__) for i, constraint in enumerate(p_system.constraint_list)]
 
 def force_item_callback(self, context):
-    p_system = particle_system.ParticleSystem.get_instance()
-    enum_prop_list = []
-    for i, force in enumerate(p_system.force_list):
-        enum_prop_list.append((str(i), str(i) + " " + type(force).__name__, str(i) + " " + type(force).__name__))
-    if len(enum_prop_list) == 0:
-        enum_prop_list.append(("None", "None", "None"))
-    return enum_prop_list
+    return get_cached_items('force', force_item_list)
 
 def constraint_item_callback(self, context):
-    p_system = particle_system.ParticleSystem.get_instance()
-    enum_prop_list = []
-    for i, constraint in enumerate(p_system.constraint_list):
-        enum_prop_list.append((str(i), str(i) + " " + type(constraint).__name__, str(i) + " " + type(constraint).__name__))
-    if len(enum_prop_list) == 0:
-        enum_prop_list.append(("None", "None", "None"))
-    return enum_prop_list
+    return get_cached_items('constraint', constraint_item_list)
 
 def solver_item_callback(self, context):
     return (
@@ -480,6 +961,18 @@ def solver_item_callback(self, context):
         ('BACKEULER', 'Backward Euler', "Backward euler solver"),
     )
 
+def sync_profiler(p_system, context):
+    # Every bake starts a fresh table when profiling is on
+    p_system.profiler.enabled = context.scene.profile_simulation
+    if p_system.profiler.enabled:
+        p_system.profiler.reset()
+
+def backend_item_callback(self, context):
+    return (
+        ('NUMPY', 'NumPy', "Vectorized numpy kernels"),
+        ('NUMBA', 'Numba' if kernels.HAS_NUMBA else 'Numba (not installed)', "Compiled numba kernels, falls back to numpy when numba is missing"),
+    )
+
 def obj_location_callback(ob):
     # Do something here
     print('Object "{}" changed its location to: {}: '.format(
@@ -492,26 +985,48 @@ def register():
     bpy.utils.register_class(ParticleManagePanel)
     bpy.utils.register_class(ForceManagePanel)
     bpy.utils.register_class(CollisionManagePanel)
+    bpy.utils.register_class(EmitterManagePanel)
     bpy.utils.register_class(ConstraintManagePanel)
+    bpy.utils.register_class(ProfilePanel)
+    bpy.utils.register_class(BakeQueuePanel)
     bpy.utils.register_class(ApplyConstantForceOperator)
     bpy.utils.register_class(ApplyDampingForceOperator)
     bpy.utils.register_class(ApplySpringForceOperator)
+    bpy.utils.register_class(ApplyNBodyForceOperator)
+    bpy.utils.register_class(ApplySPHFluidForceOperator)
     bpy.utils.register_class(CalculateFrameOperator)
     bpy.utils.register_class(AddParticleOperator)
     bpy.utils.register_class(RemoveParticleOperator)
+    bpy.utils.register_class(PickParticleOperator)
+    bpy.utils.register_class(BatchEditParticleOperator)
     bpy.utils.register_class(SyncParticleInitOperator)
     bpy.utils.register_class(ApplySolverOperator)
+    bpy.utils.register_class(ApplyBackendOperator)
+    bpy.utils.register_class(ApplySleepOperator)
     bpy.utils.register_class(MassSpringSystemOperator)
     bpy.utils.register_class(RemoveForceOperator)
     bpy.utils.register_class(RemoveConstraintOperator)
     bpy.utils.register_class(ClothMassSpringSystemOperator)
+    bpy.utils.register_class(MeshSpringSystemOperator)
+    bpy.utils.register_class(ProxyMeshSpringSystemOperator)
     bpy.utils.register_class(AddWallCollisionOperator)
     bpy.utils.register_class(AddParticleCollisionOperator)
+    bpy.utils.register_class(AddMeshCollisionOperator)
+    bpy.utils.register_class(AddEmitterOperator)
+    bpy.utils.register_class(ClearEmittersOperator)
     bpy.utils.register_class(AddAngularConstraintOperator)
     bpy.utils.register_class(SaveInitParticleSystemOperator)
     bpy.utils.register_class(LoadInitParticleSystemOperator)
     bpy.utils.register_class(SaveParticleSystemAnimationOperator)
     bpy.utils.register_class(LoadParticleSystemAnimationOperator)
+    bpy.utils.register_class(PlaybackParticleSystemAnimationOperator)
+    bpy.utils.register_class(StopParticleSystemPlaybackOperator)
+    bpy.utils.register_class(ResetProfileOperator)
+    bpy.utils.register_class(SaveProfileOperator)
+    bpy.utils.register_class(SaveFrameHashOperator)
+    bpy.utils.register_class(CompareFrameHashOperator)
+    bpy.utils.register_class(SubmitBakeJobOperator)
+    bpy.utils.register_class(StartBakeWorkersOperator)
 
     bpy.utils.register_class(custom_prop.ParticleProp)
     bpy.utils.register_class(custom_prop.ConstantForceProp)
@@ -519,19 +1034,91 @@ def register():
     bpy.utils.register_class(custom_prop.SpringForceProp)
     bpy.utils.register_class(custom_prop.AngularConstraintProp)
 
-    bpy.types.Scene.spring_particle_idx = bpy.props.EnumProperty(name="spring_particle_idx", items=particle_item_callback)
+    # Particle indices are plain integers, an enum with one item per particle is rebuilt on every redraw
+    bpy.types.Scene.spring_particle_idx = bpy.props.IntProperty(name="spring_particle_idx", default=0, min=0)
     bpy.types.Scene.solver_name = bpy.props.EnumProperty(name="solver_name", items=solver_item_callback)
+    bpy.types.Scene.backend_name = bpy.props.EnumProperty(name="backend_name", items=backend_item_callback)
+    bpy.types.Scene.num_threads = bpy.props.IntProperty(name="num_threads", default=1, min=1, max=64)
+    bpy.types.Scene.num_processes = bpy.props.IntProperty(name="num_processes", default=1, min=1, max=256,
+                                                          description="Worker processes sharing one bake, each simulates a slab of the particles")
+    bpy.types.Scene.precision_name = bpy.props.EnumProperty(name="precision_name", items=[
+        ("DOUBLE", "Double", "Simulate in float64"),
+        ("SINGLE", "Single", "Simulate in float32, faster and lighter for very large scenes"),
+    ])
+    bpy.types.Scene.deterministic = bpy.props.BoolProperty(name="deterministic", default=False,
+                                                           description="Bitwise reproducible bakes whatever the thread count, a little slower")
+    bpy.types.Scene.neighbor_skin = bpy.props.FloatProperty(name="neighbor_skin", default=0.5, min=0.0,
+                                                            description="Margin of the neighbor lists, larger rebuilds them less often")
+    bpy.types.Scene.add_particle_count = bpy.props.IntProperty(name="add_particle_count", default=1, min=1)
+    bpy.types.Scene.pool_capacity = bpy.props.IntProperty(name="pool_capacity", default=10000, min=0)
+    bpy.types.Scene.emitter_type = bpy.props.EnumProperty(name="emitter_type", items=[
+        ("POINT", "Point", "Emit from the 3D cursor"),
+        ("VOLUME", "Volume", "Emit inside a box around the 3D cursor"),
+        ("MESH", "Mesh surface", "Emit from the surface of the active mesh"),
+    ])
+    bpy.types.Scene.emitter_rate = bpy.props.FloatProperty(name="emitter_rate", default=100.0, min=0.0)
+    bpy.types.Scene.emitter_lifetime = bpy.props.FloatProperty(name="emitter_lifetime", default=2.0, min=0.0)
+    bpy.types.Scene.emitter_velocity = bpy.props.FloatVectorProperty(name="emitter_velocity", size=3, default=(0.0, 0.0, 5.0))
+    bpy.types.Scene.emitter_velocity_spread = bpy.props.FloatProperty(name="emitter_velocity_spread", default=1.0, min=0.0)
+    bpy.types.Scene.sleep_enabled = bpy.props.BoolProperty(name="sleep_enabled", default=False)
+    bpy.types.Scene.sleep_velocity_threshold = bpy.props.FloatProperty(name="sleep_velocity_threshold", default=0.05, min=0.0)
+    bpy.types.Scene.sleep_frames = bpy.props.IntProperty(name="sleep_frames", default=10, min=1)
+    bpy.types.Scene.collision_continuous = bpy.props.BoolProperty(name="collision_continuous", default=False,
+                                                                  description="Sweep particles over the step so fast ones don't pass through")
+    bpy.types.Scene.mesh_collision_thickness = bpy.props.FloatProperty(name="mesh_collision_thickness", default=0.1, min=0.0)
+    bpy.types.Scene.n_body_strength = bpy.props.FloatProperty(name="n_body_strength", default=1.0)
+    bpy.types.Scene.n_body_theta = bpy.props.FloatProperty(name="n_body_theta", default=0.5, min=0.0, max=2.0,
+                                                           description="Opening angle, larger is faster and less accurate")
+    bpy.types.Scene.n_body_softening = bpy.props.FloatProperty(name="n_body_softening", default=0.1, min=0.0)
+    bpy.types.Scene.n_body_method = bpy.props.EnumProperty(name="n_body_method", items=[
+        ("BARNES_HUT", "Barnes-Hut", "Octree approximation"),
+        ("DIRECT", "Direct", "Exact all pairs sum"),
+    ])
+    bpy.types.Scene.fluid_smoothing_length = bpy.props.FloatProperty(name="fluid_smoothing_length", default=2.0, min=0.001)
+    bpy.types.Scene.fluid_rest_density = bpy.props.FloatProperty(name="fluid_rest_density", default=1.0, min=0.0)
+    bpy.types.Scene.fluid_stiffness = bpy.props.FloatProperty(name="fluid_stiffness", default=20.0, min=0.0)
+    bpy.types.Scene.fluid_viscosity = bpy.props.FloatProperty(name="fluid_viscosity", default=0.5, min=0.0)
+    bpy.types.Scene.grid_row = bpy.props.IntProperty(name="grid_row", default=7, min=2)
+    bpy.types.Scene.grid_col = bpy.props.IntProperty(name="grid_col", default=7, min=2)
+    bpy.types.Scene.pin_vertex_group = bpy.props.StringProperty(name="pin_vertex_group", default="pin")
+    bpy.types.Scene.proxy_cell_size = bpy.props.FloatProperty(name="proxy_cell_size", default=1.0, min=0.001,
+                                                              description="Size of the cells the mesh is clustered into, one particle per cell")
+    bpy.types.Scene.grid_pin_pattern = bpy.props.EnumProperty(name="grid_pin_pattern", items=[
+        ("TOP_CORNERS", "Top corners", "Pin the two top corners"),
+        ("TOP_ROW", "Top row", "Pin the whole top row"),
+        ("CORNERS", "Corners", "Pin all four corners"),
+        ("NONE", "None", "No pins"),
+    ])
     bpy.types.Scene.particle_property = bpy.props.PointerProperty(type=custom_prop.ParticleProp)
     bpy.types.Scene.constant_force_vector = bpy.props.PointerProperty(type=custom_prop.ConstantForceProp)
     bpy.types.Scene.damping_constant = bpy.props.PointerProperty(type=custom_prop.DampingForceProp)
     bpy.types.Scene.spring_force = bpy.props.PointerProperty(type=custom_prop.SpringForceProp)
     bpy.types.Scene.angular_constraint = bpy.props.PointerProperty(type=custom_prop.AngularConstraintProp)
-    bpy.types.Scene.axis_particle_idx = bpy.props.EnumProperty(name="axis_particle_idx", items=particle_item_callback)
-    bpy.types.Scene.pair_particle_1_idx = bpy.props.EnumProperty(name="pair_particle_1_idx", items=particle_item_callback)
-    bpy.types.Scene.pair_particle_2_idx = bpy.props.EnumProperty(name="pair_particle_2_idx", items=particle_item_callback)
-    bpy.types.Scene.select_particle_idx = bpy.props.EnumProperty(name="select_particle_idx", items=particle_item_callback)
+    bpy.types.Scene.axis_particle_idx = bpy.props.IntProperty(name="axis_particle_idx", default=0, min=0)
+    bpy.types.Scene.pair_particle_1_idx = bpy.props.IntProperty(name="pair_particle_1_idx", default=0, min=0)
+    bpy.types.Scene.pair_particle_2_idx = bpy.props.IntProperty(name="pair_particle_2_idx", default=0, min=0)
+    bpy.types.Scene.select_particle_idx = bpy.props.IntProperty(name="select_particle_idx", default=0, min=0)
+    bpy.types.Scene.batch_particle_source = bpy.props.EnumProperty(name="batch_particle_source", items=[
+        ("SELECTED", "Selected", "The selected particle objects"),
+        ("RANGE", "Index ranges", "Particle indices such as 0-9, 20, 30-"),
+    ])
+    bpy.types.Scene.batch_particle_range = bpy.props.StringProperty(name="batch_particle_range", default="0-")
+    bpy.types.Scene.batch_edit_mode = bpy.props.EnumProperty(name="batch_edit_mode", items=[
+        ("SET", "Set", "Assign the values"),
+        ("SCALE", "Scale", "Multiply by the values"),
+        ("OFFSET", "Offset", "Add the values"),
+    ])
+    bpy.types.Scene.batch_edit_location = bpy.props.BoolProperty(name="batch_edit_location", default=False)
+    bpy.types.Scene.batch_location = bpy.props.FloatVectorProperty(name="batch_location", size=3)
+    bpy.types.Scene.batch_edit_velocity = bpy.props.BoolProperty(name="batch_edit_velocity", default=False)
+    bpy.types.Scene.batch_velocity = bpy.props.FloatVectorProperty(name="batch_velocity", size=3)
+    bpy.types.Scene.batch_edit_mass = bpy.props.BoolProperty(name="batch_edit_mass", default=False)
+    bpy.types.Scene.batch_mass = bpy.props.FloatProperty(name="batch_mass", default=1.0)
     bpy.types.Scene.force_name = bpy.props.EnumProperty(name="force_name", items=force_item_callback)
     bpy.types.Scene.constraint_name = bpy.props.EnumProperty(name="constraint_name", items=constraint_item_callback)
+    bpy.types.Scene.profile_simulation = bpy.props.BoolProperty(name="profile_simulation", default=False)
+    bpy.types.Scene.bake_queue_dir = bpy.props.StringProperty(name="bake_queue_dir", subtype="DIR_PATH", default="")
+    bpy.types.Scene.bake_worker_count = bpy.props.IntProperty(name="bake_worker_count", default=4, min=1, max=256)
 
 def unregister():
     bpy.utils.unregister_class(DeleteParticleSystemOperator)
@@ -539,26 +1126,49 @@ def unregister():
     bpy.utils.unregister_class(ParticleManagePanel)
     bpy.utils.unregister_class(ForceManagePanel)
     bpy.utils.unregister_class(CollisionManagePanel)
+    bpy.utils.unregister_class(EmitterManagePanel)
     bpy.utils.unregister_class(ConstraintManagePanel)
+    bpy.utils.unregister_class(ProfilePanel)
+    bpy.utils.unregister_class(BakeQueuePanel)
     bpy.utils.unregister_class(ApplyConstantForceOperator)
     bpy.utils.unregister_class(ApplyDampingForceOperator)
     bpy.utils.unregister_class(ApplySpringForceOperator)
+    bpy.utils.unregister_class(ApplyNBodyForceOperator)
+    bpy.utils.unregister_class(ApplySPHFluidForceOperator)
     bpy.utils.unregister_class(CalculateFrameOperator)
     bpy.utils.unregister_class(AddParticleOperator)
     bpy.utils.unregister_class(RemoveParticleOperator)
+    bpy.utils.unregister_class(PickParticleOperator)
+    bpy.utils.unregister_class(BatchEditParticleOperator)
     bpy.utils.unregister_class(SyncParticleInitOperator)
     bpy.utils.unregister_class(ApplySolverOperator)
+    bpy.utils.unregister_class(ApplyBackendOperator)
+    bpy.utils.unregister_class(ApplySleepOperator)
     bpy.utils.unregister_class(MassSpringSystemOperator)
     bpy.utils.unregister_class(RemoveForceOperator)
     bpy.utils.unregister_class(RemoveConstraintOperator)
     bpy.utils.unregister_class(ClothMassSpringSystemOperator)
+    bpy.utils.unregister_class(MeshSpringSystemOperator)
+    bpy.utils.unregister_class(ProxyMeshSpringSystemOperator)
     bpy.utils.unregister_class(AddWallCollisionOperator)
     bpy.utils.unregister_class(AddParticleCollisionOperator)
+    bpy.utils.unregister_class(AddMeshCollisionOperator)
+    bpy.utils.unregister_class(AddEmitterOperator)
+    bpy.utils.unregister_class(ClearEmittersOperator)
     bpy.utils.unregister_class(AddAngularConstraintOperator)
     bpy.utils.unregister_class(SaveInitParticleSystemOperator)
     bpy.utils.unregister_class(LoadInitParticleSystemOperator)
     bpy.utils.unregister_class(SaveParticleSystemAnimationOperator)
     bpy.utils.unregister_class(LoadParticleSystemAnimationOperator)
+    bpy.utils.unregister_class(PlaybackParticleSystemAnimationOperator)
+    bpy.utils.unregister_class(StopParticleSystemPlaybackOperator)
+    bpy.utils.unregister_class(ResetProfileOperator)
+    bpy.utils.unregister_class(SaveProfileOperator)
+    bpy.utils.unregister_class(SaveFrameHashOperator)
+    bpy.utils.unregister_class(CompareFrameHashOperator)
+    bpy.utils.unregister_class(SubmitBakeJobOperator)
+    bpy.utils.unregister_class(StartBakeWorkersOperator)
+    particle_system.AnimationPlayback.stop()
 
 
     bpy.utils.unregister_class(custom_prop.ParticleProp)
@@ -568,19 +1178,63 @@ def unregister():
     bpy.utils.unregister_class(custom_prop.AngularConstraintProp)
 
     del bpy.types.Scene.solver_name
+    del bpy.types.Scene.backend_name
+    del bpy.types.Scene.num_threads
+    del bpy.types.Scene.num_processes
+    del bpy.types.Scene.neighbor_skin
+    del bpy.types.Scene.precision_name
+    del bpy.types.Scene.deterministic
+    del bpy.types.Scene.add_particle_count
+    del bpy.types.Scene.pool_capacity
+    del bpy.types.Scene.emitter_type
+    del bpy.types.Scene.emitter_rate
+    del bpy.types.Scene.emitter_lifetime
+    del bpy.types.Scene.emitter_velocity
+    del bpy.types.Scene.emitter_velocity_spread
+    del bpy.types.Scene.sleep_enabled
+    del bpy.types.Scene.sleep_velocity_threshold
+    del bpy.types.Scene.sleep_frames
+    del bpy.types.Scene.collision_continuous
+    del bpy.types.Scene.mesh_collision_thickness
+    del bpy.types.Scene.n_body_strength
+    del bpy.types.Scene.n_body_theta
+    del bpy.types.Scene.n_body_softening
+    del bpy.types.Scene.n_body_method
+    del bpy.types.Scene.fluid_smoothing_length
+    del bpy.types.Scene.fluid_rest_density
+    del bpy.types.Scene.fluid_stiffness
+    del bpy.types.Scene.fluid_viscosity
+    del bpy.types.Scene.grid_row
+    del bpy.types.Scene.grid_col
+    del bpy.types.Scene.grid_pin_pattern
+    del bpy.types.Scene.pin_vertex_group
+    del bpy.types.Scene.proxy_cell_size
     del bpy.types.Scene.particle_property
     del bpy.types.Scene.constant_force_vector
     del bpy.types.Scene.damping_constant
     del bpy.types.Scene.spring_force
     del bpy.types.Scene.angular_constraint
+    del bpy.types.Scene.spring_particle_idx
     del bpy.types.Scene.axis_particle_idx
     del bpy.types.Scene.pair_particle_1_idx
     del bpy.types.Scene.pair_particle_2_idx
     del bpy.types.Scene.angular_constraint
     del bpy.types.Scene.angular_constraint
     del bpy.types.Scene.select_particle_idx
+    del bpy.types.Scene.batch_particle_source
+    del bpy.types.Scene.batch_particle_range
+    del bpy.types.Scene.batch_edit_mode
+    del bpy.types.Scene.batch_edit_location
+    del bpy.types.Scene.batch_location
+    del bpy.types.Scene.batch_edit_velocity
+    del bpy.types.Scene.batch_velocity
+    del bpy.types.Scene.batch_edit_mass
+    del bpy.types.Scene.batch_mass
     del bpy.types.Scene.force_name
     del bpy.types.Scene.constraint_name
+    del bpy.types.Scene.profile_simulation
+    del bpy.types.Scene.bake_queue_dir
+    del bpy.types.Scene.bake_worker_count
 
 
 if __name__ == "__main__":
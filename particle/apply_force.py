@@ -1,6 +1,12 @@
-import bpy
-from .custom_prop import ConstantForceProp, DampingForceProp, SpringForceProp
-from mathutils import Vector, Matrix
+try:
+    import bpy
+    from .custom_prop import ConstantForceProp, DampingForceProp, SpringForceProp
+except ImportError:
+    # Outside of blender (bake workers) only the simulation is available, see bake_queue.py
+    bpy = None
+from .scene_file import store_array
+from .octree import Octree
+import numpy as np
 
 # Hand made a particle system and attach it to existing particle system in blender
 
@@ -9,7 +15,7 @@ class Force:
     def draw(self, context, layout):
         pass
 
-    def apply_force(self, particle):
+    def apply_force(self, particle_system):
         pass
 
     def save_force(self):
@@ -28,8 +34,9 @@ class ConstantForce(Force):
         row.prop(context.scene.constant_force_vector, "constant_force_vector", text="Force constant")
         ConstantForceProp.constant_force_reference = self
 
-    def apply_force(self, particle):
-        particle.apply_force(Vector(self.force_constant))
+    def apply_force(self, particle_system):
+        force = particle_system.force
+        force += self.force_constant
 
     def save_force(self):
         json_data = {}
@@ -50,11 +57,10 @@ class DampingForce(Force):
         row.prop(context.scene.damping_constant, "damping_constant", text="Damp constant")
         DampingForceProp.damping_force_reference = self
 
-    def apply_force(self, particle):
+    def apply_force(self, particle_system):
         # F = -cv
-        location, velocity = particle.get_state()
-        damped_force = -self.damp_constant[0] * velocity
-        particle.apply_force(damped_force)
+        force = particle_system.force
+        force -= self.damp_constant[0] * particle_system.velocity
 
     def save_force(self):
         json_data = {}
@@ -78,11 +84,10 @@ class SpringForce(Force):
         row.prop(context.scene.spring_force, "spring_rest_location", text="Spring vector")
         SpringForceProp.spring_force_reference = self
 
-    def apply_force(self, particle):
+    def apply_force(self, particle_system):
         #F = k(x – x0)
-        location, velocity = particle.get_state()
-        spring_force = self.spring_constant[0] * (Vector(self.rest_location) - location)
-        particle.apply_force(spring_force)
+        force = particle_system.force
+        force += self.spring_constant[0] * (np.array(self.rest_location) - particle_system.location)
 
     def save_force(self):
         json_data = {}
@@ -102,11 +107,9 @@ class GravityForce(Force):
     def draw(self, context, layout):
         pass
 
-    def apply_force(self, particle):
-        #F = k(x – x0)
-        mass = particle.mass
-        gravity_force = Vector((0.0, 0.0, -mass * self.gravity_constant))
-        particle.apply_force(gravity_force)
+    def apply_force(self, particle_system):
+        # F = mg
+        particle_system.force[:, 2] -= self.gravity_constant * particle_system.mass
 
     def save_force(self):
         json_data = {}
@@ -115,60 +118,316 @@ class GravityForce(Force):
 
 
 class CoherentForce:
+    # Forces that can work on a slab of the particles set domain_split and add their force on the owned rows
+    # of a DomainPart in apply_domain_force, see domain.py. The others run on all particles in the main process
+    domain_split = False
+
     def __init__(self):
         self.coherent_particle_list = []
 
     def apply_force(self, particle_system):
         pass
 
-    def save_force(self, particle_system):
+    def apply_domain_force(self, particle_system, domain_part):
         pass
 
-    def load_force(self, json_data, particle_system):
+    def remap_particles(self, idx_map):
+        return True
+
+    def save_force(self, particle_system, array_dict=None):
+        pass
+
+    def load_force(self, json_data, particle_system, array_dict=None):
         pass
 
 class SpringTwoParticleForce(CoherentForce):
+    # The (E, 2) index array is the spring storage, add_coherent collects into lists that are merged on the next use
+    domain_split = True
+
     def __init__(self):
         super().__init__()
         self.spring_constant = 4.0
         self.rest_length_list = []
-
-    def add_coherent(self, coherent_particle_tuple, rest_length):
-        self.coherent_particle_list.append(coherent_particle_tuple)
-        self.rest_length_list.append(rest_length)
+        self.awake_edge_revision = None
+        self.awake_edge_source = None
+        self.domain_edge_part = None
+
+    @property
+    def coherent_particle_list(self):
+        return list(map(tuple, self.get_edge_array()[0].tolist()))
+
+    @coherent_particle_list.setter
+    def coherent_particle_list(self, coherent_particle_list):
+        self.edge_array = np.array(coherent_particle_list, dtype=np.int64).reshape(-1, 2)
+        self.pending_edge_list = []
+
+    @property
+    def rest_length_list(self):
+        return self.get_edge_array()[1].tolist()
+
+    @rest_length_list.setter
+    def rest_length_list(self, rest_length_list):
+        self.rest_length_array = np.array(rest_length_list, dtype=np.float64).reshape(-1)
+        self.pending_rest_length_list = []
+
+    def add_coherent(self, coherent_particle_idx_tuple, rest_length):
+        self.pending_edge_list.append(coherent_particle_idx_tuple)
+        self.pending_rest_length_list.append(rest_length)
+
+    def add_coherent_array(self, edge_array, rest_length_array):
+        # Bulk add_coherent for (E, 2) index rows, rest_length_array broadcasts against them
+        edge_array = np.asarray(edge_array, dtype=np.int64).reshape(-1, 2)
+        rest_length_array = np.broadcast_to(np.asarray(rest_length_array, dtype=np.float64), (edge_array.shape[0],))
+        old_edge_array, old_rest_length_array = self.get_edge_array()
+        self.edge_array = np.concatenate((old_edge_array, edge_array))
+        self.rest_length_array = np.concatenate((old_rest_length_array, rest_length_array))
+
+    def get_edge_array(self):
+        if len(self.pending_edge_list) > 0:
+            self.edge_array = np.concatenate((self.edge_array, np.array(self.pending_edge_list, dtype=np.int64).reshape(-1, 2)))
+            self.rest_length_array = np.concatenate((self.rest_length_array, np.array(self.pending_rest_length_list, dtype=np.float64)))
+            self.pending_edge_list = []
+            self.pending_rest_length_list = []
+        return self.edge_array, self.rest_length_array
+
+    def remap_particles(self, idx_map):
+        edge_array, rest_length_array = self.get_edge_array()
+        edge_array = idx_map[edge_array]
+        is_kept = (edge_array >= 0).all(axis=1)
+        self.edge_array = edge_array[is_kept]
+        self.rest_length_array = rest_length_array[is_kept]
+        # Dropped once every spring it had is gone
+        return edge_array.shape[0] == 0 or np.any(is_kept)
+
+    def get_awake_edge_array(self, particle_system):
+        # Springs with a sleeping particle at both ends are skipped, cached until the sleeping set or the springs change
+        edge_array, rest_length_array = self.get_edge_array()
+        sleep = particle_system.sleep
+        if self.awake_edge_revision != sleep.revision or self.awake_edge_source is not edge_array:
+            is_asleep = sleep.sleep_mask
+            is_awake_edge = ~(is_asleep[edge_array[:, 0]] & is_asleep[edge_array[:, 1]])
+            self.awake_edge_array = edge_array[is_awake_edge]
+            self.awake_rest_length_array = rest_length_array[is_awake_edge]
+            self.awake_edge_revision = sleep.revision
+            self.awake_edge_source = edge_array
+        return self.awake_edge_array, self.awake_rest_length_array
 
     def apply_force(self, particle_system):
-        #F = k(R – v_l) v/v_l
-        for i in range(len(self.rest_length_list)):
-            particle_1, particle_2 = self.coherent_particle_list[i][0], self.coherent_particle_list[i][1]
-            location_1, _ = particle_1.get_state()
-            location_2, _ = particle_2.get_state()
-            location_vec = location_1 - location_2
-            spring_force = self.spring_constant * (self.rest_length_list[i] - location_vec.length) * location_vec/location_vec.length
-            particle_1.apply_force(spring_force)
-            particle_2.apply_force(-spring_force)
-
-    def save_force(self, particle_system):
+        if particle_system.sleep.is_active():
+            edge_array, rest_length_array = self.get_awake_edge_array(particle_system)
+        else:
+            edge_array, rest_length_array = self.get_edge_array()
+        self.apply_edge_force(particle_system, edge_array, rest_length_array)
+
+    def apply_domain_force(self, particle_system, domain_part):
+        # The springs with an owned end in their order, so every owned row sums the same terms as in apply_force
+        if self.domain_edge_part is not domain_part:
+            edge_array, rest_length_array = self.get_edge_array()
+            is_incident = domain_part.is_owned[edge_array[:, 0]] | domain_part.is_owned[edge_array[:, 1]]
+            self.domain_edge_array = edge_array[is_incident]
+            self.domain_rest_length_array = rest_length_array[is_incident]
+            self.domain_edge_part = domain_part
+        self.apply_edge_force(particle_system, self.domain_edge_array, self.domain_rest_length_array)
+
+    def apply_edge_force(self, particle_system, edge_array, rest_length_array):
+        executor = particle_system.executor
+        chunk_list = executor.split(edge_array.shape[0])
+        if particle_system.deterministic:
+            # Edge forces in chunks, then one scatter in edge order, so the sums are the same for any thread count
+            edge_force = executor.get_buffer('spring_edge_force', 0, (edge_array.shape[0], 3))
+
+            def edge_chunk(chunk_idx, start, end):
+                particle_system.kernels.spring_edge_force(particle_system.location, edge_array[start:end], rest_length_array[start:end],
+                                                          self.spring_constant, edge_force[start:end])
+
+            executor.map(edge_chunk, chunk_list)
+            particle_system.kernels.scatter_edge_force(edge_array, edge_force, particle_system.force)
+            return
+        if len(chunk_list) == 1:
+            particle_system.kernels.spring_force(particle_system.location, edge_array, rest_length_array, self.spring_constant, particle_system.force)
+            return
+
+        # Two edges of a chunk pair can share a particle, so every chunk scatters into its own buffer
+        force = particle_system.force
+
+        def apply_chunk(chunk_idx, start, end):
+            chunk_force = executor.get_buffer('spring_force', chunk_idx, force.shape)
+            chunk_force[:] = 0.0
+            particle_system.kernels.spring_force(particle_system.location, edge_array[start:end], rest_length_array[start:end], self.spring_constant, chunk_force)
+            return chunk_force
+
+        # Summed in chunk order so the result doesn't depend on thread timing
+        for chunk_force in executor.map(apply_chunk, chunk_list):
+            force += chunk_force
+
+    def save_force(self, particle_system, array_dict=None):
         json_data = {}
         json_data['coherent_force_name'] = 'spring_two_particle_force'
+        json_data['spring_constant'] = self.spring_constant
+        if array_dict != None:
+            edge_array, rest_length_array = self.get_edge_array()
+            json_data['edge_array'] = store_array(array_dict, 'edge', edge_array)
+            json_data['rest_length_array'] = store_array(array_dict, 'rest_length', rest_length_array)
+            return json_data
         coherent_particle_list_data = []
-        for i, coherent_particle in enumerate(self.coherent_particle_list):
+        for coherent_particle_idx, rest_length in zip(self.coherent_particle_list, self.rest_length_list):
             coherent_particle_data = {}
-            coherent_particle_data['coherent_particle_idx'] = [particle_system.get_particle_idx(coherent_particle[0]), particle_system.get_particle_idx(coherent_particle[1])]
-            coherent_particle_data['rest_length'] = self.rest_length_list[i]
+            coherent_particle_data['coherent_particle_idx'] = [coherent_particle_idx[0], coherent_particle_idx[1]]
+            coherent_particle_data['rest_length'] = rest_length
             coherent_particle_list_data.append(coherent_particle_data)
         json_data['coherent_particle_list'] = coherent_particle_list_data
-        json_data['spring_constant'] = self.spring_constant
         return json_data
 
-    def load_force(self, json_data, particle_system):
+    def load_force(self, json_data, particle_system, array_dict=None):
         self.rest_length_list = []
         self.coherent_particle_list = []
         self.spring_constant = json_data['spring_constant']
-        for coherent_particle_data in json_data['coherent_particle_list']:
-            coherent_particle = (particle_system.particle_list[coherent_particle_data['coherent_particle_idx'][0]],
-                                 particle_system.particle_list[coherent_particle_data['coherent_particle_idx'][1]])
-            rest_length = coherent_particle_data['rest_length']
-            self.add_coherent(coherent_particle, rest_length)
+        if 'edge_array' in json_data:
+            self.edge_array = np.asarray(array_dict[json_data['edge_array']], dtype=np.int64).reshape(-1, 2)
+            self.rest_length_array = np.asarray(array_dict[json_data['rest_length_array']], dtype=np.float64).reshape(-1)
+            return
+        self.add_coherent_array([coherent_particle_data['coherent_particle_idx'] for coherent_particle_data in json_data['coherent_particle_list']],
+                                [coherent_particle_data['rest_length'] for coherent_particle_data in json_data['coherent_particle_list']])
+
+class NBodyForce(CoherentForce):
+    # Every particle pulls every other one, F_i = strength m_i sum_j m_j r_ij / (|r_ij|^2 + softening^2)^1.5.
+    # The softening length keeps close passes finite, a negative strength repels. 'barnes_hut' treats a far
+    # group of particles as one at its center of mass, a group is far when its size is below theta times
+    # its distance (theta 0 is the exact sum). 'direct' is the all pairs sum to check it against
+    def __init__(self, strength=1.0, theta=0.5, softening=0.1, method='barnes_hut'):
+        super().__init__()
+        self.strength = strength
+        self.theta = theta
+        self.softening = softening
+        self.method = method
+        self.leaf_size = 8
+
+    def apply_force(self, particle_system):
+        # Dead pool rows neither pull nor get pulled
+        alive_idx = particle_system.get_alive_idx()
+        if alive_idx is None:
+            location = particle_system.location
+            mass = particle_system.mass
+        else:
+            location = particle_system.location[alive_idx]
+            mass = particle_system.mass[alive_idx]
+        if location.shape[0] < 2:
+            return
+        field = np.zeros_like(location)
+        if self.method == 'direct':
+            particle_system.kernels.direct_field(location, mass, self.softening, field, particle_system.executor)
+        else:
+            octree = Octree(location, mass, self.leaf_size)
+            particle_system.kernels.barnes_hut_field(octree, self.theta, self.softening, field, particle_system.executor)
+        field *= self.strength * mass[:, None]
+        if alive_idx is None:
+            particle_system.force[:] += field
+        else:
+            particle_system.force[alive_idx] += field
+
+    def save_force(self, particle_system, array_dict=None):
+        json_data = {}
+        json_data['coherent_force_name'] = 'n_body_force'
+        json_data['strength'] = self.strength
+        json_data['theta'] = self.theta
+        json_data['softening'] = self.softening
+        json_data['method'] = self.method
+        return json_data
+
+    def load_force(self, json_data, particle_system, array_dict=None):
+        self.strength = json_data['strength']
+        self.theta = json_data['theta']
+        self.softening = json_data['softening']
+        self.method = json_data['method']
+
+class SPHFluidForce(CoherentForce):
+    # Smoothed particle hydrodynamics after Muller et al. 2003: density from the poly6 kernel, pressure
+    # stiffness * (density - rest_density) pushed through the spiky kernel gradient and viscosity through the
+    # laplacian of the viscosity kernel. Pressure is clamped at 0 as suction clumps the particles. The
+    # neighbors within smoothing_length come from ParticleSystem.neighbor_search once per evaluation and are
+    # shared by the density and force passes
+    domain_split = True
+
+    def __init__(self, smoothing_length=2.0, rest_density=1.0, stiffness=20.0, viscosity=0.5):
+        super().__init__()
+        self.smoothing_length = smoothing_length
+        self.rest_density = rest_density
+        self.stiffness = stiffness
+        self.viscosity = viscosity
+        self.neighbor_list = None
+        self.density = None
+
+    def apply_force(self, particle_system):
+        alive_idx = particle_system.get_alive_idx()
+        fluid_force = self.get_fluid_force(particle_system, alive_idx)
+        if fluid_force is None:
+            return
+        if alive_idx is None:
+            particle_system.force[:] += fluid_force
+        else:
+            particle_system.force[alive_idx] += fluid_force
+
+    def apply_domain_force(self, particle_system, domain_part):
+        # The owned rows need the density of their neighbors, which needs the neighbors of those, so the alive
+        # rows within two smoothing lengths of the owned ones along the split axis take part
+        owned_coordinate = particle_system.location[domain_part.owned_idx, domain_part.axis]
+        if owned_coordinate.shape[0] == 0:
+            return
+        coordinate = particle_system.location[:, domain_part.axis]
+        reach = 2.0 * self.smoothing_length
+        is_region = (coordinate >= owned_coordinate.min() - reach) & (coordinate <= owned_coordinate.max() + reach)
+        alive_idx = particle_system.get_alive_idx()
+        if alive_idx is not None:
+            is_region &= particle_system.state.alive
+        region_idx = np.flatnonzero(is_region)
+        fluid_force = self.get_fluid_force(particle_system, region_idx)
+        is_owned = domain_part.is_owned[region_idx]
+        particle_system.force[region_idx[is_owned]] += fluid_force[is_owned]
+
+    def get_fluid_force(self, particle_system, row_idx):
+        # Force of the rows row_idx (None for all of them) on each other, None without rows
+        if row_idx is None:
+            location = particle_system.location
+            velocity = particle_system.velocity
+            mass = particle_system.mass
+        else:
+            location = particle_system.location[row_idx]
+            velocity = particle_system.velocity[row_idx]
+            mass = particle_system.mass[row_idx]
+        if location.shape[0] == 0:
+            return None
+        kernels = particle_system.kernels
+        self.neighbor_list = particle_system.neighbor_search.get_neighbor_list(particle_system, location, self.smoothing_length, row_idx)
+        self.density = kernels.sph_density(location, mass, self.neighbor_list, self.smoothing_length)
+        pressure = self.stiffness * np.maximum(self.density - self.rest_density, 0.0)
+        fluid_force = np.zeros_like(location)
+        kernels.sph_force(location, velocity, mass, self.density, pressure, self.neighbor_list, self.smoothing_length, self.viscosity, fluid_force)
+        return fluid_force
+
+    def save_force(self, particle_system, array_dict=None):
+        json_data = {}
+        json_data['coherent_force_name'] = 'sph_fluid_force'
+        json_data['smoothing_length'] = self.smoothing_length
+        json_data['rest_density'] = self.rest_density
+        json_data['stiffness'] = self.stiffness
+        json_data['viscosity'] = self.viscosity
+        return json_data
 
-# TODO viscous fluid
+    def load_force(self, json_data, particle_system, array_dict=None):
+        self.smoothing_length = json_data['smoothing_length']
+        self.rest_density = json_data['rest_density']
+        self.stiffness = json_data['stiffness']
+        self.viscosity = json_data['viscosity']
+
+FORCE_TYPES = {
+    'constant_force': ConstantForce,
+    'damping_force': DampingForce,
+    'spring_force': SpringForce,
+    'gravity_force': GravityForce,
+}
+
+COHERENT_FORCE_TYPES = {
+    'spring_two_particle_force': SpringTwoParticleForce,
+    'n_body_force': NBodyForce,
+    'sph_fluid_force': SPHFluidForce,
+}
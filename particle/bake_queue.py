@@ -0,0 +1,256 @@
+from .particle_system import ParticleSystem
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+
+# Bakes of independent scenes on worker processes of one machine. The queue is a directory with one
+# subdirectory per job state and a job is a json file that moves from one to the next. A rename within
+# the queue directory is atomic, so of the workers trying to move a pending job to running exactly one
+# succeeds and owns the job. Workers are plain python processes, no blender, started from the addon
+# directory with
+#   python -m particle.bake_queue QUEUE_DIR --workers 32
+# Jobs are scenes written by ParticleSystem.save_init_system, submitted from the bake queue panel or with
+#   python -m particle.bake_queue QUEUE_DIR --submit scene.json OUTPUT_DIR --frame-start 1 --frame-end 250
+# Each job bakes to its output directory what save_animation writes, running jobs report the frame they
+# are at and finished ones their timings. Scenes with mesh colliders or mesh emitters need blender and fail.
+JOB_STATES = ('pending', 'running', 'done', 'failed')
+# Seconds between two progress writes of a running job
+PROGRESS_INTERVAL = 1.0
+
+
+def write_json(filepath, json_data):
+    # Written next to filepath and renamed over it, readers never see a partial file
+    temp_filepath = filepath + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_filepath, 'w') as fp:
+        json.dump(json_data, fp, indent=2)
+    os.replace(temp_filepath, filepath)
+
+
+def read_json(filepath):
+    # None when the job moved on in between
+    try:
+        with open(filepath, 'r') as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+
+
+class BakeQueue:
+    def __init__(self, queue_dir):
+        self.queue_dir = os.path.abspath(queue_dir)
+        for job_state in JOB_STATES + ('scenes',):
+            os.makedirs(os.path.join(self.queue_dir, job_state), exist_ok=True)
+
+    def get_job_filepath(self, job_state, job_id):
+        return os.path.join(self.queue_dir, job_state, job_id + '.json')
+
+    def get_scene_filepath(self, job_id):
+        # Where scenes submitted from blender are saved
+        return os.path.join(self.queue_dir, 'scenes', job_id + '.json')
+
+    def new_job_id(self):
+        # Sorts in submission order, workers take the oldest pending job first
+        return '{:020d}-{}'.format(time.time_ns(), os.urandom(4).hex())
+
+    def submit(self, scene_filepath, output_dir=None, frame_start=1, frame_end=250, num_threads=1, profile=False, job_id=None):
+        # num_threads per job, a machine full of workers is already busy with one thread each
+        if job_id == None:
+            job_id = self.new_job_id()
+        if output_dir == None:
+            output_dir = os.path.join(self.queue_dir, 'output', job_id)
+        job = {}
+        job['job_id'] = job_id
+        job['scene_filepath'] = os.path.abspath(scene_filepath)
+        job['output_dir'] = os.path.abspath(output_dir)
+        job['frame_start'] = frame_start
+        job['frame_end'] = frame_end
+        job['num_threads'] = num_threads
+        job['profile'] = profile
+        job['submit_time'] = time.time()
+        write_json(self.get_job_filepath('pending', job_id), job)
+        return job_id
+
+    def list_jobs(self, job_state):
+        job_dir = os.path.join(self.queue_dir, job_state)
+        return sorted(filename[:-len('.json')] for filename in os.listdir(job_dir) if filename.endswith('.json'))
+
+    def get_job(self, job_state, job_id):
+        return read_json(self.get_job_filepath(job_state, job_id))
+
+    def get_status(self):
+        # {job state: job count}
+        return {job_state: len(self.list_jobs(job_state)) for job_state in JOB_STATES}
+
+    def claim(self, worker_name):
+        # Oldest pending job moved to running, None when there is nothing left
+        for job_id in self.list_jobs('pending'):
+            running_filepath = self.get_job_filepath('running', job_id)
+            try:
+                os.rename(self.get_job_filepath('pending', job_id), running_filepath)
+            except (FileNotFoundError, PermissionError):
+                # Taken by another worker
+                continue
+            job = read_json(running_filepath)
+            job['worker'] = worker_name
+            job['start_time'] = time.time()
+            job['update_time'] = job['start_time']
+            write_json(running_filepath, job)
+            return job
+        return None
+
+    def update(self, job):
+        job['update_time'] = time.time()
+        write_json(self.get_job_filepath('running', job['job_id']), job)
+
+    def finish(self, job, job_state):
+        # Moves a running job to done or failed
+        job['end_time'] = time.time()
+        write_json(self.get_job_filepath(job_state, job['job_id']), job)
+        os.remove(self.get_job_filepath('running', job['job_id']))
+
+    def requeue_stale(self, timeout=600.0):
+        # Running jobs without progress for timeout seconds, whose worker most likely died, go back to pending.
+        # A single frame must take less than timeout
+        job_id_list = []
+        for job_id in self.list_jobs('running'):
+            job = self.get_job('running', job_id)
+            if job == None or time.time() - job.get('update_time', 0.0) < timeout:
+                continue
+            try:
+                os.rename(self.get_job_filepath('running', job_id), self.get_job_filepath('pending', job_id))
+            except (FileNotFoundError, PermissionError):
+                continue
+            job_id_list.append(job_id)
+        return job_id_list
+
+
+def bake_job(queue, job):
+    # Bakes one claimed job in this process with a fresh particle system
+    start_time = time.perf_counter()
+    ParticleSystem.delete_instance()
+    ParticleSystem.load_init_system(job['scene_filepath'])
+    p_system = ParticleSystem.get_instance()
+    p_system.set_num_threads(job.get('num_threads', 1))
+    p_system.profiler.enabled = job.get('profile', False)
+    setup_seconds = time.perf_counter() - start_time
+
+    job['frame_count'] = max(job['frame_end'] - job['frame_start'], 0)
+    job['frame_done'] = 0
+    bake_start_time = time.perf_counter()
+    last_update_time = bake_start_time
+
+    def report_frame(frame):
+        nonlocal last_update_time
+        job['frame_done'] += 1
+        now = time.perf_counter()
+        if now - last_update_time >= PROGRESS_INTERVAL:
+            job['elapsed_seconds'] = now - bake_start_time
+            queue.update(job)
+            last_update_time = now
+
+    os.makedirs(job['output_dir'], exist_ok=True)
+    try:
+        p_system.save_animation(os.path.join(job['output_dir'], ''), job['frame_start'], job['frame_end'], report_frame)
+    finally:
+        p_system.executor.shutdown()
+    bake_seconds = time.perf_counter() - bake_start_time
+
+    timing = {}
+    timing['setup_seconds'] = setup_seconds
+    timing['bake_seconds'] = bake_seconds
+    timing['frames_per_sec'] = job['frame_count'] / bake_seconds if bake_seconds > 0.0 else 0.0
+    timing['particle_count'] = len(p_system.particle_list)
+    if p_system.profiler.enabled:
+        timing['stages'] = p_system.profiler.to_json()
+    job['timing'] = timing
+    job['elapsed_seconds'] = bake_seconds
+
+
+def run_worker(queue_dir, wait=False, poll_interval=1.0):
+    # Bakes jobs until the queue is empty, or forever with wait. Returns the number of jobs baked
+    queue = BakeQueue(queue_dir)
+    worker_name = platform.node() + ':' + str(os.getpid())
+    job_count = 0
+    while True:
+        job = queue.claim(worker_name)
+        if job == None:
+            if not wait:
+                return job_count
+            time.sleep(poll_interval)
+            continue
+        try:
+            bake_job(queue, job)
+        except Exception:
+            job['error'] = traceback.format_exc()
+            queue.finish(job, 'failed')
+            continue
+        queue.finish(job, 'done')
+        job_count += 1
+
+
+def start_workers(queue_dir, worker_count, wait=False, python_executable=None):
+    # Worker processes running run_worker, returned as subprocess.Popen
+    if python_executable == None:
+        python_executable = sys.executable
+    addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    # One thread per worker, numpy's own threads would oversubscribe the cores
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS'):
+        env[name] = '1'
+    env['PYTHONPATH'] = addon_dir + os.pathsep + env.get('PYTHONPATH', '')
+    command = [python_executable, '-m', 'particle.bake_queue', os.path.abspath(queue_dir)]
+    if wait:
+        command.append('--wait')
+    return [subprocess.Popen(command, cwd=addon_dir, env=env) for worker_idx in range(worker_count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Particle system bake queue')
+    parser.add_argument('queue_dir')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes, 1 bakes in this process')
+    parser.add_argument('--wait', action='store_true', help='keep polling for jobs when the queue is empty')
+    parser.add_argument('--submit', nargs=2, metavar=('SCENE', 'OUTPUT_DIR'), default=None)
+    parser.add_argument('--frame-start', type=int, default=1)
+    parser.add_argument('--frame-end', type=int, default=250)
+    parser.add_argument('--threads', type=int, default=1, help='threads per submitted job')
+    parser.add_argument('--profile', action='store_true', help='record the stage timings of submitted jobs')
+    parser.add_argument('--status', action='store_true')
+    parser.add_argument('--requeue-stale', type=float, default=None, metavar='SECONDS')
+    args = parser.parse_args(argv)
+
+    queue = BakeQueue(args.queue_dir)
+    if args.submit != None:
+        print(queue.submit(args.submit[0], args.submit[1], args.frame_start, args.frame_end, args.threads, args.profile))
+        return 0
+    if args.requeue_stale != None:
+        for job_id in queue.requeue_stale(args.requeue_stale):
+            print('requeued', job_id)
+        return 0
+    if args.status:
+        print(' '.join('{} {}'.format(job_state, job_count) for job_state, job_count in queue.get_status().items()))
+        for job_id in queue.list_jobs('running'):
+            job = queue.get_job('running', job_id)
+            if job != None:
+                print('{} {} frame {}/{}'.format(job_id, job['worker'], job.get('frame_done', 0), job.get('frame_count', '?')))
+        for job_id in queue.list_jobs('done'):
+            job = queue.get_job('done', job_id)
+            print('{} done in {:.2f}s, {:.2f} frames/sec'.format(job_id, job['timing']['bake_seconds'], job['timing']['frames_per_sec']))
+        for job_id in queue.list_jobs('failed'):
+            job = queue.get_job('failed', job_id)
+            print('{} failed: {}'.format(job_id, job['error'].strip().splitlines()[-1]))
+        return 0
+
+    if args.workers <= 1:
+        run_worker(args.queue_dir, args.wait)
+        return 0
+    process_list = start_workers(args.queue_dir, args.workers, args.wait)
+    return max(process.wait() for process in process_list)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,632 @@
+# Benchmark of the simulation hot paths on synthetic scenes, no scene objects are created.
+# Run it inside blender with the addon installed, for example
+#   blender -b --python-expr "import sys; from ParticleSystemAddon.particle import benchmark; benchmark.main(sys.argv[sys.argv.index('--') + 1:])" -- --output result.json
+# and compare two result files with
+#   ... benchmark.main([...]) -- --output new.json --compare old.json
+# --check-backends runs every kernel on both backends and reports the largest difference.
+# --threads 1 2 4 8 repeats every scene per thread count and prints the speedup over the first,
+# --precision double single does the same per precision. --check-drift compares the two precisions on the cloth.
+# --check-determinism runs scenes in deterministic mode on one and on --threads threads and compares every step.
+from .particle_system import ParticleSystem, MassSpringSystem, MeshSpringSystem, ProxyMeshSpringSystem, grid_spring_edges, PRECISION_DTYPES
+from .apply_force import GravityForce, DampingForce, SpringTwoParticleForce, NBodyForce, SPHFluidForce
+from .solver import ForwardEulerSolver, SOLVER_TYPES
+from .constraint import PinConstraint, BatchAngularConstraint, color_triples
+from .collision import ParticleCollision
+from .kernels import NumpyKernels, get_kernels, KERNEL_BACKENDS
+from .parallel import ChunkExecutor
+from .octree import Octree
+from .neighbor import build_neighbor_list
+from .emitter import PointEmitter
+from .cache import compare_frame_hash
+import numpy as np
+import argparse
+import os
+import platform
+import sys
+import time
+import json
+import math
+
+BENCHMARK_VERSION = 1
+STEP = 0.05
+# Largest single vs double precision distance allowed on the cloth scene of check_precision_drift, the
+# 2500 particle cloth spans about 150 units and drifts 1.3e-4 over the 200 steps
+DRIFT_TOLERANCE = 1e-3
+
+
+def build_free_scene(particle_count, seed=0):
+    rng = np.random.default_rng(seed)
+    p_system = ParticleSystem()
+    for location, velocity in zip(rng.uniform(-10.0, 10.0, (particle_count, 3)), rng.uniform(-1.0, 1.0, (particle_count, 3))):
+        p_system.add_particle(location, velocity, (0.0, 0.0, 0.0), 1.0)
+    p_system.add_force(GravityForce())
+    p_system.add_force(DampingForce())
+    p_system.reset_state()
+    return p_system
+
+
+def build_grid_scene(particle_count, spacing=3.0, seed=0):
+    # Square cloth pinned at its two top corners, structural springs only
+    col = max(int(math.ceil(math.sqrt(particle_count))), 2)
+    row = max(int(math.ceil(particle_count / col)), 2)
+    p_system = ParticleSystem()
+    MassSpringSystem(row=row, col=col, spacing=spacing, rest_length=spacing, spring_constant=4.0, create_objects=False, p_system=p_system)
+    p_system.reset_state()
+    return p_system
+
+
+def build_clump_scene(particle_count, seed=0):
+    # Unit mass particles packed so that most of them overlap a neighbour
+    rng = np.random.default_rng(seed)
+    extent = 1.5 * particle_count ** (1.0 / 3.0)
+    p_system = ParticleSystem()
+    for location, velocity in zip(rng.uniform(0.0, extent, (particle_count, 3)), rng.uniform(-1.0, 1.0, (particle_count, 3))):
+        p_system.add_particle(location, velocity, (0.0, 0.0, 0.0), 1.0)
+    p_system.add_force(GravityForce())
+    p_system.add_collision(ParticleCollision())
+    p_system.reset_state()
+    return p_system
+
+
+def build_rope_scene(particle_count, spacing=1.0, seed=0):
+    # Horizontal chains of 100 particles pinned at one end, bending limited by angular constraints
+    rope_length = min(max(particle_count, 3), 100)
+    rope_count = max(particle_count // rope_length, 1)
+    p_system = ParticleSystem()
+    pin_constraint = PinConstraint()
+    structural_force = SpringTwoParticleForce()
+    angular_constraint = BatchAngularConstraint()
+    for rope_idx in range(rope_count):
+        start_idx = len(p_system.init_particle_list)
+        for i in range(rope_length):
+            p_system.add_particle((spacing * i, 2.0 * spacing * rope_idx, 0.0), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 0.5)
+        pin_constraint.add_pin(start_idx, p_system.init_particle_list[start_idx].location)
+        for i in range(rope_length - 1):
+            structural_force.add_coherent((start_idx + i, start_idx + i + 1), spacing)
+        axis_idx_array = start_idx + np.arange(1, rope_length - 1)
+        angular_constraint.add_triple_array(np.stack((axis_idx_array, axis_idx_array - 1, axis_idx_array + 1), axis=1), 2.6, math.pi)
+    p_system.reset_state()
+    p_system.add_constraint(pin_constraint)
+    p_system.add_constraint(angular_constraint)
+    p_system.add_coherent_force(structural_force)
+    p_system.add_force(GravityForce())
+    p_system.add_force(DampingForce())
+    return p_system
+
+
+def build_emit_scene(particle_count, seed=0):
+    # Point emitter filling a pool of particle_count rows, particles expire and get recycled
+    p_system = ParticleSystem()
+    p_system.add_emitter(PointEmitter((0.0, 0.0, 0.0), rate=float(particle_count), lifetime=1.0, lifetime_spread=0.2,
+                                      velocity=(0.0, 0.0, 5.0), velocity_spread=1.0, seed=seed))
+    p_system.add_force(GravityForce())
+    p_system.add_force(DampingForce())
+    p_system.set_pool_capacity(particle_count)
+    return p_system
+
+
+def build_nbody_scene(particle_count, seed=0):
+    # Rotating cloud of unit mass particles pulling on each other
+    rng = np.random.default_rng(seed)
+    location = rng.normal(0.0, 10.0, (particle_count, 3))
+    velocity = 0.05 * np.cross(np.array([0.0, 0.0, 1.0]), location)
+    p_system = ParticleSystem()
+    for particle_location, particle_velocity in zip(location, velocity):
+        p_system.add_particle(particle_location, particle_velocity, (0.0, 0.0, 0.0), 1.0)
+    p_system.add_coherent_force(NBodyForce(strength=0.01, theta=0.5, softening=0.5))
+    p_system.reset_state()
+    return p_system
+
+
+def build_fluid_scene(particle_count, seed=0):
+    # Unit spaced block of fluid at about its rest density falling under gravity
+    rng = np.random.default_rng(seed)
+    side = max(int(math.ceil(particle_count ** (1.0 / 3.0))), 2)
+    location = np.stack(np.meshgrid(np.arange(side), np.arange(side), np.arange(side), indexing='ij'), axis=-1).reshape(-1, 3)[:particle_count]
+    location = location + rng.normal(0.0, 0.05, location.shape)
+    p_system = ParticleSystem()
+    p_system.add_particles(location, 0.0, 1.0)
+    p_system.add_coherent_force(SPHFluidForce(smoothing_length=2.0, rest_density=1.0))
+    p_system.add_force(GravityForce())
+    p_system.reset_state()
+    return p_system
+
+
+SCENE_BUILDERS = {
+    'free': build_free_scene,
+    'grid': build_grid_scene,
+    'clump': build_clump_scene,
+    'rope': build_rope_scene,
+    'emit': build_emit_scene,
+    'nbody': build_nbody_scene,
+    'fluid': build_fluid_scene,
+}
+
+
+def time_call(func, repeat, max_seconds):
+    # Returns the mean seconds per call, stops early once max_seconds is spent
+    call_count = 0
+    start_time = time.perf_counter()
+    elapsed = 0.0
+    while call_count < repeat and (call_count == 0 or elapsed < max_seconds):
+        func()
+        call_count += 1
+        elapsed = time.perf_counter() - start_time
+    return elapsed / call_count, call_count
+
+
+def benchmark_scene(scene_name, particle_count, steps, max_seconds, solver_names, profile=False, backend='numpy', num_threads=1, precision='double'):
+    start_time = time.perf_counter()
+    p_system = SCENE_BUILDERS[scene_name](particle_count)
+    setup_seconds = time.perf_counter() - start_time
+    p_system.set_backend(backend)
+    p_system.set_num_threads(num_threads)
+    p_system.set_precision(precision)
+    result = {
+        'scene': scene_name,
+        'backend': p_system.kernels.name,
+        'num_threads': num_threads,
+        # Threads the chunked passes ran on, the numpy backend runs them inline whatever num_threads is
+        'worker_threads': p_system.executor.num_threads,
+        'precision': p_system.precision,
+        # Emitter scenes start empty, their pool rows are counted
+        'particle_count': len(p_system.particle_list) + p_system.pool.capacity,
+        'setup_seconds': setup_seconds,
+        'stages': {},
+        'solvers': {},
+    }
+
+    # Whole frame step, the same work a bake does per frame
+    p_system.solver = ForwardEulerSolver()
+    p_system.solver.reset_solver(p_system)
+    p_system.profiler.enabled = profile
+    seconds, step_count = time_call(lambda: p_system.simulate_step(STEP), steps, max_seconds)
+    p_system.profiler.enabled = False
+    result['steps_per_sec'] = 1.0 / seconds
+    result['measured_steps'] = step_count
+    result['neighbor_builds'] = p_system.neighbor_search.build_count
+    result['neighbor_reuses'] = p_system.neighbor_search.reuse_count
+    if profile:
+        # Profiled steps carry the timer overhead, steps_per_sec is only comparable between profiled runs
+        result['profile'] = p_system.profiler.to_json()
+
+    p_system.reset_state()
+    result['stages']['derivative_eval'] = time_call(p_system.derivative_eval, steps, max_seconds)[0]
+    result['stages']['get_state'] = time_call(p_system.get_state, steps, max_seconds)[0]
+    particle_state = p_system.get_state()
+    result['stages']['set_state'] = time_call(lambda: p_system.set_state(particle_state), steps, max_seconds)[0]
+    for i, coherent_force in enumerate(p_system.coherent_force_list):
+        stage_name = type(coherent_force).__name__ + '.apply_force[' + str(i) + ']'
+        result['stages'][stage_name] = time_call(lambda: coherent_force.apply_force(p_system), steps, max_seconds)[0]
+    for i, collision in enumerate(p_system.collision_detect_list):
+        stage_name = type(collision).__name__ + '.project_collision[' + str(i) + ']'
+        result['stages'][stage_name] = time_call(lambda: collision.project_collision(p_system), steps, max_seconds)[0]
+
+    for solver_name in solver_names:
+        p_system.reset_state()
+        p_system.solver = SOLVER_TYPES[solver_name]()
+        p_system.solver.reset_solver(p_system)
+        result['solvers'][solver_name] = time_call(lambda: p_system.solver.solve_step(p_system, STEP), steps, max_seconds)[0]
+
+    p_system.executor.shutdown()
+    return result
+
+
+def run_benchmark(scene_sizes, steps=10, max_seconds=5.0, solver_names=None, profile=False, backend='numpy', log=print, thread_counts=(1,),
+                  precisions=('double',)):
+    if solver_names == None:
+        solver_names = list(SOLVER_TYPES.keys())
+    results = []
+    for scene_name, particle_counts in scene_sizes.items():
+        for particle_count in particle_counts:
+            for num_threads in thread_counts:
+                for precision in precisions:
+                    log('benchmark ' + scene_name + ' ' + str(particle_count) + ' threads ' + str(num_threads) + ' ' + precision)
+                    results.append(benchmark_scene(scene_name, particle_count, steps, max_seconds, solver_names, profile, backend, num_threads, precision))
+    return {
+        'benchmark_version': BENCHMARK_VERSION,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'steps': steps,
+        'profile': profile,
+        'backend': get_kernels(backend).name,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+
+BACKEND_KERNEL_NAMES = ('spring_force', 'particle_collision', 'swept_particle_collision', 'wall_collision', 'swept_wall_collision',
+                        'angular_constraint', 'angular_constraint_batch', 'direct_field', 'barnes_hut_field', 'sph_force')
+
+
+def build_kernel_inputs(particle_count=500, seed=0):
+    # Seeded inputs of every kernel in BACKEND_KERNEL_NAMES, the same for each backend
+    rng = np.random.default_rng(seed)
+    kernel_inputs = {}
+    kernel_inputs['location'] = rng.uniform(0.0, 1.5 * particle_count ** (1.0 / 3.0), (particle_count, 3))
+    kernel_inputs['velocity'] = rng.uniform(-1.0, 1.0, (particle_count, 3))
+    kernel_inputs['mass'] = rng.uniform(0.5, 1.0, particle_count)
+    kernel_inputs['edge_array'] = rng.integers(0, particle_count, (4 * particle_count, 2))
+    kernel_inputs['rest_length_array'] = rng.uniform(0.5, 2.0, 4 * particle_count)
+    kernel_inputs['wall_location'] = np.array([0.0, 0.0, 2.0])
+    kernel_inputs['wall_normal'] = np.array([0.0, 0.6, 0.8])
+    # Triples sharing particles, like the joints of a chain
+    triple_array = np.stack((np.arange(1, particle_count - 1), np.arange(0, particle_count - 2), np.arange(2, particle_count)), axis=1)
+    min_angle_array = rng.uniform(0.3, 1.5, particle_count - 2)
+    max_angle_array = min_angle_array + rng.uniform(0.0, 1.0, particle_count - 2)
+    order, kernel_inputs['batch_bounds'] = color_triples(triple_array)
+    kernel_inputs['triple_array'] = triple_array[order]
+    kernel_inputs['min_angle_array'] = min_angle_array[order]
+    kernel_inputs['max_angle_array'] = max_angle_array[order]
+    # Where the particles were a large step earlier, so that the swept kernels see crossings
+    kernel_inputs['previous_location'] = kernel_inputs['location'] - 0.5 * kernel_inputs['velocity']
+    kernel_inputs['octree'] = Octree(kernel_inputs['location'], kernel_inputs['mass'])
+    return kernel_inputs
+
+
+def run_kernel(kernels, name, kernel_inputs, executor):
+    # (particle count, 9) location, velocity and force after one call of the kernel on copies of the inputs
+    location = kernel_inputs['location']
+    velocity = kernel_inputs['velocity']
+    mass = kernel_inputs['mass']
+    previous_location = kernel_inputs['previous_location']
+    particle_count = location.shape[0]
+    kernel_location = location.copy()
+    kernel_velocity = velocity.copy()
+    kernel_force = np.zeros((particle_count, 3))
+    if name == 'spring_force':
+        kernels.spring_force(kernel_location, kernel_inputs['edge_array'], kernel_inputs['rest_length_array'], 4.0, kernel_force)
+    elif name == 'particle_collision':
+        kernels.particle_collision(kernel_location, kernel_velocity, mass, executor)
+    elif name == 'swept_particle_collision':
+        kernels.swept_particle_collision(previous_location, kernel_location, kernel_velocity, mass, 0.5, executor)
+    elif name == 'wall_collision':
+        kernels.wall_collision(kernel_location, kernel_velocity, kernel_inputs['wall_location'], kernel_inputs['wall_normal'])
+    elif name == 'swept_wall_collision':
+        kernels.swept_wall_collision(previous_location, kernel_location, kernel_velocity, kernel_inputs['wall_location'], kernel_inputs['wall_normal'])
+    elif name == 'angular_constraint':
+        for i in range(0, particle_count - 2, 3):
+            kernels.angular_constraint(kernel_location, i, i + 1, i + 2, 0.3, 0.9)
+    elif name == 'angular_constraint_batch':
+        kernels.angular_constraint_batch(kernel_location, kernel_inputs['triple_array'], kernel_inputs['min_angle_array'],
+                                         kernel_inputs['max_angle_array'], kernel_inputs['batch_bounds'], 0.5)
+    elif name == 'direct_field':
+        kernels.direct_field(kernel_location, mass, 0.1, kernel_force, executor)
+    elif name == 'barnes_hut_field':
+        kernels.barnes_hut_field(kernel_inputs['octree'], 0.5, 0.1, kernel_force, executor)
+    elif name == 'sph_force':
+        # Each backend finds its own neighbors, the pair order differs but not the sums
+        neighbor_list = build_neighbor_list(kernels, location, 1.5, executor)
+        density = kernels.sph_density(location, mass, neighbor_list, 1.5)
+        kernels.sph_force(location, velocity, mass, density, 10.0 * np.maximum(density - 1.0, 0.0), neighbor_list, 1.5, 0.5, kernel_force)
+    return np.hstack((kernel_location, kernel_velocity, kernel_force))
+
+
+def check_backends(particle_count=500, seed=0):
+    # Largest absolute difference of every kernel between numpy and the compiled backend,
+    # the compiled particle collision runs its contact search split over chunks
+    compiled_kernels = get_kernels('numba')
+    if compiled_kernels is NumpyKernels:
+        return None
+    kernel_inputs = build_kernel_inputs(particle_count, seed)
+    executor = ChunkExecutor(4, min_chunk_size=64)
+    difference_dict = {}
+    for name in BACKEND_KERNEL_NAMES:
+        output_list = [run_kernel(kernels, name, kernel_inputs, executor) for kernels in (NumpyKernels, compiled_kernels)]
+        difference_dict[name] = float(np.abs(output_list[0] - output_list[1]).max())
+    executor.shutdown()
+    return difference_dict
+
+
+def check_precision_drift(particle_count=2500, steps=200, solver_name='fourth_order_rk_solver', backend='numpy'):
+    # Runs the cloth scene in double and single precision from the same start and returns the largest and
+    # the root mean square distance between the two, also relative to the size of the cloth
+    location_list = []
+    for precision in ('double', 'single'):
+        p_system = build_grid_scene(particle_count)
+        p_system.set_backend(backend)
+        p_system.set_precision(precision)
+        p_system.solver = SOLVER_TYPES[solver_name]()
+        p_system.solver.reset_solver(p_system)
+        for step_idx in range(steps):
+            p_system.simulate_step(STEP)
+        location_list.append(p_system.location.astype(np.float64))
+    distance = np.sqrt(np.einsum('ij,ij->i', location_list[0] - location_list[1], location_list[0] - location_list[1]))
+    extent = float((location_list[0].max(axis=0) - location_list[0].min(axis=0)).max())
+    return {
+        'steps': steps,
+        'max_distance': float(distance.max()),
+        'rms_distance': float(np.sqrt(np.mean(distance ** 2))),
+        'relative_max_distance': float(distance.max()) / max(extent, 1e-12),
+    }
+
+
+def check_determinism(scene_sizes, steps=50, num_threads=4, backend='numpy', solver_name='fourth_order_rk_solver'):
+    # {scene: [(step, hash, other hash)]} of the steps whose state differs between a serial and a threaded
+    # run in deterministic mode, empty lists when the runs are bitwise equal
+    mismatch_dict = {}
+    for scene_name, particle_count in scene_sizes.items():
+        frame_hash_list_pair = []
+        for thread_count in (1, num_threads):
+            p_system = SCENE_BUILDERS[scene_name](particle_count)
+            p_system.set_backend(backend)
+            p_system.set_num_threads(thread_count)
+            # Small chunks so that every chunked pass is actually split at these sizes
+            p_system.executor.min_chunk_size = 256
+            p_system.set_deterministic(True)
+            p_system.solver = SOLVER_TYPES[solver_name]()
+            p_system.solver.reset_solver(p_system)
+            p_system.record_frame_hash(0)
+            for step_idx in range(steps):
+                p_system.simulate_step(STEP)
+                p_system.record_frame_hash(step_idx + 1)
+            p_system.executor.shutdown()
+            frame_hash_list_pair.append(p_system.frame_hash_list)
+        mismatch_dict[scene_name] = compare_frame_hash(*frame_hash_list_pair)
+    return mismatch_dict
+
+
+def check_domain(scene_sizes, steps=20, num_processes=2, backend='numpy', solver_name='fourth_order_rk_solver'):
+    # {scene: [(step, hash, other hash)]} of the steps whose state differs between a bake in this process
+    # and a domain decomposed bake over num_processes workers, both in deterministic mode
+    mismatch_dict = {}
+    for scene_name, particle_count in scene_sizes.items():
+        frame_hash_list_pair = []
+        for process_count in (1, num_processes):
+            p_system = SCENE_BUILDERS[scene_name](particle_count)
+            p_system.set_backend(backend)
+            p_system.set_deterministic(True)
+            p_system.set_num_processes(process_count)
+            p_system.solver = SOLVER_TYPES[solver_name]()
+            p_system.solver.reset_solver(p_system)
+            p_system.record_frame_hash(0)
+            try:
+                p_system.start_domain()
+                for step_idx in range(steps):
+                    p_system.simulate_step(STEP)
+                    p_system.record_frame_hash(step_idx + 1)
+            finally:
+                p_system.stop_domain()
+            frame_hash_list_pair.append(p_system.frame_hash_list)
+        mismatch_dict[scene_name] = compare_frame_hash(*frame_hash_list_pair)
+    return mismatch_dict
+
+
+def check_rebuild(steps=5):
+    # {case: error or None} of the builders run again on the same system with a smaller scene, every case
+    # steps the rebuilt system and checks that nothing of the first build is left
+    error_dict = {}
+    p_system = ParticleSystem()
+    MassSpringSystem(row=7, col=7, advance=True, create_objects=False, p_system=p_system)
+    MassSpringSystem(row=3, col=3, create_objects=False, p_system=p_system)
+    error_dict['grid'] = check_rebuilt_system(p_system, steps, 9, 1)
+
+    p_system = ParticleSystem()
+    mesh_spring_system = MeshSpringSystem(create_objects=False, p_system=p_system)
+    for row, col in ((12, 12), (4, 5)):
+        mesh_spring_system.build(p_system, *build_grid_mesh(row, col))
+    error_dict['mesh'] = check_rebuilt_system(p_system, steps, 20, 2)
+
+    # A finer proxy first, the coarser one has fewer particles
+    p_system = ParticleSystem()
+    proxy_spring_system = ProxyMeshSpringSystem(create_objects=False, p_system=p_system)
+    location_array, edge_array, bending_array, pin_idx_array = build_grid_mesh(20, 20)
+    for cell_size in (2.0, 5.0):
+        proxy_spring_system.build_proxy(p_system, location_array, edge_array, pin_idx_array, cell_size)
+    error_dict['proxy'] = check_rebuilt_system(p_system, steps, 16, 2)
+    if error_dict['proxy'] == None and (p_system.cloth_proxy == None or p_system.cloth_proxy.weight.shape != (400, 16)):
+        error_dict['proxy'] = 'cloth proxy of the first build'
+    return error_dict
+
+
+def build_grid_mesh(row, col, spacing=1.0):
+    # (location, edge, bending, pin index) arrays of a flat quad grid mesh pinned along its first row
+    i, j = np.meshgrid(np.arange(row), np.arange(col), indexing='ij')
+    location_array = np.stack((spacing * j.ravel(), np.zeros(row * col), -spacing * i.ravel()), axis=1)
+    edge_array = np.concatenate((grid_spring_edges(row, col, 1, 0), grid_spring_edges(row, col, 0, 1)))
+    bending_array = np.concatenate((grid_spring_edges(row, col, 2, 0), grid_spring_edges(row, col, 0, 2)))
+    return location_array, edge_array, bending_array, np.arange(col)
+
+
+def check_rebuilt_system(p_system, steps, particle_count, spring_force_count):
+    try:
+        p_system.reset_state()
+        for step_idx in range(steps):
+            p_system.simulate_step(STEP)
+    except Exception as exception:
+        return repr(exception)
+    if p_system.state.count != particle_count:
+        return '{} particles instead of {}'.format(p_system.state.count, particle_count)
+    for force_class in (GravityForce, DampingForce):
+        force_count = sum(type(force) == force_class for force in p_system.force_list)
+        if force_count != 1:
+            return '{} {} forces'.format(force_count, force_class.__name__)
+    if len(p_system.coherent_force_list) != spring_force_count:
+        return '{} spring forces instead of {}'.format(len(p_system.coherent_force_list), spring_force_count)
+    for spring_force in p_system.coherent_force_list:
+        edge_array = spring_force.get_edge_array()[0]
+        if edge_array.shape[0] == 0 or edge_array.max() >= particle_count:
+            return 'springs outside the particles'
+    for constraint in p_system.constraint_list:
+        if isinstance(constraint, PinConstraint) and np.any(constraint.get_pin_array()[0] >= particle_count):
+            return 'pins outside the particles'
+    if not np.all(np.isfinite(p_system.location)):
+        return 'non finite locations'
+    return None
+
+
+def check_remove(steps=5):
+    # {case: error or None} of particles removed between steps, every case steps on afterwards and checks
+    # that the state and the initial particles still match
+    error_dict = {}
+    p_system = build_free_scene(10)
+    p_system.solver = SOLVER_TYPES['leap_frog_solver']()
+    p_system.solver.reset_solver(p_system)
+    error_dict['leapfrog'] = check_removed_system(p_system, steps, 12, add_and_remove_particles)
+
+    # The emitted particles take state rows after the initial ones
+    for solver_name in ('fourth_order_rk_solver', 'leap_frog_solver'):
+        p_system = build_free_scene(10)
+        p_system.add_emitter(PointEmitter(rate=200.0, lifetime=0.2, velocity_spread=1.0))
+        p_system.set_pool_capacity(50)
+        p_system.solver = SOLVER_TYPES[solver_name]()
+        p_system.solver.reset_solver(p_system)
+        error_dict['emit/' + solver_name] = check_removed_system(p_system, steps, 12, add_and_remove_particles)
+    return error_dict
+
+
+def add_and_remove_particles(p_system):
+    p_system.add_particles(np.zeros((3, 3)))
+    p_system.remove_particles([0])
+
+
+def check_removed_system(p_system, steps, particle_count, edit_func):
+    try:
+        for step_idx in range(steps):
+            p_system.simulate_step(STEP)
+        emitted_id_array = p_system.state.particle_id[p_system.init_state.count:].copy()
+        edit_func(p_system)
+        if not np.array_equal(p_system.state.particle_id[p_system.init_state.count:], emitted_id_array):
+            return 'emitted particles moved out of order'
+        for step_idx in range(steps):
+            p_system.simulate_step(STEP)
+    except Exception as exception:
+        return repr(exception)
+    if p_system.init_state.count != particle_count:
+        return '{} particles instead of {}'.format(p_system.init_state.count, particle_count)
+    if p_system.pool.capacity > 0 and p_system.pool.base_count != particle_count:
+        return 'emitter pool starts at row {} instead of {}'.format(p_system.pool.base_count, particle_count)
+    if not np.all(np.isfinite(p_system.location)):
+        return 'non finite locations'
+    return None
+
+
+def compare_results(old_data, new_data, threshold=0.1):
+    # Lists every timing that got slower by more than threshold (relative)
+    regression_list = []
+    # Results written before the threads option ran on a single thread
+    # and results written before the precision option in double
+    old_results = {(result['scene'], result['particle_count'], result.get('num_threads', 1), result.get('precision', 'double')): result
+                   for result in old_data['results']}
+    for new_result in new_data['results']:
+        old_result = old_results.get((new_result['scene'], new_result['particle_count'], new_result['num_threads'], new_result['precision']))
+        if old_result == None:
+            continue
+        key_prefix = new_result['scene'] + '/' + str(new_result['particle_count']) + '/' + str(new_result['num_threads']) + '/' + new_result['precision']
+        if new_result['steps_per_sec'] < old_result['steps_per_sec'] * (1.0 - threshold):
+            regression_list.append((key_prefix + '/steps_per_sec', old_result['steps_per_sec'], new_result['steps_per_sec']))
+        for group in ('stages', 'solvers'):
+            for name, new_seconds in new_result[group].items():
+                old_seconds = old_result[group].get(name)
+                if old_seconds != None and new_seconds > old_seconds * (1.0 + threshold):
+                    regression_list.append((key_prefix + '/' + group + '/' + name, old_seconds, new_seconds))
+    return regression_list
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Particle system benchmark')
+    parser.add_argument('--free', type=int, nargs='*', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--grid', type=int, nargs='*', default=[100, 1000, 10000, 100000])
+    # Particle collision is all pairs, large clumps take minutes per step
+    parser.add_argument('--clump', type=int, nargs='*', default=[100, 1000])
+    parser.add_argument('--rope', type=int, nargs='*', default=[100, 1000, 10000])
+    parser.add_argument('--emit', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--nbody', type=int, nargs='*', default=[1000, 10000])
+    parser.add_argument('--fluid', type=int, nargs='*', default=[1000, 20000])
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--max-seconds', type=float, default=5.0)
+    parser.add_argument('--solver', nargs='*', default=None, choices=list(SOLVER_TYPES.keys()))
+    parser.add_argument('--profile', action='store_true', help='add the per stage profiler table of the frame step')
+    parser.add_argument('--backend', default='numpy', choices=KERNEL_BACKENDS)
+    parser.add_argument('--threads', type=int, nargs='*', default=[1])
+    parser.add_argument('--precision', nargs='*', default=['double'], choices=list(PRECISION_DTYPES.keys()))
+    parser.add_argument('--check-backends', action='store_true')
+    parser.add_argument('--check-drift', action='store_true', help='compare single and double precision on the cloth scene')
+    parser.add_argument('--drift-tolerance', type=float, default=DRIFT_TOLERANCE, help='largest distance --check-drift allows')
+    parser.add_argument('--check-determinism', action='store_true', help='compare serial and threaded deterministic runs step by step')
+    parser.add_argument('--check-domain', type=int, default=None, metavar='PROCESSES', help='compare deterministic bakes in this process and over worker processes')
+    parser.add_argument('--check-rebuild', action='store_true', help='run the grid, mesh and proxy spring builders again with a smaller scene and step it')
+    parser.add_argument('--check-remove', action='store_true', help='add and remove particles between steps and step on')
+    parser.add_argument('--tolerance', type=float, default=1e-9)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.check_backends:
+        difference_dict = check_backends()
+        if difference_dict == None:
+            print('numba is not installed, only the numpy backend is available')
+            return 0
+        failed_count = 0
+        for name, difference in difference_dict.items():
+            print('{:>20} max difference {:.3e}'.format(name, difference))
+            if difference > args.tolerance:
+                failed_count += 1
+        return failed_count
+
+    if args.check_drift:
+        drift = check_precision_drift(backend=args.backend)
+        print('single vs double after {} steps: max {:.3e} rms {:.3e} ({:.3e} of the cloth size)'.format(
+            drift['steps'], drift['max_distance'], drift['rms_distance'], drift['relative_max_distance']))
+        if drift['max_distance'] > args.drift_tolerance:
+            print('max drift is over the tolerance of {:.3e}'.format(args.drift_tolerance))
+            return 1
+        return 0
+
+    if args.check_determinism:
+        num_threads = max(max(args.threads), 2)
+        mismatch_dict = check_determinism({'grid': 5000, 'clump': 1000, 'nbody': 2000, 'fluid': 5000}, num_threads=num_threads, backend=args.backend)
+        for scene_name, mismatch_list in mismatch_dict.items():
+            if len(mismatch_list) == 0:
+                print('{:>6} 1 vs {} threads: every step matches'.format(scene_name, num_threads))
+            else:
+                print('{:>6} 1 vs {} threads: {} steps differ, first at step {}'.format(scene_name, num_threads, len(mismatch_list), mismatch_list[0][0]))
+        return sum(len(mismatch_list) > 0 for mismatch_list in mismatch_dict.values())
+
+    if args.check_domain != None:
+        mismatch_dict = check_domain({'grid': 2000, 'nbody': 1000, 'fluid': 2000}, num_processes=args.check_domain, backend=args.backend)
+        for scene_name, mismatch_list in mismatch_dict.items():
+            if len(mismatch_list) == 0:
+                print('{:>6} 1 vs {} processes: every step matches'.format(scene_name, args.check_domain))
+            else:
+                print('{:>6} 1 vs {} processes: {} steps differ, first at step {}'.format(scene_name, args.check_domain, len(mismatch_list), mismatch_list[0][0]))
+        return sum(len(mismatch_list) > 0 for mismatch_list in mismatch_dict.values())
+
+    if args.check_rebuild:
+        error_dict = check_rebuild()
+        for case_name, error in error_dict.items():
+            print('{:>6} rebuild: {}'.format(case_name, 'ok' if error == None else error))
+        return sum(error != None for error in error_dict.values())
+
+    if args.check_remove:
+        error_dict = check_remove()
+        for case_name, error in error_dict.items():
+            print('{:>30} remove: {}'.format(case_name, 'ok' if error == None else error))
+        return sum(error != None for error in error_dict.values())
+
+    scene_sizes = {'free': args.free, 'grid': args.grid, 'clump': args.clump, 'rope': args.rope, 'emit': args.emit, 'nbody': args.nbody, 'fluid': args.fluid}
+    data = run_benchmark(scene_sizes, args.steps, args.max_seconds, args.solver, args.profile, args.backend, thread_counts=args.threads, precisions=args.precision)
+    with open(args.output, 'w') as fp:
+        json.dump(data, fp, indent=2)
+
+    base_steps_per_sec = {}
+    for result in data['results']:
+        scene_key = (result['scene'], result['particle_count'])
+        speedup = result['steps_per_sec'] / base_steps_per_sec.setdefault(scene_key, result['steps_per_sec'])
+        print('{:>6} {:>7} particles {:>3} threads {:>6} {:10.2f} steps/sec {:6.2f}x setup {:.3f}s'.format(
+            result['scene'], result['particle_count'], result['num_threads'], result['precision'], result['steps_per_sec'], speedup, result['setup_seconds']))
+
+    if args.compare != None:
+        with open(args.compare, 'r') as fp:
+            old_data = json.load(fp)
+        regression_list = compare_results(old_data, data, args.threshold)
+        for name, old_value, new_value in regression_list:
+            print('regression', name, old_value, '->', new_value)
+        return len(regression_list)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import numpy as np
+
+# Axis aligned bounding box tree over the triangles of a collider mesh, plain numpy so it works
+# without blender. Nodes are stored in flat arrays in build order (a parent comes before its
+# children), leaves own a contiguous range of the triangles in tree order. Queries walk the tree for
+# all points at once, one level per loop iteration.
+
+
+def closest_point_triangle(point, a, b, c):
+    # Closest point on the triangles (a, b, c) to point, all (N, 3). Real-Time Collision Detection 5.1.5,
+    # the Voronoi regions are applied in reverse so the first matching region of the book wins
+    ab = b - a
+    ac = c - a
+    ap = point - a
+    bp = point - b
+    cp = point - c
+    d1 = np.einsum('ij,ij->i', ab, ap)
+    d2 = np.einsum('ij,ij->i', ac, ap)
+    d3 = np.einsum('ij,ij->i', ab, bp)
+    d4 = np.einsum('ij,ij->i', ac, bp)
+    d5 = np.einsum('ij,ij->i', ab, cp)
+    d6 = np.einsum('ij,ij->i', ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = 1.0 / (va + vb + vc)
+        closest = a + ab * (vb * denom)[:, None] + ac * (vc * denom)[:, None]
+        in_bc = (va <= 0.0) & (d4 - d3 >= 0.0) & (d5 - d6 >= 0.0)
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        closest = np.where(in_bc[:, None], b + w[:, None] * (c - b), closest)
+        in_ac = (vb <= 0.0) & (d2 >= 0.0) & (d6 <= 0.0)
+        w = d2 / (d2 - d6)
+        closest = np.where(in_ac[:, None], a + w[:, None] * ac, closest)
+        closest = np.where(((d6 >= 0.0) & (d5 <= d6))[:, None], c, closest)
+        in_ab = (vc <= 0.0) & (d1 >= 0.0) & (d3 <= 0.0)
+        v = d1 / (d1 - d3)
+        closest = np.where(in_ab[:, None], a + v[:, None] * ab, closest)
+        closest = np.where(((d3 >= 0.0) & (d4 <= d3))[:, None], b, closest)
+        closest = np.where(((d1 <= 0.0) & (d2 <= 0.0))[:, None], a, closest)
+    # Degenerate triangles fall through every region test
+    return np.where(np.isfinite(closest).all(axis=1)[:, None], closest, a)
+
+
+class TriangleBVH:
+    def __init__(self, vertex_array, triangle_array, leaf_size=8):
+        self.leaf_size = leaf_size
+        self.build(vertex_array, triangle_array)
+
+    def build(self, vertex_array, triangle_array):
+        vertex_array = np.asarray(vertex_array, dtype=np.float64).reshape(-1, 3)
+        triangle_array = np.asarray(triangle_array, dtype=np.int64).reshape(-1, 3)
+        centroid = vertex_array[triangle_array].mean(axis=1)
+        order = np.arange(triangle_array.shape[0])
+        node_start = []
+        node_end = []
+        node_left = []
+        node_right = []
+        node_depth = []
+        # (node_idx, start, end, depth), the node rows are appended before their children are split
+        stack = [(0, 0, triangle_array.shape[0], 0)]
+        node_start.append(0)
+        node_end.append(triangle_array.shape[0])
+        node_left.append(-1)
+        node_right.append(-1)
+        node_depth.append(0)
+        while len(stack) > 0:
+            node_idx, start, end, depth = stack.pop()
+            if end - start <= self.leaf_size:
+                continue
+            # Median split along the longest axis of the centroids
+            node_centroid = centroid[order[start:end]]
+            axis = int(np.argmax(node_centroid.max(axis=0) - node_centroid.min(axis=0)))
+            mid = (end - start) // 2
+            order[start:end] = order[start:end][np.argpartition(node_centroid[:, axis], mid)]
+            for child_start, child_end in ((start, start + mid), (start + mid, end)):
+                child_idx = len(node_start)
+                node_start.append(child_start)
+                node_end.append(child_end)
+                node_left.append(-1)
+                node_right.append(-1)
+                node_depth.append(depth + 1)
+                if child_start == start:
+                    node_left[node_idx] = child_idx
+                else:
+                    node_right[node_idx] = child_idx
+                stack.append((child_idx, child_start, child_end, depth + 1))
+
+        self.triangle_idx = order
+        self.tree_triangle_array = triangle_array[order]
+        self.node_start = np.array(node_start, dtype=np.int64)
+        self.node_end = np.array(node_end, dtype=np.int64)
+        self.node_left = np.array(node_left, dtype=np.int64)
+        self.node_right = np.array(node_right, dtype=np.int64)
+        node_depth = np.array(node_depth, dtype=np.int64)
+        self.leaf_idx = np.flatnonzero(self.node_left < 0)
+        # Leaves sorted by start so their ranges can be reduced in one reduceat
+        self.leaf_idx = self.leaf_idx[np.argsort(self.node_start[self.leaf_idx])]
+        internal_idx = np.flatnonzero(self.node_left >= 0)
+        self.level_list = [internal_idx[node_depth[internal_idx] == depth] for depth in range(int(node_depth.max(initial=0)), -1, -1)]
+        self.node_min = np.zeros((len(node_start), 3))
+        self.node_max = np.zeros((len(node_start), 3))
+        self.refit(vertex_array)
+
+    def refit(self, vertex_array):
+        # Same triangles, moved vertices: recompute the boxes bottom up without touching the tree shape
+        vertex_array = np.asarray(vertex_array, dtype=np.float64).reshape(-1, 3)
+        self.triangle_location = vertex_array[self.tree_triangle_array]
+        edge_1 = self.triangle_location[:, 1] - self.triangle_location[:, 0]
+        edge_2 = self.triangle_location[:, 2] - self.triangle_location[:, 0]
+        normal = np.cross(edge_1, edge_2)
+        self.triangle_normal = normal / np.maximum(np.sqrt(np.einsum('ij,ij->i', normal, normal)), 1e-12)[:, None]
+        if self.tree_triangle_array.shape[0] == 0:
+            return
+        leaf_start = self.node_start[self.leaf_idx]
+        self.node_min[self.leaf_idx] = np.minimum.reduceat(self.triangle_location.min(axis=1), leaf_start, axis=0)
+        self.node_max[self.leaf_idx] = np.maximum.reduceat(self.triangle_location.max(axis=1), leaf_start, axis=0)
+        for level_idx in self.level_list:
+            self.node_min[level_idx] = np.minimum(self.node_min[self.node_left[level_idx]], self.node_min[self.node_right[level_idx]])
+            self.node_max[level_idx] = np.maximum(self.node_max[self.node_left[level_idx]], self.node_max[self.node_right[level_idx]])
+
+    def query_radius(self, point_array, radius):
+        # (point_idx, tree_triangle_idx) of every triangle whose box is within radius of a point
+        point_idx = np.arange(point_array.shape[0])
+        node_idx = np.zeros(point_array.shape[0], dtype=np.int64)
+        if self.tree_triangle_array.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pair_point_list = [np.zeros(0, dtype=np.int64)]
+        pair_triangle_list = [np.zeros(0, dtype=np.int64)]
+        while point_idx.shape[0] > 0:
+            point = point_array[point_idx]
+            gap = np.maximum(self.node_min[node_idx] - point, 0.0) + np.maximum(point - self.node_max[node_idx], 0.0)
+            is_near = np.einsum('ij,ij->i', gap, gap) <= radius * radius
+            point_idx = point_idx[is_near]
+            node_idx = node_idx[is_near]
+            is_leaf = self.node_left[node_idx] < 0
+            leaf_point_idx = point_idx[is_leaf]
+            leaf_node_idx = node_idx[is_leaf]
+            leaf_count = self.node_end[leaf_node_idx] - self.node_start[leaf_node_idx]
+            # Expand every (point, leaf) into its triangles
+            pair_offset = np.arange(leaf_count.sum()) - np.repeat(np.cumsum(leaf_count) - leaf_count, leaf_count)
+            pair_point_list.append(np.repeat(leaf_point_idx, leaf_count))
+            pair_triangle_list.append(np.repeat(self.node_start[leaf_node_idx], leaf_count) + pair_offset)
+            point_idx = np.concatenate((point_idx[~is_leaf], point_idx[~is_leaf]))
+            node_idx = np.concatenate((self.node_left[node_idx[~is_leaf]], self.node_right[node_idx[~is_leaf]]))
+        return np.concatenate(pair_point_list), np.concatenate(pair_triangle_list)
+
+    def find_nearest(self, point_array, radius):
+        # Nearest triangle within radius of every point: (triangle_idx, closest_point, normal, distance),
+        # triangle_idx is -1 and distance inf for points with nothing in range
+        point_array = np.asarray(point_array, dtype=np.float64).reshape(-1, 3)
+        triangle_idx = np.full(point_array.shape[0], -1, dtype=np.int64)
+        closest_point = np.zeros_like(point_array)
+        normal = np.zeros_like(point_array)
+        distance = np.full(point_array.shape[0], np.inf)
+        pair_point, pair_triangle = self.query_radius(point_array, radius)
+        if pair_point.shape[0] == 0:
+            return triangle_idx, closest_point, normal, distance
+        triangle = self.triangle_location[pair_triangle]
+        pair_closest = closest_point_triangle(point_array[pair_point], triangle[:, 0], triangle[:, 1], triangle[:, 2])
+        offset = point_array[pair_point] - pair_closest
+        pair_distance = np.sqrt(np.einsum('ij,ij->i', offset, offset))
+        # The first pair of every point after sorting by (point, distance) is its nearest
+        pair_order = np.lexsort((pair_distance, pair_point))
+        first = pair_order[np.flatnonzero(np.diff(pair_point[pair_order], prepend=-1) != 0)]
+        is_in_range = pair_distance[first] <= radius
+        first = first[is_in_range]
+        hit_point = pair_point[first]
+        triangle_idx[hit_point] = self.triangle_idx[pair_triangle[first]]
+        closest_point[hit_point] = pair_closest[first]
+        normal[hit_point] = self.triangle_normal[pair_triangle[first]]
+        distance[hit_point] = pair_distance[first]
+        return triangle_idx, closest_point, normal, distance
@@ -0,0 +1,156 @@
+import numpy as np
+from collections import OrderedDict
+import os
+import json
+
+# Binary frame cache written next to the per frame json files of an animation bake.
+# Row 0 holds the initial state, row k holds the state after k solver steps. Bakes with emitters
+# also store the particle id of every column (-1 for unused or dead) and the alive count per row.
+CACHE_FILENAME = 'positions.npy'
+ID_CACHE_FILENAME = 'ids.npy'
+ALIVE_COUNT_CACHE_FILENAME = 'alive_count.npy'
+# [frame, state hash] per saved frame, in the order they were saved
+FRAME_HASH_FILENAME = 'frame_hash.json'
+
+
+class FrameCacheWriter:
+    def __init__(self, cache_dir, frame_start, frame_end, particle_count, record_ids=False):
+        self.cache_dir = cache_dir
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        row_count = max(frame_end - frame_start + 1, 1)
+        self.positions = np.lib.format.open_memmap(os.path.join(cache_dir, CACHE_FILENAME), mode='w+',
+                                                   dtype=np.float32, shape=(row_count, particle_count, 3))
+        self.ids = None
+        self.alive_counts = None
+        if record_ids:
+            self.ids = np.lib.format.open_memmap(os.path.join(cache_dir, ID_CACHE_FILENAME), mode='w+',
+                                                 dtype=np.int64, shape=(row_count, particle_count))
+            self.alive_counts = np.lib.format.open_memmap(os.path.join(cache_dir, ALIVE_COUNT_CACHE_FILENAME), mode='w+',
+                                                          dtype=np.int64, shape=(row_count,))
+
+    def write_frame(self, frame, locations, ids=None):
+        # Fewer locations than columns when the emitter pool isn't full yet
+        row = frame_to_row(frame, self.frame_start, self.positions.shape[0])
+        count = locations.shape[0]
+        self.positions[row, :count] = locations
+        self.positions[row, count:] = 0.0
+        if self.ids is not None:
+            self.ids[row, :count] = ids
+            self.ids[row, count:] = -1
+            self.alive_counts[row] = np.count_nonzero(ids >= 0)
+
+    def close(self):
+        if self.positions is None:
+            return
+        self.positions.flush()
+        self.positions = None
+        if self.ids is not None:
+            self.ids.flush()
+            self.alive_counts.flush()
+            self.ids = None
+            self.alive_counts = None
+
+    def discard(self):
+        # Bakes that stopped part way remove their cache, it would be played back as a finished one
+        self.close()
+        for filename in (CACHE_FILENAME, ID_CACHE_FILENAME, ALIVE_COUNT_CACHE_FILENAME):
+            filepath = os.path.join(self.cache_dir, filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+
+class FrameCacheReader:
+    def __init__(self, cache_dir, lru_size=32):
+        self.cache_dir = cache_dir
+        self.lru_size = lru_size
+        self.decoded_frames = OrderedDict()
+        with open(os.path.join(cache_dir, 'config.json'), 'r') as fp:
+            json_data = json.load(fp)
+        self.frame_start = json_data["frame_start"]
+        self.frame_end = json_data["frame_end"]
+        self.particle_count = len(json_data["particle_list"])
+
+        cache_filepath = os.path.join(cache_dir, CACHE_FILENAME)
+        if os.path.exists(cache_filepath):
+            # Memory mapped, only the rows being played back are paged in
+            self.positions = np.load(cache_filepath, mmap_mode='r')
+        else:
+            # Bakes made before the binary cache existed, fall back to the json frames
+            self.positions = None
+
+        # Only bakes with emitters have ids
+        self.ids = None
+        self.alive_counts = None
+        if os.path.exists(os.path.join(cache_dir, ID_CACHE_FILENAME)):
+            self.ids = np.load(os.path.join(cache_dir, ID_CACHE_FILENAME), mmap_mode='r')
+            self.alive_counts = np.load(os.path.join(cache_dir, ALIVE_COUNT_CACHE_FILENAME), mmap_mode='r')
+
+    def get_row_count(self):
+        if self.positions is not None:
+            return self.positions.shape[0]
+        return max(self.frame_end - self.frame_start + 1, 1)
+
+    def read_frame(self, frame):
+        row = frame_to_row(frame, self.frame_start, self.get_row_count())
+        if row in self.decoded_frames:
+            self.decoded_frames.move_to_end(row)
+            return self.decoded_frames[row]
+
+        if self.positions is not None:
+            locations = np.array(self.positions[row], dtype=np.float64)
+        else:
+            locations = self.read_json_row(row)
+
+        self.decoded_frames[row] = locations
+        while len(self.decoded_frames) > self.lru_size:
+            self.decoded_frames.popitem(last=False)
+        return locations
+
+    def read_ids(self, frame):
+        # Particle id per column, -1 for dead or unused columns. None for bakes without emitters
+        if self.ids is None:
+            return None
+        return np.array(self.ids[frame_to_row(frame, self.frame_start, self.get_row_count())])
+
+    def read_alive_count(self, frame):
+        if self.alive_counts is None:
+            return self.particle_count
+        return int(self.alive_counts[frame_to_row(frame, self.frame_start, self.get_row_count())])
+
+    def read_json_row(self, row):
+        # Row 0 is saved as frame 0, the others as the frame they were solved for
+        frame = 0 if row == 0 else self.frame_start + row - 1
+        animation_filepath = os.path.join(self.cache_dir, str(frame) + '.json')
+        with open(animation_filepath, 'r') as fp:
+            json_data = json.load(fp)
+        return np.array([particle_data['location'] for particle_data in json_data['particle_list']], dtype=np.float64).reshape(-1, 3)
+
+
+def frame_to_row(frame, frame_start, row_count):
+    return min(max(frame - frame_start + 1, 0), row_count - 1)
+
+
+def write_frame_hash(filepath, frame_hash_list):
+    with open(filepath, 'w') as fp:
+        json.dump({'frame_hash_list': frame_hash_list}, fp)
+
+
+def read_frame_hash(filepath):
+    # A bake directory reads the hashes saved with the bake
+    if os.path.isdir(filepath):
+        filepath = os.path.join(filepath, FRAME_HASH_FILENAME)
+    with open(filepath, 'r') as fp:
+        return json.load(fp)['frame_hash_list']
+
+
+def compare_frame_hash(frame_hash_list, other_frame_hash_list):
+    # [(frame, hash, other hash)] of the saved frames that differ, matched by position. A frame only one
+    # of the runs has shows up with None for the other hash
+    mismatch_list = []
+    for idx in range(max(len(frame_hash_list), len(other_frame_hash_list))):
+        frame, state_hash = frame_hash_list[idx] if idx < len(frame_hash_list) else (None, None)
+        other_frame, other_state_hash = other_frame_hash_list[idx] if idx < len(other_frame_hash_list) else (None, None)
+        if state_hash != other_state_hash:
+            mismatch_list.append((frame if frame != None else other_frame, state_hash, other_state_hash))
+    return mismatch_list
@@ -1,13 +1,25 @@
-import bpy
-from mathutils import Vector, Matrix
-from .wall import Wall
-from math import tan, sin, cos
+try:
+    import bpy
+    from mathutils import Vector, Matrix
+    from .utils import create_collection, create_plane
+except ImportError:
+    bpy = None
+from .wall import Wall, FixedWall
+from .bvh import TriangleBVH
+from .kernels import filter_contact_pairs
+import numpy as np
 
 
 class Collision:
+    # Continuous collisions sweep each particle from where it started the step, see ParticleSystem.previous_location
+    continuous = False
+
     def project_collision(self, particle_system):
         pass
 
+    def remap_particles(self, idx_map):
+        return True
+
     def save_collision(self):
         pass
 
@@ -15,58 +27,173 @@ class Collision:
         pass
 
 class WallCollision(Collision):
-    def __init__(self, plane_obj):
-        self.wall = Wall(plane_obj)
+    def __init__(self, plane_obj=None, continuous=False):
+        # Without a plane object one is created when the collision is loaded
+        self.wall = Wall(plane_obj) if plane_obj != None else None
+        self.continuous = continuous
 
     def project_collision(self, particle_system):
         # collision
-        wall_location = self.wall.get_location()
-        wall_normal = self.wall.get_normal()
-        for particle in particle_system.particle_list:
-            projection = (wall_location - particle.location).dot(wall_normal)
-            is_inside_wall = projection > 0
-            if is_inside_wall == True:
-                particle.location += (2 * projection) * wall_normal
-                particle.velocity = particle.velocity.reflect(wall_normal)
+        wall_location = np.array(self.wall.get_location(), dtype=np.float64)
+        wall_normal = np.array(self.wall.get_unit_normal(), dtype=np.float64)
+        executor = particle_system.executor
+
+        def project_chunk(chunk_idx, start, end):
+            if self.continuous:
+                particle_system.kernels.swept_wall_collision(particle_system.previous_location[start:end], particle_system.location[start:end],
+                                                             particle_system.velocity[start:end], wall_location, wall_normal)
+                return
+            particle_system.kernels.wall_collision(particle_system.location[start:end], particle_system.velocity[start:end], wall_location, wall_normal)
+
+        executor.map(project_chunk, executor.split(len(particle_system.particle_list)))
 
     def save_collision(self):
         json_data = {}
         json_data["collision_name"] = "wall_collision"
         wall_location = self.wall.get_location()
-        json_data["wall_location"] = [wall_location.x, wall_location.y, wall_location.z]
+        json_data["wall_location"] = [float(wall_location[0]), float(wall_location[1]), float(wall_location[2])]
         wall_normal = self.wall.get_normal()
-        json_data["wall_normal"] = [wall_normal.x, wall_normal.y, wall_normal.z]
+        json_data["wall_normal"] = [float(wall_normal[0]), float(wall_normal[1]), float(wall_normal[2])]
+        json_data["continuous"] = self.continuous
         return json_data
 
     def load_collision(self, json_data):
+        self.continuous = json_data.get("continuous", False)
+        if bpy == None:
+            self.wall = FixedWall(json_data["wall_location"], json_data["wall_normal"])
+            return
+        if self.wall == None:
+            current_collection = bpy.data.collections.get("Collision")
+            if current_collection == None:
+                current_collection = create_collection(bpy.context.scene.collection, "Collision")
+            self.wall = Wall(create_plane(current_collection, 'Wall collision', Vector((0.0, 0.0, -4.0))))
         wall_location = Vector((json_data["wall_location"][0], json_data["wall_location"][1], json_data["wall_location"][2]))
         self.wall.set_location(wall_location)
         wall_normal = Vector((json_data["wall_normal"][0], json_data["wall_normal"][1], json_data["wall_normal"][2]))
         self.wall.set_normal(wall_normal)
 
 class ParticleCollision(Collision):
+    def __init__(self, continuous=False):
+        self.continuous = continuous
+
+    def collide(self, particle_system, previous_location, location, velocity, mass, collision_idx=None):
+        if self.continuous:
+            particle_system.kernels.swept_particle_collision(previous_location, location, velocity, mass, particle_system.time_step, particle_system.executor)
+            return
+        if location.shape[0] < 2:
+            return
+        # Candidates from the shared neighbor lists, the pairs and their order are those of NumpyKernels.particle_collision
+        neighbor_list = particle_system.neighbor_search.get_neighbor_list(particle_system, location, 2.0 * float(mass.max()), collision_idx)
+        contact_pairs = filter_contact_pairs(location, mass, neighbor_list.pair_array)
+        particle_system.kernels.particle_collision_response(location, velocity, mass, contact_pairs)
+
     def project_collision(self, particle_system):
-        for i in range(len(particle_system.particle_list)):
-            for j in range(i+1, len(particle_system.particle_list)):
-                particle_i = particle_system.particle_list[i]
-                particle_j = particle_system.particle_list[j]
-                # Reference from https://www.sjsu.edu/faculty/watkins/collision.htm
-                if particle_i.is_collision(particle_j):
-                    velocity_i = particle_i.velocity.copy()
-                    velocity_j = particle_j.velocity.copy()
-                    mass_i = particle_i.mass
-                    mass_j = particle_j.mass
-                    normal = (particle_i.location - particle_j.location).normalized()
-                    a = 2 * normal.dot(velocity_i - velocity_j) / (1.0 / mass_i + 1.0 / mass_j)
-
-                    particle_i.velocity -= ((a / mass_i) * normal)
-                    particle_j.velocity += ((a / mass_j) * normal)
+        # Spheres of radius mass, see NumpyKernels.particle_collision
+        collision_idx = particle_system.get_collision_idx()
+        if collision_idx is None:
+            self.collide(particle_system, particle_system.previous_location, particle_system.location, particle_system.velocity, particle_system.mass)
+            return
+        # Dead emitter rows and untouched sleeping rows don't collide, the others are gathered and written back
+        location = particle_system.location[collision_idx]
+        velocity = particle_system.velocity[collision_idx]
+        previous_location = particle_system.previous_location[collision_idx] if self.continuous else None
+        self.collide(particle_system, previous_location, location, velocity, particle_system.mass[collision_idx], collision_idx)
+        particle_system.location[collision_idx] = location
+        particle_system.velocity[collision_idx] = velocity
 
     def save_collision(self):
         json_data = {}
         json_data["collision_name"] = "particle_collision"
+        json_data["continuous"] = self.continuous
+        return json_data
+
+    def load_collision(self, json_data):
+        self.continuous = json_data.get("continuous", False)
+
+class MeshCollision(Collision):
+    # Particles against the surface of a mesh object, treated as solid with outward face normals.
+    # Particles closer than thickness to the surface are pushed out to thickness and their
+    # velocity into the surface is reflected, scaled by restitution
+    def __init__(self, ob=None, thickness=0.1, restitution=1.0):
+        self.ob = ob
+        self.thickness = thickness
+        self.restitution = restitution
+        self.bvh = None
+        self.topology_key = None
+        self.local_vertex_array = None
+        self.matrix_world = None
+
+    def set_mesh(self, vertex_array, triangle_array):
+        # World space geometry given directly, for colliders that don't come from an object
+        self.bvh = TriangleBVH(vertex_array, triangle_array)
+
+    def update_mesh(self):
+        # The tree is rebuilt when the topology changes and only refit when the vertices or the transform move
+        if self.ob == None:
+            return
+        mesh = self.ob.data
+        topology_key = (len(mesh.vertices), len(mesh.polygons), len(mesh.loops))
+        local_vertex_array = np.empty(len(mesh.vertices) * 3)
+        mesh.vertices.foreach_get("co", local_vertex_array)
+        matrix_world = np.array(self.ob.matrix_world)
+        if self.bvh != None and topology_key == self.topology_key and np.array_equal(matrix_world, self.matrix_world) \
+                and np.array_equal(local_vertex_array, self.local_vertex_array):
+            return
+        vertex_array = local_vertex_array.reshape(-1, 3) @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+        if self.bvh == None or topology_key != self.topology_key:
+            mesh.calc_loop_triangles()
+            triangle_array = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int64)
+            mesh.loop_triangles.foreach_get("vertices", triangle_array)
+            self.set_mesh(vertex_array, triangle_array)
+        else:
+            self.bvh.refit(vertex_array)
+        self.topology_key = topology_key
+        self.local_vertex_array = local_vertex_array
+        self.matrix_world = matrix_world
+
+    def project_collision(self, particle_system):
+        self.update_mesh()
+        if self.bvh == None:
+            return
+        # Sleeping rows rest where they are, only the awake ones are queried
+        awake_idx = particle_system.get_awake_idx()
+        location = particle_system.location if awake_idx is None else particle_system.location[awake_idx]
+        velocity = particle_system.velocity if awake_idx is None else particle_system.velocity[awake_idx]
+        triangle_idx, closest_point, normal, distance = self.bvh.find_nearest(location, self.thickness)
+        hit_idx = np.flatnonzero(triangle_idx >= 0)
+        if hit_idx.shape[0] == 0:
+            return
+        closest_point = closest_point[hit_idx]
+        normal = normal[hit_idx]
+        offset = location[hit_idx] - closest_point
+        # In front of the surface the particle is pushed away from the closest point (rounded around
+        # edges), behind it or on it along the face normal
+        is_outside = (np.einsum('ij,ij->i', offset, normal) > 0.0) & (distance[hit_idx] > 1e-12)
+        contact_normal = np.where(is_outside[:, None], offset / np.maximum(distance[hit_idx], 1e-12)[:, None], normal)
+        location[hit_idx] = closest_point + self.thickness * contact_normal
+        hit_velocity = velocity[hit_idx]
+        normal_speed = np.minimum(np.einsum('ij,ij->i', hit_velocity, contact_normal), 0.0)
+        velocity[hit_idx] = hit_velocity - ((1.0 + self.restitution) * normal_speed)[:, None] * contact_normal
+        if awake_idx is not None:
+            particle_system.location[awake_idx] = location
+            particle_system.velocity[awake_idx] = velocity
+
+    def save_collision(self):
+        json_data = {}
+        json_data["collision_name"] = "mesh_collision"
+        json_data["object_name"] = self.ob.name if self.ob != None else ''
+        json_data["thickness"] = self.thickness
+        json_data["restitution"] = self.restitution
         return json_data
 
+    def load_collision(self, json_data):
+        if bpy == None and json_data["object_name"] != '':
+            raise RuntimeError("mesh collision with " + json_data["object_name"] + " needs blender")
+        self.ob = bpy.data.objects.get(json_data["object_name"]) if bpy != None else None
+        self.thickness = json_data["thickness"]
+        self.restitution = json_data["restitution"]
+        self.bvh = None
+
 class ClothCollision(Collision):
     def __init__(self):
         self.particle_location = None
@@ -78,6 +205,13 @@ class ClothCollision(Collision):
         self.triangle_connection = []
         self.first = True
 
+    def remap_particles(self, idx_map):
+        self.triangle_connection = [tuple(int(idx_map[particle_idx]) for particle_idx in triangle) for triangle in self.triangle_connection
+                                    if all(idx_map[particle_idx] >= 0 for particle_idx in triangle)]
+        self.particle_location = None
+        self.first = True
+        return True
+
     def project_collision(self, particle_system):
         if self.first == True:
             origin_state = particle_system.get_state()
@@ -94,3 +228,9 @@ class ClothCollision(Collision):
                     pass
             # particle_location should update at the end
             self.particle_location = origin_state[:, 0:3].copy()
+
+COLLISION_TYPES = {
+    'wall_collision': WallCollision,
+    'particle_collision': ParticleCollision,
+    'mesh_collision': MeshCollision,
+}
@@ -1,7 +1,15 @@
-import bpy
-from mathutils import Vector, Matrix, Quaternion
-from .custom_prop import AngularConstraintProp
-import math
+try:
+    import bpy
+    from .custom_prop import AngularConstraintProp
+except ImportError:
+    bpy = None
+from .scene_file import store_array
+import numpy as np
+
+
+def remap_idx_list(item_list, idx_map):
+    # [(particle_idx, value)] lists of the per particle constraints, removed particles are dropped
+    return [(int(idx_map[item[0]]), item[1]) for item in item_list if idx_map[item[0]] >= 0]
 
 
 class Constraint:
@@ -10,130 +18,250 @@ class Constraint:
     def apply_constraint(self, particle_system):
         pass
 
-    def save_constraint(self, particle_system):
+    # A 'pre' constraint runs inside every solver stage. Inside ParticleSystem.simulate_step it is split:
+    # prepare_step once before the solver for what holds over the whole step, apply_stage per stage
+    def prepare_step(self, particle_system):
+        pass
+
+    def apply_stage(self, particle_system):
+        self.apply_constraint(particle_system)
+
+    def remap_particles(self, idx_map):
+        return True
+
+    def save_constraint(self, particle_system, array_dict=None):
         pass
 
-    def load_constraint(self, json_data, particle_system):
+    def load_constraint(self, json_data, particle_system, array_dict=None):
         pass
 
 class PinConstraint(Constraint):
     def __init__(self):
         self.type = 'pre'
         self.pin_list = []
-
-    def add_pin(self, particle, location):
-        self.pin_list.append((particle, location))
+        self.pin_idx_array = None
+        self.pin_location_array = None
+
+    def add_pin(self, particle_idx, location):
+        self.pin_list.append((particle_idx, tuple(location)))
+        self.pin_idx_array = None
+
+    def add_pin_array(self, particle_idx_array, location_array):
+        for particle_idx, location in zip(np.asarray(particle_idx_array).tolist(), np.asarray(location_array).tolist()):
+            self.pin_list.append((particle_idx, tuple(location)))
+        self.pin_idx_array = None
+
+    def get_pin_array(self):
+        if self.pin_idx_array is None:
+            self.pin_idx_array = np.array([pin[0] for pin in self.pin_list], dtype=np.int64)
+            self.pin_location_array = np.array([pin[1] for pin in self.pin_list], dtype=np.float64).reshape(-1, 3)
+        return self.pin_idx_array, self.pin_location_array
+
+    def remap_particles(self, idx_map):
+        # Dropped once every pin it had is gone
+        pin_count = len(self.pin_list)
+        self.pin_list = remap_idx_list(self.pin_list, idx_map)
+        self.pin_idx_array = None
+        return pin_count == 0 or len(self.pin_list) > 0
 
     def apply_constraint(self, particle_system):
-        for pin in self.pin_list:
-            particle, location = pin
+        pin_idx_array, pin_location_array = self.get_pin_array()
+        particle_system.velocity[pin_idx_array] = 0.0
+        particle_system.force[pin_idx_array] = 0.0
+        particle_system.location[pin_idx_array] = pin_location_array
 
-            particle.velocity = Vector((0.0, 0.0, 0.0))
-            particle.force = Vector((0.0, 0.0, 0.0))
-            particle.location = location
+    def prepare_step(self, particle_system):
+        # The stages start from zero velocity and get zero force, so the pinned rows stay put until the step ends
+        pin_idx_array, pin_location_array = self.get_pin_array()
+        particle_system.velocity[pin_idx_array] = 0.0
+        particle_system.location[pin_idx_array] = pin_location_array
 
-    def save_constraint(self, particle_system):
+    def apply_stage(self, particle_system):
+        particle_system.force[self.get_pin_array()[0]] = 0.0
+
+    def save_constraint(self, particle_system, array_dict=None):
         json_data = {}
         json_data['constraint_name'] = 'pin_constraint'
+        if array_dict != None:
+            pin_idx_array, pin_location_array = self.get_pin_array()
+            json_data['pin_idx_array'] = store_array(array_dict, 'pin_idx', pin_idx_array)
+            json_data['pin_location_array'] = store_array(array_dict, 'pin_location', pin_location_array)
+            return json_data
         pin_list_data = []
         for pin in self.pin_list:
             pin_data = {}
-            pin_data['pin_particle_idx'] = particle_system.get_particle_idx(pin[0])
-            pin_data['pin_location'] = [pin[1].x, pin[1].y, pin[1].z]
+            pin_data['pin_particle_idx'] = int(pin[0])
+            pin_data['pin_location'] = [pin[1][0], pin[1][1], pin[1][2]]
             pin_list_data.append(pin_data)
         json_data['pin_list'] = pin_list_data
         return json_data
 
-    def load_constraint(self, json_data, particle_system):
+    def load_constraint(self, json_data, particle_system, array_dict=None):
         self.pin_list = []
+        self.pin_idx_array = None
+        if 'pin_idx_array' in json_data:
+            self.add_pin_array(array_dict[json_data['pin_idx_array']], array_dict[json_data['pin_location_array']])
+            return
         for pin_data in json_data['pin_list']:
-            pin_particle = particle_system.particle_list[pin_data['pin_particle_idx']]
-            pin_location = Vector((pin_data['pin_location'][0], pin_data['pin_location'][1], pin_data['pin_location'][2]))
-            self.pin_list.append((pin_particle, pin_location))
+            self.add_pin(pin_data['pin_particle_idx'], pin_data['pin_location'])
 
 class AxisConstraint(Constraint):
     def __init__(self):
         self.type = 'pre'
         self.axis_list = []
+        self.axis_idx_array = None
+        self.axis_vector_array = None
 
-    def add_pin(self, particle, axis='x'):
-        axis_vector = Vector((1.0, 1.0, 1.0))
+    def add_pin(self, particle_idx, axis='x'):
+        axis_vector = (1.0, 1.0, 1.0)
         if axis.lower() == 'x':
-            axis_vector = Vector((1.0, 0.0, 0.0))
+            axis_vector = (1.0, 0.0, 0.0)
         if axis.lower() == 'y':
-            axis_vector = Vector((0.0, 1.0, 0.0))
+            axis_vector = (0.0, 1.0, 0.0)
         if axis.lower() == 'z':
-            axis_vector = Vector((0.0, 0.0, 1.0))
-        self.axis_list.append((particle, axis_vector))
+            axis_vector = (0.0, 0.0, 1.0)
+        self.axis_list.append((particle_idx, axis_vector))
+        self.axis_idx_array = None
+
+    def get_axis_array(self):
+        if self.axis_idx_array is None:
+            self.axis_idx_array = np.array([axis[0] for axis in self.axis_list], dtype=np.int64)
+            self.axis_vector_array = np.array([axis[1] for axis in self.axis_list], dtype=np.float64).reshape(-1, 3)
+        return self.axis_idx_array, self.axis_vector_array
+
+    def remap_particles(self, idx_map):
+        self.axis_list = remap_idx_list(self.axis_list, idx_map)
+        self.axis_idx_array = None
+        return True
 
     def apply_constraint(self, particle_system):
-        for pin in self.axis_list:
-            particle, axis_vector = pin
-            particle.velocity = particle.velocity * axis_vector
-            particle.force = Vector((0.0, 0.0, 0.0))
+        axis_idx_array, axis_vector_array = self.get_axis_array()
+        particle_system.velocity[axis_idx_array] *= axis_vector_array
+        particle_system.force[axis_idx_array] = 0.0
 
-    def save_constraint(self, particle_system):
+    def prepare_step(self, particle_system):
+        axis_idx_array, axis_vector_array = self.get_axis_array()
+        particle_system.velocity[axis_idx_array] *= axis_vector_array
+
+    def apply_stage(self, particle_system):
+        # Without force the velocity masked in prepare_step stays masked over the stages
+        particle_system.force[self.get_axis_array()[0]] = 0.0
+
+    def save_constraint(self, particle_system, array_dict=None):
         json_data = {}
         json_data['constraint_name'] = 'axis_constraint'
+        if array_dict != None:
+            axis_idx_array, axis_vector_array = self.get_axis_array()
+            json_data['axis_idx_array'] = store_array(array_dict, 'axis_idx', axis_idx_array)
+            json_data['axis_vector_array'] = store_array(array_dict, 'axis_vector', axis_vector_array)
+            return json_data
         axis_list_data = []
         for axis in self.axis_list:
             axis_data = {}
-            axis_data['axis_particle_idx'] = particle_system.get_particle_idx(axis[0])
-            axis_data['axis_vector'] = [axis[1].x, axis[1].y, axis[1].z]
+            axis_data['axis_particle_idx'] = int(axis[0])
+            axis_data['axis_vector'] = [axis[1][0], axis[1][1], axis[1][2]]
             axis_list_data.append(axis_data)
         json_data['axis_list'] = axis_list_data
         return json_data
 
-    def load_constraint(self, json_data, particle_system):
+    def load_constraint(self, json_data, particle_system, array_dict=None):
         self.axis_list = []
-        for axix_data in json_data['axis_list']:
-            axis_particle = particle_system.particle_list[axix_data['axis_particle_idx']]
-            axis_vector = Vector((axix_data['axis_vector'][0], axix_data['axis_vector'][1], axix_data['axis_vector'][2]))
-            self.axis_list.append((axis_particle, axis_vector))
+        if 'axis_idx_array' in json_data:
+            self.axis_list = list(zip(array_dict[json_data['axis_idx_array']].tolist(), map(tuple, array_dict[json_data['axis_vector_array']].tolist())))
+        else:
+            for axix_data in json_data['axis_list']:
+                self.axis_list.append((axix_data['axis_particle_idx'], tuple(axix_data['axis_vector'])))
+        self.axis_idx_array = None
 
 class PlaneConstraint(Constraint):
     def __init__(self):
         self.type = 'pre'
         self.plane_list = []
+        self.plane_idx_array = None
+        self.plane_vector_array = None
 
-    def add_pin(self, particle, plane_axis='xy'):
-        plane_vector = Vector((1.0, 1.0, 1.0))
+    def add_pin(self, particle_idx, plane_axis='xy'):
+        plane_vector = [1.0, 1.0, 1.0]
         if 'x' not in plane_axis.lower():
             plane_vector[0] = 0.0
         if 'y' not in plane_axis.lower():
             plane_vector[1] = 0.0
         if 'z' not in plane_axis.lower():
             plane_vector[2] = 0.0
-        self.plane_list.append((particle, plane_vector))
+        self.plane_list.append((particle_idx, tuple(plane_vector)))
+        self.plane_idx_array = None
+
+    def get_plane_array(self):
+        if self.plane_idx_array is None:
+            self.plane_idx_array = np.array([plane[0] for plane in self.plane_list], dtype=np.int64)
+            self.plane_vector_array = np.array([plane[1] for plane in self.plane_list], dtype=np.float64).reshape(-1, 3)
+        return self.plane_idx_array, self.plane_vector_array
+
+    def remap_particles(self, idx_map):
+        self.plane_list = remap_idx_list(self.plane_list, idx_map)
+        self.plane_idx_array = None
+        return True
 
     def apply_constraint(self, particle_system):
-        for pin in self.plane_list:
-            particle, plane_vector = pin
-            particle.velocity = particle.velocity * plane_vector
-            particle.force = Vector((0.0, 0.0, 0.0))
+        plane_idx_array, plane_vector_array = self.get_plane_array()
+        particle_system.velocity[plane_idx_array] *= plane_vector_array
+        particle_system.force[plane_idx_array] = 0.0
+
+    def prepare_step(self, particle_system):
+        plane_idx_array, plane_vector_array = self.get_plane_array()
+        particle_system.velocity[plane_idx_array] *= plane_vector_array
 
-    def save_constraint(self, particle_system):
+    def apply_stage(self, particle_system):
+        # Without force the velocity masked in prepare_step stays masked over the stages
+        particle_system.force[self.get_plane_array()[0]] = 0.0
+
+    def save_constraint(self, particle_system, array_dict=None):
         json_data = {}
         json_data['constraint_name'] = 'plane_constraint'
+        if array_dict != None:
+            plane_idx_array, plane_vector_array = self.get_plane_array()
+            json_data['plane_idx_array'] = store_array(array_dict, 'plane_idx', plane_idx_array)
+            json_data['plane_vector_array'] = store_array(array_dict, 'plane_vector', plane_vector_array)
+            return json_data
         plane_list_data = []
         for plane in self.plane_list:
             plane_data = {}
-            plane_data['plane_particle_idx'] = particle_system.get_particle_idx(plane[0])
-            plane_data['plane_vector'] = [plane[1].x, plane[1].y, plane[1].z]
+            plane_data['plane_particle_idx'] = int(plane[0])
+            plane_data['plane_vector'] = [plane[1][0], plane[1][1], plane[1][2]]
             plane_list_data.append(plane_data)
         json_data['plane_list'] = plane_list_data
         return json_data
 
-    def load_constraint(self, json_data, particle_system):
+    def load_constraint(self, json_data, particle_system, array_dict=None):
         self.plane_list = []
-        for plane_data in json_data['plane_list']:
-            plane_particle = particle_system.particle_list[plane_data['plane_particle_idx']]
-            plane_vector = Vector((plane_data['plane_vector'][0], plane_data['plane_vector'][1], plane_data['plane_vector'][2]))
-            self.plane_list.append((plane_particle, plane_vector))
+        if 'plane_idx_array' in json_data:
+            self.plane_list = list(zip(array_dict[json_data['plane_idx_array']].tolist(), map(tuple, array_dict[json_data['plane_vector_array']].tolist())))
+        else:
+            for plane_data in json_data['plane_list']:
+                self.plane_list.append((plane_data['plane_particle_idx'], tuple(plane_data['plane_vector'])))
+        self.plane_idx_array = None
+
+def color_triples(triple_array):
+    # Greedy coloring so that no two triples of a color share a particle, returns the order that
+    # groups the triples by color and the batch bounds into it
+    triple_color = np.zeros(triple_array.shape[0], dtype=np.int64)
+    particle_color_dict = {}
+    for k, triple in enumerate(triple_array.tolist()):
+        used_color_set = set()
+        for particle_idx in triple:
+            used_color_set |= particle_color_dict.get(particle_idx, set())
+        color = 0
+        while color in used_color_set:
+            color += 1
+        triple_color[k] = color
+        for particle_idx in triple:
+            particle_color_dict.setdefault(particle_idx, set()).add(color)
+    order = np.argsort(triple_color, kind='stable')
+    batch_bounds = np.searchsorted(triple_color[order], np.arange(triple_color.max(initial=-1) + 2))
+    return order, batch_bounds
 
 class AngularConstraint(Constraint):
     # https://www.cs.rpi.edu/~cutler/classes/advancedgraphics/S07/final_projects/mulley_bittarelli.pdf
-    # FIXME bug
     def __init__(self):
         self.type = 'post'
         self.axis_particle_idx = None
@@ -151,7 +279,7 @@ class AngularConstraint(Constraint):
         row.prop(context.scene.angular_constraint, "max_angle", text="Max angle")
         AngularConstraintProp.angular_constraint_reference = self
 
-    def save_constraint(self, particle_system):
+    def save_constraint(self, particle_system, array_dict=None):
         json_data = {}
         json_data['constraint_name'] = 'angular_constraint'
         json_data['axis_particle_idx'] = self.axis_particle_idx
@@ -161,7 +289,7 @@ class AngularConstraint(Constraint):
         json_data['max_angle'] = self.max_angle
         return json_data
 
-    def load_constraint(self, json_data, particle_system):
+    def load_constraint(self, json_data, particle_system, array_dict=None):
         self.axis_particle_idx = json_data['axis_particle_idx']
         self.pair_particle_idx = json_data['pair_particle_idx_1'], json_data['pair_particle_idx_2']
         self.min_angle = json_data['min_angle']
@@ -179,56 +307,129 @@ class AngularConstraint(Constraint):
     def assign_max_angle(self, max_angle):
         self.max_angle = max_angle
 
+    def remap_particles(self, idx_map):
+        # Dropped as a whole once one of its three particles is gone
+        particle_idx_list = [self.axis_particle_idx, self.pair_particle_idx[0], self.pair_particle_idx[1]]
+        if any(idx_map[particle_idx] < 0 for particle_idx in particle_idx_list):
+            return False
+        self.axis_particle_idx = int(idx_map[self.axis_particle_idx])
+        self.pair_particle_idx = int(idx_map[self.pair_particle_idx[0]]), int(idx_map[self.pair_particle_idx[1]])
+        return True
+
+    def apply_constraint(self, particle_system):
+        particle_system.kernels.angular_constraint(particle_system.location, self.axis_particle_idx, self.pair_particle_idx[0],
+                                                   self.pair_particle_idx[1], self.min_angle, self.max_angle)
+
+class BatchAngularConstraint(Constraint):
+    # Many angular constraints (rope and chain rigs) solved together, see AngularConstraint. The (K, 3)
+    # (axis, pair, pair) index array and the angle arrays are the storage, in the order they were added,
+    # add_triple collects into lists that are merged on the next use
+    def __init__(self, iterations=4, stiffness=0.5):
+        self.type = 'post'
+        self.triple_array = np.zeros((0, 3), dtype=np.int64)
+        self.min_angle_array = np.zeros(0, dtype=np.float64)
+        self.max_angle_array = np.zeros(0, dtype=np.float64)
+        self.pending_triple_list = []
+        self.pending_angle_list = []
+        self.iterations = iterations
+        # Fraction of the angle error corrected per iteration, full corrections overshoot along chains
+        self.stiffness = stiffness
+        self.batch_array = None
+
+    def draw(self, context, layout):
+        row = layout.row()
+        row.label(text=str(self.get_triple_array()[0].shape[0]) + " angular constraints, " + str(self.iterations) + " iterations, stiffness " + str(self.stiffness))
+
+    def add_triple(self, axis_particle_idx, pair_particle_idx_1, pair_particle_idx_2, min_angle=0.3, max_angle=0.9):
+        self.pending_triple_list.append((axis_particle_idx, pair_particle_idx_1, pair_particle_idx_2))
+        self.pending_angle_list.append((min_angle, max_angle))
+        self.batch_array = None
+
+    def add_triple_array(self, triple_array, min_angle=0.3, max_angle=0.9):
+        # Bulk add_triple for (K, 3) index rows, the angles broadcast against them
+        triple_array = np.asarray(triple_array, dtype=np.int64).reshape(-1, 3)
+        triple_count = triple_array.shape[0]
+        old_triple_array, old_min_angle_array, old_max_angle_array = self.get_triple_array()
+        self.triple_array = np.concatenate((old_triple_array, triple_array))
+        self.min_angle_array = np.concatenate((old_min_angle_array, np.broadcast_to(np.asarray(min_angle, dtype=np.float64), (triple_count,))))
+        self.max_angle_array = np.concatenate((old_max_angle_array, np.broadcast_to(np.asarray(max_angle, dtype=np.float64), (triple_count,))))
+        self.batch_array = None
+
+    def get_triple_array(self):
+        if len(self.pending_triple_list) > 0:
+            pending_angle_array = np.array(self.pending_angle_list, dtype=np.float64)
+            self.triple_array = np.concatenate((self.triple_array, np.array(self.pending_triple_list, dtype=np.int64)))
+            self.min_angle_array = np.concatenate((self.min_angle_array, pending_angle_array[:, 0]))
+            self.max_angle_array = np.concatenate((self.max_angle_array, pending_angle_array[:, 1]))
+            self.pending_triple_list = []
+            self.pending_angle_list = []
+        return self.triple_array, self.min_angle_array, self.max_angle_array
+
+    def get_batch_array(self):
+        # The arrays in batch order and the batch bounds, cached until the triples change
+        if self.batch_array is None:
+            triple_array, min_angle_array, max_angle_array = self.get_triple_array()
+            order, batch_bounds = color_triples(triple_array)
+            self.batch_array = triple_array[order], min_angle_array[order], max_angle_array[order], batch_bounds
+        return self.batch_array
+
+    def remap_particles(self, idx_map):
+        # Dropped once every triple it had is gone
+        old_triple_array, min_angle_array, max_angle_array = self.get_triple_array()
+        triple_array = idx_map[old_triple_array]
+        is_kept = (triple_array >= 0).all(axis=1)
+        self.triple_array = triple_array[is_kept]
+        self.min_angle_array = min_angle_array[is_kept]
+        self.max_angle_array = max_angle_array[is_kept]
+        self.batch_array = None
+        return triple_array.shape[0] == 0 or np.any(is_kept)
+
     def apply_constraint(self, particle_system):
-        #0.24 0.34
-        axis_particle = particle_system.particle_list[self.axis_particle_idx]
-        pair_particle = particle_system.particle_list[self.pair_particle_idx[0]], particle_system.particle_list[
-            self.pair_particle_idx[1]]
-        vector_1 = pair_particle[0].location - axis_particle.location
-        vector_2 = pair_particle[1].location - axis_particle.location
-        angle_val = vector_1.angle(vector_2)
-        if angle_val < 1e-9:
+        triple_array, min_angle_array, max_angle_array, batch_bounds = self.get_batch_array()
+        if triple_array.shape[0] == 0:
             return
-        if angle_val < self.min_angle:
-            # v1.rotation_difference(v2) is the diff that rotate from v1 to v2
-            da = (self.min_angle - angle_val) / (2 * angle_val)
-            rotate_diff = vector_2.rotation_difference(vector_1)
-            vector_1_rotated = vector_1.copy()
-            da_temp = da
-            while da_temp >= 1:
-                vector_1_rotated.rotate(Quaternion().slerp(rotate_diff, 1.0))
-                da_temp -= 1.0
-            vector_1_rotated.rotate(Quaternion().slerp(rotate_diff, da_temp))
-            pair_particle[0].location = axis_particle.location + vector_1_rotated
-
-            rotate_diff = vector_1.rotation_difference(vector_2)
-            vector_2_rotated = vector_2.copy()
-            da_temp = da
-            while da_temp >= 1:
-                vector_2_rotated.rotate(Quaternion().slerp(rotate_diff, 1.0))
-                da_temp -= 1.0
-            vector_2_rotated.rotate(Quaternion().slerp(rotate_diff, da_temp))
-            pair_particle[1].location = axis_particle.location + vector_2_rotated
-        elif angle_val > self.max_angle:
-            da = (angle_val - self.max_angle) / (2 * angle_val)
-            rotate_diff = vector_1.rotation_difference(vector_2)
-            vector_1_rotated = vector_1.copy()
-            da_temp = da
-            while da_temp >= 1:
-                vector_1_rotated.rotate(Quaternion().slerp(rotate_diff, 1.0))
-                da_temp -= 1.0
-            vector_1_rotated.rotate(Quaternion().slerp(rotate_diff, da_temp))
-            pair_particle[0].location = axis_particle.location + vector_1_rotated
-
-            rotate_diff = vector_2.rotation_difference(vector_1)
-            vector_2_rotated = vector_2.copy()
-            da_temp = da
-            while da_temp >= 1:
-                vector_2_rotated.rotate(Quaternion().slerp(rotate_diff, 1.0))
-                da_temp -= 1.0
-            vector_2_rotated.rotate(Quaternion().slerp(rotate_diff, da_temp))
-            pair_particle[1].location = axis_particle.location + vector_2_rotated
-
-        vector_1 = pair_particle[0].location - axis_particle.location
-        vector_2 = pair_particle[1].location - axis_particle.location
-        angle_val = vector_1.angle(vector_2)
+        for iteration in range(self.iterations):
+            particle_system.kernels.angular_constraint_batch(particle_system.location, triple_array, min_angle_array, max_angle_array, batch_bounds, self.stiffness)
+
+    def save_constraint(self, particle_system, array_dict=None):
+        json_data = {}
+        json_data['constraint_name'] = 'batch_angular_constraint'
+        json_data['iterations'] = self.iterations
+        json_data['stiffness'] = self.stiffness
+        triple_array, min_angle_array, max_angle_array = self.get_triple_array()
+        if array_dict != None:
+            # Saved in the order they were added, the coloring is redone on load
+            json_data['triple_array'] = store_array(array_dict, 'triple', triple_array)
+            json_data['min_angle_array'] = store_array(array_dict, 'min_angle', min_angle_array)
+            json_data['max_angle_array'] = store_array(array_dict, 'max_angle', max_angle_array)
+            return json_data
+        json_data['triple_list'] = triple_array.tolist()
+        json_data['min_angle_list'] = min_angle_array.tolist()
+        json_data['max_angle_list'] = max_angle_array.tolist()
+        return json_data
+
+    def load_constraint(self, json_data, particle_system, array_dict=None):
+        self.iterations = json_data['iterations']
+        self.stiffness = json_data['stiffness']
+        if 'triple_array' in json_data:
+            triple_array = array_dict[json_data['triple_array']]
+            min_angle_array = array_dict[json_data['min_angle_array']]
+            max_angle_array = array_dict[json_data['max_angle_array']]
+        else:
+            triple_array = json_data['triple_list']
+            min_angle_array = json_data['min_angle_list']
+            max_angle_array = json_data['max_angle_list']
+        self.triple_array = np.asarray(triple_array, dtype=np.int64).reshape(-1, 3)
+        self.min_angle_array = np.asarray(min_angle_array, dtype=np.float64).reshape(-1)
+        self.max_angle_array = np.asarray(max_angle_array, dtype=np.float64).reshape(-1)
+        self.pending_triple_list = []
+        self.pending_angle_list = []
+        self.batch_array = None
+
+CONSTRAINT_TYPES = {
+    'pin_constraint': PinConstraint,
+    'axis_constraint': AxisConstraint,
+    'plane_constraint': PlaneConstraint,
+    'angular_constraint': AngularConstraint,
+    'batch_angular_constraint': BatchAngularConstraint,
+}
@@ -1,13 +1,14 @@
 import bpy
-from mathutils import Vector
 
 
 def update_particle_prop(self, context):
-    ParticleProp.particle_reference.mass = bpy.context.scene.particle_property.init_mass.__getitem__(0)
-    getitem_func = bpy.context.scene.particle_property.init_location.__getitem__
-    ParticleProp.particle_reference.location = Vector((getitem_func(0), getitem_func(1), getitem_func(2)))
-    getitem_func = bpy.context.scene.particle_property.init_velocity.__getitem__
-    ParticleProp.particle_reference.velocity = Vector((getitem_func(0), getitem_func(1), getitem_func(2)))
+    # self is the scene's particle_property, the values go straight to the row of the initial state
+    particle = ParticleProp.particle_reference
+    if particle == None:
+        return
+    particle.location = self.init_location[:]
+    particle.velocity = self.init_velocity[:]
+    particle.mass = self.init_mass[0]
 
 
 class ParticleProp(bpy.types.PropertyGroup):
@@ -15,6 +16,8 @@ class ParticleProp(bpy.types.PropertyGroup):
     init_velocity: bpy.props.FloatVectorProperty(size=3, update=update_particle_prop)
     init_mass: bpy.props.FloatVectorProperty(size=1, update=update_particle_prop)
     particle_reference = None
+    # (particle system id, particle index, revision) the fields were last written for, see ParticleSystem.draw
+    draw_key = None
 
 def update_constant_force_prop(self, context):
     getitem_func = bpy.context.scene.constant_force_vector.constant_force_vector.__getitem__
@@ -0,0 +1,255 @@
+from .parallel import ParticleRows
+from .scene_file import read_scene
+from .profiler import stage_name
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import traceback
+
+# Domain decomposed bakes of one simulation over worker processes. The state buffers live in shared memory
+# so every process sees the locations the solver just wrote. Every step the particles are split into slabs
+# along the longest axis of their bounding box with the same count in each, slab k belongs to worker k.
+# On every force evaluation each worker adds the per particle forces and the coherent forces that split
+# (springs, fluid) for its own rows, reading the rows of the other slabs it needs (spring ends, fluid
+# neighbors) straight from shared memory, and writes its rows of the force buffer. The main process sends
+# one command line to every worker and waits for every reply, which is the barrier between the stages.
+# Forces that need all particles, the constraints, the collisions, the emitters and the solver stay in the
+# main process. Workers sum the same terms in the same order as a serial bake, with deterministic mode on
+# the bake cache is bitwise the one of the serial bake. Workers are plain python processes started with
+#   python -m particle.domain
+# from the addon directory, as the bake queue workers.
+SHARED_BUFFER_NAMES = ('location', 'velocity', 'force', 'mass', 'alive')
+
+
+def attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before python 3.13 attaching registers the block with the resource tracker of this process,
+        # which would unlink it when the worker exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class DomainPart:
+    # Rows of one slab at the current step
+    def __init__(self, slab_idx, axis, owner):
+        self.slab_idx = slab_idx
+        self.axis = axis
+        self.is_owned = owner == slab_idx
+        self.owned_idx = np.flatnonzero(self.is_owned)
+
+
+def get_owner(location, axis, bounds):
+    # Slab of every row, NaN locations end up in the last one
+    return np.searchsorted(np.asarray(bounds, dtype=np.float64), location[:, axis], side='right')
+
+
+class DomainBake:
+    def __init__(self, process_count=2, python_executable=None):
+        self.process_count = process_count
+        self.python_executable = python_executable
+        self.process_list = []
+        self.shm_dict = {}
+        self.scene_dir = None
+        self.step_idx = 0
+        self.axis = 0
+        self.bounds = []
+
+    def is_running(self):
+        return len(self.process_list) > 0
+
+    def start(self, particle_system):
+        # Moves the state into shared memory and starts the workers, call after reset_state
+        state = particle_system.state
+        for name in SHARED_BUFFER_NAMES:
+            buffer = state.get_buffer(name)
+            shm = shared_memory.SharedMemory(create=True, size=max(buffer.nbytes, 1))
+            shared_buffer = np.ndarray(buffer.shape, dtype=buffer.dtype, buffer=shm.buf)
+            shared_buffer[:] = buffer
+            state.set_buffer(name, shared_buffer)
+            self.shm_dict[name] = shm
+        self.scene_dir = tempfile.mkdtemp(prefix='particle_domain_')
+        scene_filepath = os.path.join(self.scene_dir, 'scene.json')
+        particle_system.save_system(scene_filepath)
+
+        python_executable = self.python_executable if self.python_executable != None else sys.executable
+        addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS'):
+            env[name] = '1'
+        env['PYTHONPATH'] = addon_dir + os.pathsep + env.get('PYTHONPATH', '')
+        setup = {}
+        setup['scene_filepath'] = scene_filepath
+        setup['backend'] = particle_system.backend
+        setup['buffers'] = {name: [self.shm_dict[name].name, list(state.get_buffer(name).shape), state.get_buffer(name).dtype.str]
+                            for name in SHARED_BUFFER_NAMES}
+        for slab_idx in range(self.process_count):
+            process = subprocess.Popen([python_executable, '-m', 'particle.domain'], cwd=addon_dir, env=env,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            self.process_list.append(process)
+            setup['slab_idx'] = slab_idx
+            process.stdin.write(json.dumps(setup) + '\n')
+            process.stdin.flush()
+        self.wait_all()
+        self.step_idx = 0
+
+    def stop(self, particle_system):
+        # Stops the workers and moves the state back into private arrays
+        for process in self.process_list:
+            if process.poll() == None:
+                try:
+                    process.stdin.write(json.dumps({'command': 'stop'}) + '\n')
+                    process.stdin.close()
+                except OSError:
+                    pass
+        for process in self.process_list:
+            process.wait()
+            process.stdout.close()
+        self.process_list = []
+        state = particle_system.state
+        for name, shm in self.shm_dict.items():
+            state.set_buffer(name, np.array(state.get_buffer(name)))
+            shm.close()
+            shm.unlink()
+        self.shm_dict = {}
+        if self.scene_dir != None:
+            shutil.rmtree(self.scene_dir, ignore_errors=True)
+            self.scene_dir = None
+
+    def wait_all(self):
+        # Barrier: returns once every worker has answered the last command
+        for process in self.process_list:
+            line = process.stdout.readline()
+            if line == '':
+                raise RuntimeError('domain worker exited with code ' + str(process.wait()))
+            reply = json.loads(line)
+            if 'error' in reply:
+                raise RuntimeError('domain worker failed:\n' + reply['error'])
+
+    def split(self, particle_system):
+        # Slabs of equal particle count along the longest axis, fixed for the step
+        location = particle_system.location
+        self.step_idx += 1
+        if location.shape[0] == 0:
+            self.axis = 0
+            self.bounds = []
+            return
+        self.axis = int(np.argmax(location.max(axis=0) - location.min(axis=0)))
+        coordinate = np.sort(location[:, self.axis])
+        bound_idx = (np.arange(1, self.process_count) * coordinate.shape[0]) // self.process_count
+        self.bounds = coordinate[bound_idx].tolist()
+
+    def apply_forces(self, particle_system):
+        # The per particle forces and the coherent forces in list order, runs of forces that split go to the
+        # workers and the others are applied here in between
+        coherent_idx_list = []
+        is_first = True
+        for i, coherent_force in enumerate(particle_system.coherent_force_list):
+            if coherent_force.domain_split:
+                coherent_idx_list.append(i)
+                continue
+            self.apply_round(particle_system, is_first, coherent_idx_list)
+            is_first = False
+            coherent_idx_list = []
+            with particle_system.profiler.stage(stage_name('derivative_eval/coherent_force', i, coherent_force)):
+                coherent_force.apply_force(particle_system)
+        if is_first or len(coherent_idx_list) > 0:
+            self.apply_round(particle_system, is_first, coherent_idx_list)
+
+    def apply_round(self, particle_system, is_first, coherent_idx_list):
+        with particle_system.profiler.stage('derivative_eval/domain/workers'):
+            command = {}
+            command['command'] = 'force'
+            command['count'] = particle_system.state.count
+            command['step_idx'] = self.step_idx
+            command['axis'] = self.axis
+            command['bounds'] = self.bounds
+            command['is_first'] = is_first
+            command['coherent_idx_list'] = coherent_idx_list
+            line = json.dumps(command) + '\n'
+            for process in self.process_list:
+                process.stdin.write(line)
+                process.stdin.flush()
+            self.wait_all()
+
+
+def run_domain_worker(input_stream, output_stream):
+    # particle_system.py imports this module
+    from .particle_system import ParticleSystem
+    setup = json.loads(input_stream.readline())
+    slab_idx = setup['slab_idx']
+    shm_list = []
+    try:
+        json_data, array_dict = read_scene(setup['scene_filepath'])
+        # The main process keeps the constraints, the collisions and the emitters
+        json_data['constraint_list'] = []
+        json_data['collision_list'] = []
+        json_data['emitter_list'] = []
+        p_system = ParticleSystem()
+        p_system.load_scene_data(json_data, array_dict)
+        p_system.set_backend(setup['backend'])
+        p_system.set_num_threads(1)
+        state = p_system.state
+        for name, (shm_name, shape, dtype) in setup['buffers'].items():
+            shm = attach_shared_memory(shm_name)
+            shm_list.append(shm)
+            shared_buffer = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+            if name == 'force':
+                # Forces are summed in a private buffer, only the owned rows are written back
+                shared_force = shared_buffer
+                state.set_buffer(name, np.zeros_like(shared_buffer))
+            else:
+                state.set_buffer(name, shared_buffer)
+    except Exception:
+        output_stream.write(json.dumps({'error': traceback.format_exc()}) + '\n')
+        output_stream.flush()
+        return
+    output_stream.write(json.dumps({'slab_idx': slab_idx}) + '\n')
+    output_stream.flush()
+
+    domain_part = None
+    step_idx = None
+    for line in input_stream:
+        command = json.loads(line)
+        if command['command'] == 'stop':
+            break
+        try:
+            state.count = command['count']
+            if command['step_idx'] != step_idx:
+                step_idx = command['step_idx']
+                domain_part = DomainPart(slab_idx, command['axis'], get_owner(state.location, command['axis'], command['bounds']))
+            owned_idx = domain_part.owned_idx
+            if command['is_first']:
+                particle_rows = ParticleRows(p_system, owned_idx)
+                for force in p_system.force_list:
+                    force.apply_force(particle_rows)
+                state.force[owned_idx] = particle_rows.force
+            else:
+                state.force[owned_idx] = shared_force[owned_idx]
+            for coherent_idx in command['coherent_idx_list']:
+                p_system.coherent_force_list[coherent_idx].apply_domain_force(p_system, domain_part)
+            shared_force[owned_idx] = state.force[owned_idx]
+            reply = {'owned_count': int(owned_idx.shape[0])}
+        except Exception:
+            reply = {'error': traceback.format_exc()}
+        output_stream.write(json.dumps(reply) + '\n')
+        output_stream.flush()
+
+    p_system.executor.shutdown()
+    for name in SHARED_BUFFER_NAMES:
+        # Drop the views before closing the blocks
+        state.set_buffer(name, np.zeros((0,)))
+    shared_force = None
+    for shm in shm_list:
+        shm.close()
+
+
+if __name__ == '__main__':
+    run_domain_worker(sys.stdin, sys.stdout)
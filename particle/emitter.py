@@ -0,0 +1,269 @@
+try:
+    import bpy
+except ImportError:
+    bpy = None
+import numpy as np
+
+# Particle sources for effects work. Emitted particles live in a pool of rows reserved after the
+# initial particles when the state is reset, so the state arrays never reallocate during a bake.
+
+
+class ParticlePool:
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+        self.reset_pool(0)
+
+    def reset_pool(self, base_count):
+        # Pool row k is state row base_count + k
+        self.base_count = base_count
+        self.free_stack = np.zeros(self.capacity, dtype=np.int64)
+        self.free_count = 0
+        self.age = np.zeros(self.capacity)
+        self.lifetime = np.zeros(self.capacity)
+        self.park_location = np.zeros((self.capacity, 3))
+        self.dropped_count = 0
+
+    def move_base(self, base_count):
+        # Initial particles were added or removed in front of the pool, its rows move with them
+        self.free_stack[:self.free_count] += base_count - self.base_count
+        self.base_count = base_count
+
+    def reset(self, particle_system):
+        state = particle_system.state
+        state.reserve(state.count + self.capacity)
+        self.reset_pool(state.count)
+
+    def spawn(self, particle_system, location_array, velocity_array, mass_array, lifetime_array):
+        # Takes rows from the free list first, then unused pool rows. Particles that don't fit are dropped
+        state = particle_system.state
+        recycle_count = min(location_array.shape[0], self.free_count)
+        row_array = self.free_stack[self.free_count - recycle_count:self.free_count].copy()
+        self.free_count -= recycle_count
+        grow_count = min(location_array.shape[0] - recycle_count, self.base_count + self.capacity - state.count)
+        # Within the reserved capacity, resize doesn't reallocate
+        row_array = np.concatenate((row_array, np.arange(state.count, state.count + grow_count)))
+        state.resize(state.count + grow_count)
+        spawn_count = row_array.shape[0]
+        self.dropped_count += location_array.shape[0] - spawn_count
+
+        state.location[row_array] = location_array[:spawn_count]
+        state.velocity[row_array] = velocity_array[:spawn_count]
+        state.force[row_array] = 0.0
+        state.mass[row_array] = mass_array[:spawn_count]
+        state.alive[row_array] = True
+        state.particle_id[row_array] = state.new_ids(spawn_count)
+        state.still_frames[row_array] = 0
+        pool_idx_array = row_array - self.base_count
+        self.age[pool_idx_array] = 0.0
+        self.lifetime[pool_idx_array] = lifetime_array[:spawn_count]
+        particle_system.solver.spawn_particles(particle_system, row_array)
+        return row_array
+
+    def get_dead_idx(self, particle_system):
+        state = particle_system.state
+        return np.flatnonzero(~state.alive[self.base_count:]) + self.base_count
+
+    def park(self, particle_system):
+        # Dead rows go through the solver with the others, put them back where they expired
+        dead_idx_array = self.get_dead_idx(particle_system)
+        particle_system.location[dead_idx_array] = self.park_location[dead_idx_array - self.base_count]
+        particle_system.velocity[dead_idx_array] = 0.0
+
+    def expire(self, particle_system, step):
+        state = particle_system.state
+        used_count = state.count - self.base_count
+        self.age[:used_count] += step
+        expired_pool_idx = np.flatnonzero(state.alive[self.base_count:] & (self.age[:used_count] > self.lifetime[:used_count]))
+        if expired_pool_idx.shape[0] == 0:
+            return
+        expired_idx = expired_pool_idx + self.base_count
+        state.alive[expired_idx] = False
+        state.velocity[expired_idx] = 0.0
+        self.park_location[expired_pool_idx] = state.location[expired_idx]
+        self.free_stack[self.free_count:self.free_count + expired_idx.shape[0]] = expired_idx
+        self.free_count += expired_idx.shape[0]
+
+    def get_alive_count(self, particle_system):
+        return int(np.count_nonzero(particle_system.state.alive))
+
+
+class Emitter:
+    def __init__(self, rate=100.0, lifetime=2.0, lifetime_spread=0.0, velocity=(0.0, 0.0, 0.0), velocity_spread=0.0,
+                 velocity_distribution='normal', mass=0.2, seed=0):
+        # rate is particles per second, lifetime_spread and velocity_spread are +- ranges ('uniform')
+        # or standard deviations ('normal') around lifetime and velocity
+        self.rate = rate
+        self.lifetime = lifetime
+        self.lifetime_spread = lifetime_spread
+        self.velocity = velocity
+        self.velocity_spread = velocity_spread
+        self.velocity_distribution = velocity_distribution
+        self.mass = mass
+        self.seed = seed
+        self.reset_emitter()
+
+    def reset_emitter(self):
+        self.rng = np.random.default_rng(self.seed)
+        self.emit_remainder = 0.0
+
+    def draw(self, context, layout):
+        row = layout.row()
+        row.label(text=type(self).__name__ + " " + str(self.rate) + " per second, lifetime " + str(self.lifetime))
+
+    def sample_location(self, count):
+        # (location_array, normal_array or None)
+        return np.zeros((count, 3)), None
+
+    def sample_spread(self, count, spread, shape):
+        if self.velocity_distribution == 'uniform':
+            return self.rng.uniform(-spread, spread, shape)
+        return self.rng.normal(0.0, spread, shape)
+
+    def sample_velocity(self, count, normal_array):
+        return np.asarray(self.velocity, dtype=np.float64) + self.sample_spread(count, self.velocity_spread, (count, 3))
+
+    def emit(self, particle_system, step):
+        # Fractional particles carry over so low rates still emit at the right average
+        self.emit_remainder += self.rate * step
+        count = int(self.emit_remainder)
+        self.emit_remainder -= count
+        if count == 0:
+            return
+        location_array, normal_array = self.sample_location(count)
+        velocity_array = self.sample_velocity(count, normal_array)
+        lifetime_array = np.maximum(self.lifetime + self.sample_spread(count, self.lifetime_spread, count), 0.0)
+        particle_system.pool.spawn(particle_system, location_array, velocity_array, np.full(count, self.mass), lifetime_array)
+
+    def save_emitter(self):
+        json_data = {}
+        json_data['rate'] = self.rate
+        json_data['lifetime'] = self.lifetime
+        json_data['lifetime_spread'] = self.lifetime_spread
+        json_data['velocity'] = [self.velocity[0], self.velocity[1], self.velocity[2]]
+        json_data['velocity_spread'] = self.velocity_spread
+        json_data['velocity_distribution'] = self.velocity_distribution
+        json_data['mass'] = self.mass
+        json_data['seed'] = self.seed
+        return json_data
+
+    def load_emitter(self, json_data):
+        self.rate = json_data['rate']
+        self.lifetime = json_data['lifetime']
+        self.lifetime_spread = json_data['lifetime_spread']
+        self.velocity = tuple(json_data['velocity'])
+        self.velocity_spread = json_data['velocity_spread']
+        self.velocity_distribution = json_data['velocity_distribution']
+        self.mass = json_data['mass']
+        self.seed = json_data['seed']
+        self.reset_emitter()
+
+
+class PointEmitter(Emitter):
+    def __init__(self, location=(0.0, 0.0, 0.0), **kwargs):
+        self.location = location
+        super().__init__(**kwargs)
+
+    def sample_location(self, count):
+        return np.tile(np.asarray(self.location, dtype=np.float64), (count, 1)), None
+
+    def save_emitter(self):
+        json_data = super().save_emitter()
+        json_data['emitter_name'] = 'point_emitter'
+        json_data['location'] = [self.location[0], self.location[1], self.location[2]]
+        return json_data
+
+    def load_emitter(self, json_data):
+        self.location = tuple(json_data['location'])
+        super().load_emitter(json_data)
+
+
+class VolumeEmitter(Emitter):
+    # Uniform inside an axis aligned box
+    def __init__(self, center=(0.0, 0.0, 0.0), size=(1.0, 1.0, 1.0), **kwargs):
+        self.center = center
+        self.size = size
+        super().__init__(**kwargs)
+
+    def sample_location(self, count):
+        return np.asarray(self.center) + (self.rng.random((count, 3)) - 0.5) * np.asarray(self.size), None
+
+    def save_emitter(self):
+        json_data = super().save_emitter()
+        json_data['emitter_name'] = 'volume_emitter'
+        json_data['center'] = [self.center[0], self.center[1], self.center[2]]
+        json_data['size'] = [self.size[0], self.size[1], self.size[2]]
+        return json_data
+
+    def load_emitter(self, json_data):
+        self.center = tuple(json_data['center'])
+        self.size = tuple(json_data['size'])
+        super().load_emitter(json_data)
+
+
+class MeshSurfaceEmitter(Emitter):
+    # Uniform over the surface of a mesh object, normal_velocity adds speed along the face normal
+    def __init__(self, ob=None, normal_velocity=0.0, **kwargs):
+        self.normal_velocity = normal_velocity
+        self.set_object(ob)
+        super().__init__(**kwargs)
+
+    def set_object(self, ob):
+        self.ob = ob
+        self.triangle_array = np.zeros((0, 3, 3))
+        self.triangle_cdf = np.zeros(0)
+        if ob == None:
+            return
+        # Triangles in world space, captured once when the emitter is created
+        mesh = ob.data
+        mesh.calc_loop_triangles()
+        location_array = np.empty(len(mesh.vertices) * 3)
+        mesh.vertices.foreach_get("co", location_array)
+        matrix_world = np.array(ob.matrix_world)
+        location_array = location_array.reshape(-1, 3) @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+        triangle_idx_array = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int64)
+        mesh.loop_triangles.foreach_get("vertices", triangle_idx_array)
+        self.triangle_array = location_array[triangle_idx_array.reshape(-1, 3)]
+        edge_1 = self.triangle_array[:, 1] - self.triangle_array[:, 0]
+        edge_2 = self.triangle_array[:, 2] - self.triangle_array[:, 0]
+        self.triangle_normal = np.cross(edge_1, edge_2)
+        area = np.sqrt(np.einsum('ij,ij->i', self.triangle_normal, self.triangle_normal))
+        self.triangle_normal /= np.maximum(area, 1e-12)[:, None]
+        self.triangle_cdf = np.cumsum(area)
+
+    def sample_location(self, count):
+        if self.triangle_cdf.shape[0] == 0 or self.triangle_cdf[-1] <= 0.0:
+            return np.zeros((count, 3)), np.zeros((count, 3))
+        triangle_idx = np.minimum(np.searchsorted(self.triangle_cdf, self.rng.random(count) * self.triangle_cdf[-1], side='right'),
+                                  self.triangle_cdf.shape[0] - 1)
+        # Uniform barycentric coordinates, samples outside the triangle are folded back in
+        u = self.rng.random(count)
+        v = self.rng.random(count)
+        is_outside = u + v > 1.0
+        u[is_outside] = 1.0 - u[is_outside]
+        v[is_outside] = 1.0 - v[is_outside]
+        triangle = self.triangle_array[triangle_idx]
+        location_array = triangle[:, 0] + u[:, None] * (triangle[:, 1] - triangle[:, 0]) + v[:, None] * (triangle[:, 2] - triangle[:, 0])
+        return location_array, self.triangle_normal[triangle_idx]
+
+    def sample_velocity(self, count, normal_array):
+        return super().sample_velocity(count, normal_array) + self.normal_velocity * normal_array
+
+    def save_emitter(self):
+        json_data = super().save_emitter()
+        json_data['emitter_name'] = 'mesh_surface_emitter'
+        json_data['object_name'] = self.ob.name if self.ob != None else ''
+        json_data['normal_velocity'] = self.normal_velocity
+        return json_data
+
+    def load_emitter(self, json_data):
+        self.normal_velocity = json_data['normal_velocity']
+        if bpy == None and json_data['object_name'] != '':
+            raise RuntimeError("mesh surface emitter on " + json_data['object_name'] + " needs blender")
+        self.set_object(bpy.data.objects.get(json_data['object_name']) if bpy != None else None)
+        super().load_emitter(json_data)
+
+EMITTER_TYPES = {
+    'point_emitter': PointEmitter,
+    'volume_emitter': VolumeEmitter,
+    'mesh_surface_emitter': MeshSurfaceEmitter,
+}
@@ -0,0 +1,849 @@
+import numpy as np
+from scipy.spatial import cKDTree
+import math
+
+# Array kernels of the simulation hot paths. NumpyKernels is always available, NumbaKernels
+# compiles the loops that have sequential dependencies when numba is importable.
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    numba = None
+    HAS_NUMBA = False
+
+KERNEL_BACKENDS = ('numpy', 'numba')
+
+
+def find_contact_pairs(location, mass):
+    # Pairs (i < j) whose spheres of radius mass overlap, in the i-major order of the all pairs loop
+    if location.shape[0] < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    return filter_contact_pairs(location, mass, cKDTree(location).query_pairs(2.0 * float(mass.max()), output_type='ndarray'))
+
+
+def filter_contact_pairs(location, mass, candidate_pairs):
+    # The candidate pairs (i < j) whose spheres overlap, sorted as in find_contact_pairs
+    delta = location[candidate_pairs[:, 0]] - location[candidate_pairs[:, 1]]
+    radius = mass[candidate_pairs[:, 0]] + mass[candidate_pairs[:, 1]]
+    contact_pairs = candidate_pairs[np.einsum('ij,ij->i', delta, delta) <= radius * radius]
+    return contact_pairs[np.lexsort((contact_pairs[:, 1], contact_pairs[:, 0]))].astype(np.int64)
+
+
+def find_neighbor_pairs(location, radius):
+    # Pairs (i < j) closer than radius, sorted by i
+    if location.shape[0] < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    pair_array = cKDTree(location).query_pairs(radius, output_type='ndarray').astype(np.int64)
+    return pair_array[np.argsort(pair_array[:, 0], kind='stable')]
+
+
+def sph_kernel_constants(smoothing_length):
+    # Normalisations of the poly6, spiky gradient and viscosity laplacian kernels (Muller et al. 2003)
+    h = smoothing_length
+    return 315.0 / (64.0 * math.pi * h ** 9), -45.0 / (math.pi * h ** 6), 45.0 / (math.pi * h ** 6)
+
+
+def build_cell_grid(location, cell_size):
+    # Uniform grid in CSR form, the particles of cell key are cell_order[cell_start[key]:cell_start[key + 1]]
+    # Cells are grown for sparse scenes so there are at most about 8 per particle
+    min_location = location.min(axis=0)
+    extent = location.max(axis=0) - min_location
+    cell_size = max(cell_size, float(np.prod(extent + 1e-9) / (8.0 * location.shape[0])) ** (1.0 / 3.0))
+    cell = np.floor((location - min_location) / cell_size).astype(np.int64)
+    cell_dims = cell.max(axis=0) + 1
+    cell_key = (cell[:, 0] * cell_dims[1] + cell[:, 1]) * cell_dims[2] + cell[:, 2]
+    cell_order = np.argsort(cell_key, kind='stable')
+    cell_start = np.searchsorted(cell_key[cell_order], np.arange(np.prod(cell_dims) + 1))
+    return cell, cell_dims, cell_start, cell_order
+
+
+def swept_pair_candidates(previous_location, location, mass, find_pairs, executor=None):
+    # A sphere moving from previous_location to location stays within mass plus half its displacement
+    # of the midpoint, so pairs whose swept spheres can touch during the step are contacts of those
+    displacement = location - previous_location
+    midpoint = previous_location + 0.5 * displacement
+    sweep_radius = mass + 0.5 * np.sqrt(np.einsum('ij,ij->i', displacement, displacement))
+    if executor == None:
+        return find_pairs(midpoint, sweep_radius)
+    return find_pairs(midpoint, sweep_radius, executor)
+
+
+def time_of_impact(previous_location, location, mass, pair_array):
+    # Fraction of the step at which the spheres of each pair first touch when both move in a straight
+    # line, inf for pairs that don't meet or already overlap at the start (the end of step response handles those)
+    i = pair_array[:, 0]
+    j = pair_array[:, 1]
+    start_delta = previous_location[i] - previous_location[j]
+    motion_delta = (location[i] - previous_location[i]) - (location[j] - previous_location[j])
+    radius = mass[i] + mass[j]
+    a = np.einsum('ij,ij->i', motion_delta, motion_delta)
+    b = 2.0 * np.einsum('ij,ij->i', start_delta, motion_delta)
+    c = np.einsum('ij,ij->i', start_delta, start_delta) - radius * radius
+    discriminant = b * b - 4.0 * a * c
+    toi = np.full(pair_array.shape[0], np.inf)
+    is_hit = (c > 0.0) & (b < 0.0) & (discriminant >= 0.0)
+    toi[is_hit] = (-b[is_hit] - np.sqrt(discriminant[is_hit])) / (2.0 * a[is_hit])
+    toi[toi > 1.0] = np.inf
+    return toi
+
+
+def resolve_impacts(previous_location, location, velocity, mass, step, pair_array, toi):
+    # Earliest impacts first, a particle is resolved at most once per step. The pair is moved back to
+    # the contact, bounced as in particle_collision and then moves on for the rest of the step with the
+    # changed velocity. Returns which particles were resolved
+    is_resolved = np.zeros(location.shape[0], dtype=bool)
+    for k in np.argsort(toi, kind='stable').tolist():
+        t = toi[k]
+        if t == np.inf:
+            break
+        i, j = pair_array[k]
+        if is_resolved[i] or is_resolved[j]:
+            continue
+        displacement_i = location[i] - previous_location[i]
+        displacement_j = location[j] - previous_location[j]
+        contact_i = previous_location[i] + t * displacement_i
+        contact_j = previous_location[j] + t * displacement_j
+        normal = contact_i - contact_j
+        length = math.sqrt(np.dot(normal, normal))
+        if length == 0.0:
+            continue
+        normal /= length
+        a = 2 * np.dot(normal, velocity[i] - velocity[j]) / (1.0 / mass[i] + 1.0 / mass[j])
+        if a >= 0.0:
+            continue
+        velocity[i] -= (a / mass[i]) * normal
+        velocity[j] += (a / mass[j]) * normal
+        location[i] = contact_i + (1.0 - t) * (displacement_i - step * (a / mass[i]) * normal)
+        location[j] = contact_j + (1.0 - t) * (displacement_j + step * (a / mass[j]) * normal)
+        is_resolved[i] = True
+        is_resolved[j] = True
+    return is_resolved
+
+
+def particle_collision_response(location, velocity, mass, contact_pairs):
+    # Reference from https://www.sjsu.edu/faculty/watkins/collision.htm
+    # Each response changes the velocities seen by the following pairs, so this stays a loop
+    for i, j in contact_pairs.tolist():
+        normal = location[i] - location[j]
+        length = math.sqrt(np.dot(normal, normal))
+        if length == 0.0:
+            continue
+        normal /= length
+        a = 2 * np.dot(normal, velocity[i] - velocity[j]) / (1.0 / mass[i] + 1.0 / mass[j])
+        velocity[i] -= (a / mass[i]) * normal
+        velocity[j] += (a / mass[j]) * normal
+
+
+def rotate_vector(vector, axis, angle):
+    # Rodrigues rotation of vector around the unit axis
+    cos_angle = math.cos(angle)
+    sin_angle = math.sin(angle)
+    return vector * cos_angle + np.cross(axis, vector) * sin_angle + axis * (np.dot(axis, vector) * (1.0 - cos_angle))
+
+
+class NumpyKernels:
+    name = 'numpy'
+
+    @staticmethod
+    def spring_force(location, edge_array, rest_length_array, spring_constant, force):
+        #F = k(R – v_l) v/v_l
+        if edge_array.shape[0] == 0:
+            return
+        edge_force = np.empty((edge_array.shape[0], 3))
+        NumpyKernels.spring_edge_force(location, edge_array, rest_length_array, spring_constant, edge_force)
+        NumpyKernels.scatter_edge_force(edge_array, edge_force, force)
+
+    @staticmethod
+    def spring_edge_force(location, edge_array, rest_length_array, spring_constant, edge_force):
+        # Force on the first particle of every edge, the second one gets its opposite
+        location_vec = location[edge_array[:, 0]] - location[edge_array[:, 1]]
+        length = np.sqrt(np.einsum('ij,ij->i', location_vec, location_vec))
+        scale = np.divide(spring_constant * (rest_length_array - length), length, out=np.zeros_like(length), where=length > 0.0)
+        edge_force[:] = scale[:, None] * location_vec
+
+    @staticmethod
+    def scatter_edge_force(edge_array, edge_force, force):
+        # Adds the edge forces in edge order, whatever chunks they were computed in
+        particle_count = force.shape[0]
+        for axis in range(3):
+            force[:, axis] += np.bincount(edge_array[:, 0], edge_force[:, axis], minlength=particle_count)
+            force[:, axis] -= np.bincount(edge_array[:, 1], edge_force[:, axis], minlength=particle_count)
+
+    @staticmethod
+    def particle_collision(location, velocity, mass, executor=None):
+        particle_collision_response(location, velocity, mass, find_contact_pairs(location, mass))
+
+    @staticmethod
+    def particle_collision_response(location, velocity, mass, contact_pairs):
+        particle_collision_response(location, velocity, mass, contact_pairs)
+
+    @staticmethod
+    def swept_particle_collision(previous_location, location, velocity, mass, step, executor=None):
+        # Pairs that met during the step are resolved at their time of impact, the end of step
+        # response then only sees the contacts of the other particles
+        pair_array = swept_pair_candidates(previous_location, location, mass, find_contact_pairs)
+        is_resolved = resolve_impacts(previous_location, location, velocity, mass, step, pair_array,
+                                      time_of_impact(previous_location, location, mass, pair_array))
+        contact_pairs = find_contact_pairs(location, mass)
+        particle_collision_response(location, velocity, mass, contact_pairs[~is_resolved[contact_pairs].any(axis=1)])
+
+    @staticmethod
+    def wall_collision(location, velocity, wall_location, wall_normal):
+        projection = (wall_location - location) @ wall_normal
+        is_inside_wall = projection > 0
+        if not is_inside_wall.any():
+            return
+        location[is_inside_wall] += (2 * projection[is_inside_wall])[:, None] * wall_normal
+        inside_velocity = velocity[is_inside_wall]
+        velocity[is_inside_wall] = inside_velocity - (2 * (inside_velocity @ wall_normal))[:, None] * wall_normal
+
+    @staticmethod
+    def swept_wall_collision(previous_location, location, velocity, wall_location, wall_normal):
+        # Particles that crossed the wall during the step continue from the time of impact with the rest of
+        # their motion reflected, which for a plane ends on the mirror image of location. Particles already
+        # behind it at the start of the step are put back onto the wall instead of being mirrored through it
+        start_distance = (previous_location - wall_location) @ wall_normal
+        end_distance = (location - wall_location) @ wall_normal
+        is_crossing = (start_distance >= 0.0) & (end_distance < 0.0)
+        is_behind = (start_distance < 0.0) & (end_distance < 0.0)
+        if not (is_crossing.any() or is_behind.any()):
+            return
+        location[is_crossing] -= (2 * end_distance[is_crossing])[:, None] * wall_normal
+        crossing_velocity = velocity[is_crossing]
+        velocity[is_crossing] = crossing_velocity - (2 * (crossing_velocity @ wall_normal))[:, None] * wall_normal
+        location[is_behind] -= end_distance[is_behind][:, None] * wall_normal
+        behind_velocity = velocity[is_behind]
+        velocity[is_behind] = behind_velocity - np.minimum(behind_velocity @ wall_normal, 0.0)[:, None] * wall_normal
+
+    @staticmethod
+    def neighbor_pairs(location, radius, executor=None):
+        return find_neighbor_pairs(location, radius)
+
+    @staticmethod
+    def sph_density(location, mass, neighbor_list, smoothing_length):
+        # rho_i = sum_j m_j W_poly6(|x_i - x_j|), the particle itself included
+        poly6, spiky, viscosity_laplacian = sph_kernel_constants(smoothing_length)
+        h_square = smoothing_length * smoothing_length
+        density = mass * (poly6 * h_square ** 3)
+        i = neighbor_list.pair_array[:, 0]
+        j = neighbor_list.pair_array[:, 1]
+        delta = location[i] - location[j]
+        weight = poly6 * np.maximum(h_square - np.einsum('ij,ij->i', delta, delta), 0.0) ** 3
+        density += np.bincount(i, mass[j] * weight, minlength=location.shape[0])
+        density += np.bincount(j, mass[i] * weight, minlength=location.shape[0])
+        return density
+
+    @staticmethod
+    def sph_force(location, velocity, mass, density, pressure, neighbor_list, smoothing_length, viscosity, force):
+        # Pressure and viscosity in the pairwise symmetric form, what i gets j gets with the opposite sign
+        #   F_ij = -m_i m_j (p_i / rho_i^2 + p_j / rho_j^2) grad W_spiky + viscosity m_i m_j (v_j - v_i) / (rho_i rho_j) lap W_viscosity
+        poly6, spiky, viscosity_laplacian = sph_kernel_constants(smoothing_length)
+        i = neighbor_list.pair_array[:, 0]
+        j = neighbor_list.pair_array[:, 1]
+        delta = location[i] - location[j]
+        length = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        gap = np.maximum(smoothing_length - length, 0.0)
+        gradient_scale = np.divide(spiky * gap * gap, length, out=np.zeros_like(length), where=length > 0.0)
+        mass_product = mass[i] * mass[j]
+        pressure_scale = -mass_product * (pressure[i] / density[i] ** 2 + pressure[j] / density[j] ** 2) * gradient_scale
+        viscosity_scale = viscosity * mass_product / (density[i] * density[j]) * viscosity_laplacian * gap
+        pair_force = pressure_scale[:, None] * delta + viscosity_scale[:, None] * (velocity[j] - velocity[i])
+        particle_count = location.shape[0]
+        for axis in range(3):
+            force[:, axis] += np.bincount(i, pair_force[:, axis], minlength=particle_count)
+            force[:, axis] -= np.bincount(j, pair_force[:, axis], minlength=particle_count)
+
+    @staticmethod
+    def direct_field(location, mass, softening, field, executor=None):
+        # All pairs reference of Octree.get_field, in blocks of rows to bound the temporaries
+        particle_count = location.shape[0]
+        block_size = max(1, (1 << 20) // max(particle_count, 1))
+        softening_square = softening * softening
+
+        def field_chunk(chunk_idx, start, end):
+            for block_start in range(start, end, block_size):
+                block_end = min(block_start + block_size, end)
+                delta = location[None, :, :] - location[block_start:block_end, None, :]
+                distance_square = np.einsum('ijk,ijk->ij', delta, delta) + softening_square
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    scale = np.where(distance_square > 0.0, mass[None, :] / distance_square ** 1.5, 0.0)
+                scale[np.arange(block_end - block_start), np.arange(block_start, block_end)] = 0.0
+                field[block_start:block_end] += np.einsum('ij,ijk->ik', scale, delta)
+
+        if executor == None:
+            field_chunk(0, 0, particle_count)
+            return
+        executor.map(field_chunk, executor.split(particle_count))
+
+    @staticmethod
+    def barnes_hut_field(octree, theta, softening, field, executor=None):
+        # Chunks are ranges of the tree order, whose rows are disjoint in field
+        if executor == None:
+            octree.get_field(theta, softening, field)
+            return
+        executor.map(lambda chunk_idx, start, end: octree.get_field(theta, softening, field, start, end), executor.split(octree.order.shape[0]))
+
+    @staticmethod
+    def angular_constraint(location, axis_particle_idx, pair_particle_idx_1, pair_particle_idx_2, min_angle, max_angle):
+        # https://www.cs.rpi.edu/~cutler/classes/advancedgraphics/S07/final_projects/mulley_bittarelli.pdf
+        # Both arms are rotated in their common plane by half of the angle error
+        axis_location = location[axis_particle_idx]
+        vector_1 = location[pair_particle_idx_1] - axis_location
+        vector_2 = location[pair_particle_idx_2] - axis_location
+        length_1 = math.sqrt(np.dot(vector_1, vector_1))
+        length_2 = math.sqrt(np.dot(vector_2, vector_2))
+        if length_1 == 0.0 or length_2 == 0.0:
+            return
+        angle_val = math.acos(min(max(np.dot(vector_1, vector_2) / (length_1 * length_2), -1.0), 1.0))
+        if angle_val < 1e-9:
+            return
+        if angle_val < min_angle:
+            correction = (min_angle - angle_val) / 2.0
+        elif angle_val > max_angle:
+            correction = (max_angle - angle_val) / 2.0
+        else:
+            return
+        rotate_axis = np.cross(vector_1, vector_2)
+        rotate_axis_length = math.sqrt(np.dot(rotate_axis, rotate_axis))
+        if rotate_axis_length < 1e-12:
+            return
+        rotate_axis /= rotate_axis_length
+        # Rotating vector_1 around vector_1 x vector_2 turns it towards vector_2
+        location[pair_particle_idx_1] = axis_location + rotate_vector(vector_1, rotate_axis, -correction)
+        location[pair_particle_idx_2] = axis_location + rotate_vector(vector_2, rotate_axis, correction)
+
+    @staticmethod
+    def angular_constraint_batch(location, triple_array, min_angle_array, max_angle_array, batch_bounds, stiffness=1.0):
+        # Same correction as angular_constraint for (K, 3) rows of (axis, pair 1, pair 2), scaled by stiffness.
+        # The triples of one batch share no particle and are solved together, batches run in order (Gauss-Seidel)
+        for batch_idx in range(batch_bounds.shape[0] - 1):
+            batch = slice(batch_bounds[batch_idx], batch_bounds[batch_idx + 1])
+            axis_idx = triple_array[batch, 0]
+            pair_idx_1 = triple_array[batch, 1]
+            pair_idx_2 = triple_array[batch, 2]
+            axis_location = location[axis_idx]
+            vector_1 = location[pair_idx_1] - axis_location
+            vector_2 = location[pair_idx_2] - axis_location
+            length_1 = np.sqrt(np.einsum('ij,ij->i', vector_1, vector_1))
+            length_2 = np.sqrt(np.einsum('ij,ij->i', vector_2, vector_2))
+            length_product = length_1 * length_2
+            cos_angle = np.divide(np.einsum('ij,ij->i', vector_1, vector_2), length_product, out=np.ones_like(length_product), where=length_product > 0.0)
+            angle_val = np.arccos(np.clip(cos_angle, -1.0, 1.0))
+            correction = np.where(angle_val < min_angle_array[batch], min_angle_array[batch] - angle_val,
+                                  np.where(angle_val > max_angle_array[batch], max_angle_array[batch] - angle_val, 0.0)) * (stiffness / 2.0)
+            rotate_axis = np.cross(vector_1, vector_2)
+            rotate_axis_length = np.sqrt(np.einsum('ij,ij->i', rotate_axis, rotate_axis))
+            is_active = (length_product > 0.0) & (angle_val >= 1e-9) & (correction != 0.0) & (rotate_axis_length >= 1e-12)
+            if not is_active.any():
+                continue
+            rotate_axis = rotate_axis[is_active] / rotate_axis_length[is_active][:, None]
+            correction = correction[is_active][:, None]
+            axis_location = axis_location[is_active]
+            for pair_idx, vector, angle in ((pair_idx_1, vector_1, -correction), (pair_idx_2, vector_2, correction)):
+                # Rodrigues rotation, the axis component vanishes as vector is perpendicular to the axis
+                vector = vector[is_active]
+                location[pair_idx[is_active]] = axis_location + vector * np.cos(angle) + np.cross(rotate_axis, vector) * np.sin(angle)
+
+
+if HAS_NUMBA:
+    @numba.njit(nogil=True, cache=True)
+    def spring_force_jit(location, edge_array, rest_length_array, spring_constant, force):
+        for k in range(edge_array.shape[0]):
+            i = edge_array[k, 0]
+            j = edge_array[k, 1]
+            dx = location[i, 0] - location[j, 0]
+            dy = location[i, 1] - location[j, 1]
+            dz = location[i, 2] - location[j, 2]
+            length = math.sqrt(dx * dx + dy * dy + dz * dz)
+            if length == 0.0:
+                continue
+            scale = spring_constant * (rest_length_array[k] - length) / length
+            force[i, 0] += scale * dx
+            force[i, 1] += scale * dy
+            force[i, 2] += scale * dz
+            force[j, 0] -= scale * dx
+            force[j, 1] -= scale * dy
+            force[j, 2] -= scale * dz
+
+    @numba.njit(nogil=True, cache=True)
+    def spring_edge_force_jit(location, edge_array, rest_length_array, spring_constant, edge_force):
+        for k in range(edge_array.shape[0]):
+            i = edge_array[k, 0]
+            j = edge_array[k, 1]
+            dx = location[i, 0] - location[j, 0]
+            dy = location[i, 1] - location[j, 1]
+            dz = location[i, 2] - location[j, 2]
+            length = math.sqrt(dx * dx + dy * dy + dz * dz)
+            if length == 0.0:
+                edge_force[k, 0] = 0.0
+                edge_force[k, 1] = 0.0
+                edge_force[k, 2] = 0.0
+                continue
+            scale = spring_constant * (rest_length_array[k] - length) / length
+            edge_force[k, 0] = scale * dx
+            edge_force[k, 1] = scale * dy
+            edge_force[k, 2] = scale * dz
+
+    @numba.njit(nogil=True, cache=True)
+    def scatter_edge_force_jit(edge_array, edge_force, force):
+        for k in range(edge_array.shape[0]):
+            i = edge_array[k, 0]
+            j = edge_array[k, 1]
+            force[i, 0] += edge_force[k, 0]
+            force[i, 1] += edge_force[k, 1]
+            force[i, 2] += edge_force[k, 2]
+            force[j, 0] -= edge_force[k, 0]
+            force[j, 1] -= edge_force[k, 1]
+            force[j, 2] -= edge_force[k, 2]
+
+    @numba.njit(nogil=True, cache=True)
+    def contact_pairs_jit(location, mass, cell, cell_dims, cell_start, cell_order, start, end):
+        # Contacts (i, j > i) for i in [start, end), only the 27 cells around i are visited
+        pair_array = np.empty((max(end - start, 16), 2), dtype=np.int64)
+        pair_count = 0
+        for i in range(start, end):
+            first_pair = pair_count
+            for dx in range(-1, 2):
+                cx = cell[i, 0] + dx
+                if cx < 0 or cx >= cell_dims[0]:
+                    continue
+                for dy in range(-1, 2):
+                    cy = cell[i, 1] + dy
+                    if cy < 0 or cy >= cell_dims[1]:
+                        continue
+                    for dz in range(-1, 2):
+                        cz = cell[i, 2] + dz
+                        if cz < 0 or cz >= cell_dims[2]:
+                            continue
+                        key = (cx * cell_dims[1] + cy) * cell_dims[2] + cz
+                        for p in range(cell_start[key], cell_start[key + 1]):
+                            j = cell_order[p]
+                            if j <= i:
+                                continue
+                            dx_ij = location[i, 0] - location[j, 0]
+                            dy_ij = location[i, 1] - location[j, 1]
+                            dz_ij = location[i, 2] - location[j, 2]
+                            radius = mass[i] + mass[j]
+                            if dx_ij * dx_ij + dy_ij * dy_ij + dz_ij * dz_ij > radius * radius:
+                                continue
+                            if pair_count == pair_array.shape[0]:
+                                grown_pair_array = np.empty((2 * pair_count, 2), dtype=np.int64)
+                                grown_pair_array[:pair_count] = pair_array
+                                pair_array = grown_pair_array
+                            # Insertion keeps the pairs of i sorted by j
+                            p = pair_count
+                            while p > first_pair and pair_array[p - 1, 1] > j:
+                                pair_array[p, 1] = pair_array[p - 1, 1]
+                                p -= 1
+                            pair_array[pair_count, 0] = i
+                            pair_array[p, 1] = j
+                            pair_count += 1
+        return pair_array[:pair_count]
+
+    def find_contact_pairs_jit(location, mass, executor=None):
+        # Same pairs and order as find_contact_pairs, the grid walk is split over particle chunks
+        particle_count = location.shape[0]
+        if particle_count < 2:
+            return np.zeros((0, 2), dtype=np.int64)
+        cell, cell_dims, cell_start, cell_order = build_cell_grid(location, 2.0 * float(mass.max()))
+        if executor == None:
+            return contact_pairs_jit(location, mass, cell, cell_dims, cell_start, cell_order, 0, particle_count)
+
+        def find_chunk_pairs(chunk_idx, start, end):
+            return contact_pairs_jit(location, mass, cell, cell_dims, cell_start, cell_order, start, end)
+
+        # Chunks are contiguous ranges of i and already sorted inside, so joining them keeps the order
+        return np.concatenate(executor.map(find_chunk_pairs, executor.split(particle_count)))
+
+    @numba.njit(nogil=True, cache=True)
+    def particle_collision_response_jit(location, velocity, mass, contact_pairs):
+        for k in range(contact_pairs.shape[0]):
+            i = contact_pairs[k, 0]
+            j = contact_pairs[k, 1]
+            nx = location[i, 0] - location[j, 0]
+            ny = location[i, 1] - location[j, 1]
+            nz = location[i, 2] - location[j, 2]
+            length = math.sqrt(nx * nx + ny * ny + nz * nz)
+            if length == 0.0:
+                continue
+            nx /= length
+            ny /= length
+            nz /= length
+            relative_velocity = nx * (velocity[i, 0] - velocity[j, 0]) + ny * (velocity[i, 1] - velocity[j, 1]) + nz * (velocity[i, 2] - velocity[j, 2])
+            a = 2 * relative_velocity / (1.0 / mass[i] + 1.0 / mass[j])
+            velocity[i, 0] -= a / mass[i] * nx
+            velocity[i, 1] -= a / mass[i] * ny
+            velocity[i, 2] -= a / mass[i] * nz
+            velocity[j, 0] += a / mass[j] * nx
+            velocity[j, 1] += a / mass[j] * ny
+            velocity[j, 2] += a / mass[j] * nz
+
+    @numba.njit(nogil=True, cache=True)
+    def wall_collision_jit(location, velocity, wall_location, wall_normal):
+        for i in range(location.shape[0]):
+            projection = 0.0
+            for axis in range(3):
+                projection += (wall_location[axis] - location[i, axis]) * wall_normal[axis]
+            if projection > 0:
+                velocity_dot = 0.0
+                for axis in range(3):
+                    velocity_dot += velocity[i, axis] * wall_normal[axis]
+                for axis in range(3):
+                    location[i, axis] += 2 * projection * wall_normal[axis]
+                    velocity[i, axis] -= 2 * velocity_dot * wall_normal[axis]
+
+    @numba.njit(nogil=True, cache=True)
+    def swept_wall_collision_jit(previous_location, location, velocity, wall_location, wall_normal):
+        for i in range(location.shape[0]):
+            start_distance = 0.0
+            end_distance = 0.0
+            for axis in range(3):
+                start_distance += (previous_location[i, axis] - wall_location[axis]) * wall_normal[axis]
+                end_distance += (location[i, axis] - wall_location[axis]) * wall_normal[axis]
+            if end_distance >= 0.0:
+                continue
+            velocity_dot = 0.0
+            for axis in range(3):
+                velocity_dot += velocity[i, axis] * wall_normal[axis]
+            if start_distance >= 0.0:
+                for axis in range(3):
+                    location[i, axis] -= 2 * end_distance * wall_normal[axis]
+                    velocity[i, axis] -= 2 * velocity_dot * wall_normal[axis]
+            else:
+                velocity_dot = min(velocity_dot, 0.0)
+                for axis in range(3):
+                    location[i, axis] -= end_distance * wall_normal[axis]
+                    velocity[i, axis] -= velocity_dot * wall_normal[axis]
+
+    @numba.njit(nogil=True, cache=True)
+    def resolve_impacts_jit(previous_location, location, velocity, mass, step, pair_array, toi, toi_order):
+        # See resolve_impacts
+        is_resolved = np.zeros(location.shape[0], dtype=np.bool_)
+        for k in toi_order:
+            t = toi[k]
+            if t == np.inf:
+                break
+            i = pair_array[k, 0]
+            j = pair_array[k, 1]
+            if is_resolved[i] or is_resolved[j]:
+                continue
+            displacement_i = location[i] - previous_location[i]
+            displacement_j = location[j] - previous_location[j]
+            contact_i = previous_location[i] + t * displacement_i
+            contact_j = previous_location[j] + t * displacement_j
+            normal = contact_i - contact_j
+            length = math.sqrt(normal[0] * normal[0] + normal[1] * normal[1] + normal[2] * normal[2])
+            if length == 0.0:
+                continue
+            normal /= length
+            relative_velocity = normal[0] * (velocity[i, 0] - velocity[j, 0]) + normal[1] * (velocity[i, 1] - velocity[j, 1]) + normal[2] * (velocity[i, 2] - velocity[j, 2])
+            a = 2 * relative_velocity / (1.0 / mass[i] + 1.0 / mass[j])
+            if a >= 0.0:
+                continue
+            for axis in range(3):
+                velocity[i, axis] -= a / mass[i] * normal[axis]
+                velocity[j, axis] += a / mass[j] * normal[axis]
+                location[i, axis] = contact_i[axis] + (1.0 - t) * (displacement_i[axis] - step * a / mass[i] * normal[axis])
+                location[j, axis] = contact_j[axis] + (1.0 - t) * (displacement_j[axis] + step * a / mass[j] * normal[axis])
+            is_resolved[i] = True
+            is_resolved[j] = True
+        return is_resolved
+
+    @numba.njit(nogil=True, cache=True)
+    def rotate_vector_jit(vector, axis, angle):
+        cos_angle = math.cos(angle)
+        sin_angle = math.sin(angle)
+        axis_dot = axis[0] * vector[0] + axis[1] * vector[1] + axis[2] * vector[2]
+        rotated = np.empty(3)
+        rotated[0] = vector[0] * cos_angle + (axis[1] * vector[2] - axis[2] * vector[1]) * sin_angle + axis[0] * axis_dot * (1.0 - cos_angle)
+        rotated[1] = vector[1] * cos_angle + (axis[2] * vector[0] - axis[0] * vector[2]) * sin_angle + axis[1] * axis_dot * (1.0 - cos_angle)
+        rotated[2] = vector[2] * cos_angle + (axis[0] * vector[1] - axis[1] * vector[0]) * sin_angle + axis[2] * axis_dot * (1.0 - cos_angle)
+        return rotated
+
+    @numba.njit(nogil=True, cache=True)
+    def angular_constraint_jit(location, axis_particle_idx, pair_particle_idx_1, pair_particle_idx_2, min_angle, max_angle, stiffness):
+        vector_1 = location[pair_particle_idx_1] - location[axis_particle_idx]
+        vector_2 = location[pair_particle_idx_2] - location[axis_particle_idx]
+        length_1 = math.sqrt(vector_1[0] ** 2 + vector_1[1] ** 2 + vector_1[2] ** 2)
+        length_2 = math.sqrt(vector_2[0] ** 2 + vector_2[1] ** 2 + vector_2[2] ** 2)
+        if length_1 == 0.0 or length_2 == 0.0:
+            return
+        cos_angle = (vector_1[0] * vector_2[0] + vector_1[1] * vector_2[1] + vector_1[2] * vector_2[2]) / (length_1 * length_2)
+        angle_val = math.acos(min(max(cos_angle, -1.0), 1.0))
+        if angle_val < 1e-9:
+            return
+        if angle_val < min_angle:
+            correction = (min_angle - angle_val) * (stiffness / 2.0)
+        elif angle_val > max_angle:
+            correction = (max_angle - angle_val) * (stiffness / 2.0)
+        else:
+            return
+        rotate_axis = np.empty(3)
+        rotate_axis[0] = vector_1[1] * vector_2[2] - vector_1[2] * vector_2[1]
+        rotate_axis[1] = vector_1[2] * vector_2[0] - vector_1[0] * vector_2[2]
+        rotate_axis[2] = vector_1[0] * vector_2[1] - vector_1[1] * vector_2[0]
+        rotate_axis_length = math.sqrt(rotate_axis[0] ** 2 + rotate_axis[1] ** 2 + rotate_axis[2] ** 2)
+        if rotate_axis_length < 1e-12:
+            return
+        rotate_axis /= rotate_axis_length
+        axis_location = location[axis_particle_idx].copy()
+        location[pair_particle_idx_1] = axis_location + rotate_vector_jit(vector_1, rotate_axis, -correction)
+        location[pair_particle_idx_2] = axis_location + rotate_vector_jit(vector_2, rotate_axis, correction)
+
+    @numba.njit(nogil=True, cache=True)
+    def angular_constraint_batch_jit(location, triple_array, min_angle_array, max_angle_array, stiffness):
+        # Triples are ordered by batch, a plain sequential sweep gives the batched result
+        for k in range(triple_array.shape[0]):
+            angular_constraint_jit(location, triple_array[k, 0], triple_array[k, 1], triple_array[k, 2], min_angle_array[k], max_angle_array[k], stiffness)
+
+    @numba.njit(nogil=True, cache=True)
+    def neighbor_pairs_jit(location, radius, cell, cell_dims, cell_start, cell_order, start, end):
+        # Pairs (i, j > i) closer than radius for i in [start, end), in i order
+        pair_array = np.empty((max(end - start, 16), 2), dtype=np.int64)
+        pair_count = 0
+        radius_square = radius * radius
+        for i in range(start, end):
+            for dx in range(-1, 2):
+                cx = cell[i, 0] + dx
+                if cx < 0 or cx >= cell_dims[0]:
+                    continue
+                for dy in range(-1, 2):
+                    cy = cell[i, 1] + dy
+                    if cy < 0 or cy >= cell_dims[1]:
+                        continue
+                    for dz in range(-1, 2):
+                        cz = cell[i, 2] + dz
+                        if cz < 0 or cz >= cell_dims[2]:
+                            continue
+                        key = (cx * cell_dims[1] + cy) * cell_dims[2] + cz
+                        for p in range(cell_start[key], cell_start[key + 1]):
+                            j = cell_order[p]
+                            if j <= i:
+                                continue
+                            dx_ij = location[i, 0] - location[j, 0]
+                            dy_ij = location[i, 1] - location[j, 1]
+                            dz_ij = location[i, 2] - location[j, 2]
+                            if dx_ij * dx_ij + dy_ij * dy_ij + dz_ij * dz_ij > radius_square:
+                                continue
+                            if pair_count == pair_array.shape[0]:
+                                grown_pair_array = np.empty((2 * pair_count, 2), dtype=np.int64)
+                                grown_pair_array[:pair_count] = pair_array
+                                pair_array = grown_pair_array
+                            pair_array[pair_count, 0] = i
+                            pair_array[pair_count, 1] = j
+                            pair_count += 1
+        return pair_array[:pair_count]
+
+    @numba.njit(nogil=True, cache=True)
+    def sph_density_jit(location, mass, neighbor_start, neighbor_idx, smoothing_length, poly6, density):
+        h_square = smoothing_length * smoothing_length
+        for i in range(location.shape[0]):
+            density[i] += mass[i] * poly6 * h_square ** 3
+        for i in range(location.shape[0]):
+            for k in range(neighbor_start[i], neighbor_start[i + 1]):
+                j = neighbor_idx[k]
+                dx = location[i, 0] - location[j, 0]
+                dy = location[i, 1] - location[j, 1]
+                dz = location[i, 2] - location[j, 2]
+                gap = h_square - (dx * dx + dy * dy + dz * dz)
+                if gap <= 0.0:
+                    continue
+                weight = poly6 * gap * gap * gap
+                density[i] += mass[j] * weight
+                density[j] += mass[i] * weight
+
+    @numba.njit(nogil=True, cache=True)
+    def sph_force_jit(location, velocity, mass, density, pressure, neighbor_start, neighbor_idx, smoothing_length, viscosity,
+                      spiky, viscosity_laplacian, force):
+        for i in range(location.shape[0]):
+            for k in range(neighbor_start[i], neighbor_start[i + 1]):
+                j = neighbor_idx[k]
+                dx = location[i, 0] - location[j, 0]
+                dy = location[i, 1] - location[j, 1]
+                dz = location[i, 2] - location[j, 2]
+                length = math.sqrt(dx * dx + dy * dy + dz * dz)
+                gap = max(smoothing_length - length, 0.0)
+                mass_product = mass[i] * mass[j]
+                pressure_scale = 0.0
+                if length > 0.0:
+                    pressure_scale = -mass_product * (pressure[i] / density[i] ** 2 + pressure[j] / density[j] ** 2) * spiky * gap * gap / length
+                viscosity_scale = viscosity * mass_product / (density[i] * density[j]) * viscosity_laplacian * gap
+                fx = pressure_scale * dx + viscosity_scale * (velocity[j, 0] - velocity[i, 0])
+                fy = pressure_scale * dy + viscosity_scale * (velocity[j, 1] - velocity[i, 1])
+                fz = pressure_scale * dz + viscosity_scale * (velocity[j, 2] - velocity[i, 2])
+                force[i, 0] += fx
+                force[i, 1] += fy
+                force[i, 2] += fz
+                force[j, 0] -= fx
+                force[j, 1] -= fy
+                force[j, 2] -= fz
+
+    @numba.njit(nogil=True, cache=True)
+    def direct_field_jit(location, mass, softening, field, start, end):
+        softening_square = softening * softening
+        for i in range(start, end):
+            for j in range(location.shape[0]):
+                if j == i:
+                    continue
+                dx = location[j, 0] - location[i, 0]
+                dy = location[j, 1] - location[i, 1]
+                dz = location[j, 2] - location[i, 2]
+                distance_square = dx * dx + dy * dy + dz * dz + softening_square
+                if distance_square == 0.0:
+                    continue
+                scale = mass[j] / (distance_square * math.sqrt(distance_square))
+                field[i, 0] += scale * dx
+                field[i, 1] += scale * dy
+                field[i, 2] += scale * dz
+
+    @numba.njit(nogil=True, cache=True)
+    def barnes_hut_field_jit(order, sorted_location, sorted_mass, node_start, node_end, node_size, node_mass, node_center,
+                             child_start, child_count, theta, softening, field, start, end):
+        # Octree.get_block_field with a depth first walk per particle
+        softening_square = softening * softening
+        theta_square = theta * theta
+        stack = np.empty(64 * 8, dtype=np.int64)
+        for i in range(start, end):
+            fx = 0.0
+            fy = 0.0
+            fz = 0.0
+            stack[0] = 0
+            stack_count = 1
+            while stack_count > 0:
+                stack_count -= 1
+                node = stack[stack_count]
+                dx = node_center[node, 0] - sorted_location[i, 0]
+                dy = node_center[node, 1] - sorted_location[i, 1]
+                dz = node_center[node, 2] - sorted_location[i, 2]
+                distance_square = dx * dx + dy * dy + dz * dz
+                is_inside = node_start[node] <= i and i < node_end[node]
+                if not is_inside and node_size[node] * node_size[node] < theta_square * distance_square:
+                    distance_square += softening_square
+                    scale = node_mass[node] / (distance_square * math.sqrt(distance_square))
+                    fx += scale * dx
+                    fy += scale * dy
+                    fz += scale * dz
+                elif child_count[node] == 0:
+                    for j in range(node_start[node], node_end[node]):
+                        if j == i:
+                            continue
+                        dx = sorted_location[j, 0] - sorted_location[i, 0]
+                        dy = sorted_location[j, 1] - sorted_location[i, 1]
+                        dz = sorted_location[j, 2] - sorted_location[i, 2]
+                        distance_square = dx * dx + dy * dy + dz * dz + softening_square
+                        if distance_square == 0.0:
+                            continue
+                        scale = sorted_mass[j] / (distance_square * math.sqrt(distance_square))
+                        fx += scale * dx
+                        fy += scale * dy
+                        fz += scale * dz
+                else:
+                    # Pushed in reverse so the children are visited in tree order
+                    for k in range(child_count[node] - 1, -1, -1):
+                        stack[stack_count] = child_start[node] + k
+                        stack_count += 1
+            row = order[i]
+            field[row, 0] += fx
+            field[row, 1] += fy
+            field[row, 2] += fz
+
+    class NumbaKernels:
+        name = 'numba'
+
+        @staticmethod
+        def spring_force(location, edge_array, rest_length_array, spring_constant, force):
+            spring_force_jit(location, edge_array, rest_length_array, float(spring_constant), force)
+
+        @staticmethod
+        def spring_edge_force(location, edge_array, rest_length_array, spring_constant, edge_force):
+            spring_edge_force_jit(location, edge_array, rest_length_array, float(spring_constant), edge_force)
+
+        @staticmethod
+        def scatter_edge_force(edge_array, edge_force, force):
+            scatter_edge_force_jit(edge_array, edge_force, force)
+
+        @staticmethod
+        def particle_collision(location, velocity, mass, executor=None):
+            particle_collision_response_jit(location, velocity, mass, find_contact_pairs_jit(location, mass, executor))
+
+        @staticmethod
+        def particle_collision_response(location, velocity, mass, contact_pairs):
+            particle_collision_response_jit(location, velocity, mass, contact_pairs)
+
+        @staticmethod
+        def swept_particle_collision(previous_location, location, velocity, mass, step, executor=None):
+            pair_array = swept_pair_candidates(previous_location, location, mass, find_contact_pairs_jit, executor)
+            toi = time_of_impact(previous_location, location, mass, pair_array)
+            is_resolved = resolve_impacts_jit(previous_location, location, velocity, mass, float(step), pair_array, toi, np.argsort(toi, kind='stable'))
+            contact_pairs = find_contact_pairs_jit(location, mass, executor)
+            particle_collision_response_jit(location, velocity, mass, np.ascontiguousarray(contact_pairs[~is_resolved[contact_pairs].any(axis=1)]))
+
+        @staticmethod
+        def wall_collision(location, velocity, wall_location, wall_normal):
+            wall_collision_jit(location, velocity, wall_location, wall_normal)
+
+        @staticmethod
+        def swept_wall_collision(previous_location, location, velocity, wall_location, wall_normal):
+            swept_wall_collision_jit(previous_location, location, velocity, wall_location, wall_normal)
+
+        @staticmethod
+        def neighbor_pairs(location, radius, executor=None):
+            particle_count = location.shape[0]
+            if particle_count < 2:
+                return np.zeros((0, 2), dtype=np.int64)
+            cell, cell_dims, cell_start, cell_order = build_cell_grid(location, float(radius))
+
+            def find_chunk_pairs(chunk_idx, start, end):
+                return neighbor_pairs_jit(location, float(radius), cell, cell_dims, cell_start, cell_order, start, end)
+
+            if executor == None:
+                return find_chunk_pairs(0, 0, particle_count)
+            return np.concatenate(executor.map(find_chunk_pairs, executor.split(particle_count)))
+
+        @staticmethod
+        def sph_density(location, mass, neighbor_list, smoothing_length):
+            poly6, spiky, viscosity_laplacian = sph_kernel_constants(smoothing_length)
+            density = np.zeros(location.shape[0])
+            sph_density_jit(location, mass, neighbor_list.neighbor_start, neighbor_list.neighbor_idx, float(smoothing_length), poly6, density)
+            return density
+
+        @staticmethod
+        def sph_force(location, velocity, mass, density, pressure, neighbor_list, smoothing_length, viscosity, force):
+            poly6, spiky, viscosity_laplacian = sph_kernel_constants(smoothing_length)
+            sph_force_jit(location, velocity, mass, density, pressure, neighbor_list.neighbor_start, neighbor_list.neighbor_idx,
+                          float(smoothing_length), float(viscosity), spiky, viscosity_laplacian, force)
+
+        @staticmethod
+        def direct_field(location, mass, softening, field, executor=None):
+            if executor == None:
+                direct_field_jit(location, mass, float(softening), field, 0, location.shape[0])
+                return
+            executor.map(lambda chunk_idx, start, end: direct_field_jit(location, mass, float(softening), field, start, end),
+                         executor.split(location.shape[0]))
+
+        @staticmethod
+        def barnes_hut_field(octree, theta, softening, field, executor=None):
+            def field_chunk(chunk_idx, start, end):
+                barnes_hut_field_jit(octree.order, octree.sorted_location, octree.sorted_mass, octree.node_start, octree.node_end,
+                                     octree.node_size, octree.node_mass, octree.node_center, octree.child_start, octree.child_count,
+                                     float(theta), float(softening), field, start, end)
+
+            if executor == None:
+                field_chunk(0, 0, octree.order.shape[0])
+                return
+            executor.map(field_chunk, executor.split(octree.order.shape[0]))
+
+        @staticmethod
+        def angular_constraint(location, axis_particle_idx, pair_particle_idx_1, pair_particle_idx_2, min_angle, max_angle):
+            angular_constraint_jit(location, axis_particle_idx, pair_particle_idx_1, pair_particle_idx_2, float(min_angle), float(max_angle), 1.0)
+
+        @staticmethod
+        def angular_constraint_batch(location, triple_array, min_angle_array, max_angle_array, batch_bounds, stiffness=1.0):
+            angular_constraint_batch_jit(location, triple_array, min_angle_array, max_angle_array, float(stiffness))
+
+
+def get_kernels(backend):
+    # Falls back to numpy when numba is requested but not installed
+    if backend == 'numba' and HAS_NUMBA:
+        return NumbaKernels
+    return NumpyKernels
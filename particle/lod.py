@@ -0,0 +1,130 @@
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from .scene_file import store_array
+
+# Level of detail for cloth: the fine mesh is clustered into a coarse proxy that is simulated in its place,
+# and the fine vertices are rebuilt from the proxy with one sparse matrix product per frame,
+#   fine location = weight @ proxy location + offset
+# A cluster is a connected piece of the mesh inside one cell of a grid of cell_size, its particle sits at
+# the centroid. Proxy particles are joined by a spring when a mesh edge joins their clusters and by a
+# bending spring when they share a neighbor but no edge. The weights of a fine vertex are over its
+# neighbor_count nearest proxy particles, the smallest (nearer ones cheaper) that sum to 1 and rebuild the
+# vertex from the rest proxy, so moving the proxy rigidly moves the mesh with it. offset holds what the
+# weights can't rebuild, vertices off the plane of a flat proxy.
+PROXY_FILENAME = 'cloth_proxy.json'
+
+
+def cluster_vertices(location_array, edge_array, cell_size):
+    # Cluster label per vertex and the cluster count
+    vertex_count = location_array.shape[0]
+    cell = np.floor((location_array - location_array.min(axis=0)) / cell_size).astype(np.int64)
+    cell_label = np.unique(cell, axis=0, return_inverse=True)[1].reshape(-1)
+    # Pieces of the mesh that only pass through the same cell, the front and back of a sleeve, stay apart
+    is_inner = cell_label[edge_array[:, 0]] == cell_label[edge_array[:, 1]]
+    inner_edge_array = edge_array[is_inner]
+    graph = coo_matrix((np.ones(inner_edge_array.shape[0]), (inner_edge_array[:, 0], inner_edge_array[:, 1])), shape=(vertex_count, vertex_count))
+    cluster_count, cluster_label = connected_components(graph, directed=False)
+    return cluster_label, cluster_count
+
+
+def interpolation_weights(fine_location, coarse_location, neighbor_count=4):
+    # (fine count, coarse count) csr weights and the offset of every fine vertex
+    neighbor_count = min(neighbor_count, coarse_location.shape[0])
+    distance, neighbor_idx = cKDTree(coarse_location).query(fine_location, k=neighbor_count)
+    distance = distance.reshape(fine_location.shape[0], neighbor_count)
+    neighbor_idx = neighbor_idx.reshape(fine_location.shape[0], neighbor_count)
+    # Minimum of sum w^2 / phi under sum w = 1 and sum w (x_k - x) = 0 is w = sqrt(phi) pinv(A sqrt(phi)) e_0
+    phi_sqrt = 1.0 / np.sqrt(distance + 1e-6 * (distance.max() + 1.0))
+    system = np.ones((fine_location.shape[0], 4, neighbor_count))
+    system[:, 1:, :] = (coarse_location[neighbor_idx] - fine_location[:, None, :]).transpose(0, 2, 1)
+    system *= phi_sqrt[:, None, :]
+    weight_array = phi_sqrt * np.linalg.pinv(system, rcond=1e-8)[:, :, 0]
+    row_idx = np.repeat(np.arange(fine_location.shape[0]), neighbor_count)
+    weight = csr_matrix((weight_array.ravel(), (row_idx, neighbor_idx.ravel())), shape=(fine_location.shape[0], coarse_location.shape[0]))
+    offset = fine_location - weight @ coarse_location
+    return weight, offset
+
+
+class ClothProxy:
+    def __init__(self, cell_size=1.0, neighbor_count=4, object_name=''):
+        self.cell_size = cell_size
+        self.neighbor_count = neighbor_count
+        # Mesh object the fine vertices are written to on playback
+        self.object_name = object_name
+        self.weight = csr_matrix((0, 0))
+        self.offset = np.zeros((0, 3))
+
+    def build(self, location_array, edge_array, pin_idx_array=None):
+        # Clusters the mesh and sets the proxy particles (location, edge_array, bending_array, pin_idx_array)
+        location_array = np.asarray(location_array, dtype=np.float64).reshape(-1, 3)
+        edge_array = np.asarray(edge_array, dtype=np.int64).reshape(-1, 2)
+        cluster_label, cluster_count = cluster_vertices(location_array, edge_array, self.cell_size)
+        cluster_size = np.bincount(cluster_label, minlength=cluster_count)
+        self.location = np.stack([np.bincount(cluster_label, location_array[:, axis], minlength=cluster_count) for axis in range(3)], axis=1)
+        self.location /= cluster_size[:, None]
+
+        coarse_edge_array = cluster_label[edge_array]
+        coarse_edge_array = coarse_edge_array[coarse_edge_array[:, 0] != coarse_edge_array[:, 1]]
+        self.edge_array = np.unique(np.sort(coarse_edge_array, axis=1), axis=0).reshape(-1, 2)
+        # Pairs two springs apart, the shear and flexion springs of a grid
+        adjacency = coo_matrix((np.ones(self.edge_array.shape[0]), (self.edge_array[:, 0], self.edge_array[:, 1])), shape=(cluster_count, cluster_count))
+        adjacency = (adjacency + adjacency.T).tocsr()
+        second = (adjacency @ adjacency).tocoo()
+        is_pair = second.row < second.col
+        pair_array = np.stack((second.row[is_pair], second.col[is_pair]), axis=1).astype(np.int64)
+        is_edge = np.isin(pair_array[:, 0] * cluster_count + pair_array[:, 1], self.edge_array[:, 0] * cluster_count + self.edge_array[:, 1])
+        self.bending_array = pair_array[~is_edge]
+        self.bending_array = self.bending_array[np.lexsort((self.bending_array[:, 1], self.bending_array[:, 0]))].reshape(-1, 2)
+
+        self.pin_idx_array = np.zeros(0, dtype=np.int64)
+        if pin_idx_array is not None and len(pin_idx_array) > 0:
+            self.pin_idx_array = np.unique(cluster_label[np.asarray(pin_idx_array, dtype=np.int64)])
+
+        self.weight, self.offset = interpolation_weights(location_array, self.location, self.neighbor_count)
+        return self.location, self.edge_array, self.bending_array, self.pin_idx_array
+
+    def get_fine_location(self, coarse_location):
+        # Rows past the proxy particles (emitted ones) don't take part
+        return self.weight @ coarse_location[:self.weight.shape[1]] + self.offset
+
+    def remap_particles(self, idx_map):
+        # False once a proxy particle carrying weight is removed
+        idx_map = idx_map[:self.weight.shape[1]]
+        is_kept = idx_map >= 0
+        weight = self.weight.tocsc()
+        if np.any(weight[:, np.flatnonzero(~is_kept)].data != 0.0):
+            return False
+        self.weight = weight[:, np.flatnonzero(is_kept)].tocsr()
+        return True
+
+    def save_proxy(self, array_dict=None):
+        json_data = {}
+        json_data['cell_size'] = self.cell_size
+        json_data['neighbor_count'] = self.neighbor_count
+        json_data['object_name'] = self.object_name
+        json_data['shape'] = list(self.weight.shape)
+        if array_dict != None:
+            json_data['weight_data'] = store_array(array_dict, 'weight_data', self.weight.data)
+            json_data['weight_indices'] = store_array(array_dict, 'weight_indices', self.weight.indices)
+            json_data['weight_indptr'] = store_array(array_dict, 'weight_indptr', self.weight.indptr)
+            json_data['offset'] = store_array(array_dict, 'offset', self.offset)
+            return json_data
+        json_data['weight_data'] = self.weight.data.tolist()
+        json_data['weight_indices'] = self.weight.indices.tolist()
+        json_data['weight_indptr'] = self.weight.indptr.tolist()
+        json_data['offset'] = self.offset.tolist()
+        return json_data
+
+    def load_proxy(self, json_data, array_dict=None):
+        self.cell_size = json_data['cell_size']
+        self.neighbor_count = json_data['neighbor_count']
+        self.object_name = json_data['object_name']
+        array_list = [json_data[name] for name in ('weight_data', 'weight_indices', 'weight_indptr', 'offset')]
+        if array_dict != None:
+            array_list = [array_dict[key] for key in array_list]
+        weight_data, weight_indices, weight_indptr, offset = array_list
+        self.weight = csr_matrix((np.asarray(weight_data, dtype=np.float64), np.asarray(weight_indices, dtype=np.int64),
+                                  np.asarray(weight_indptr, dtype=np.int64)), shape=tuple(json_data['shape']))
+        self.offset = np.asarray(offset, dtype=np.float64).reshape(-1, 3)
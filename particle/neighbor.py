@@ -0,0 +1,80 @@
+import numpy as np
+
+# Neighbor lists for the pair forces: the pairs (i, j > i) closer than a radius sorted by i, with CSR row
+# starts so the neighbors of i are neighbor_idx[neighbor_start[i]:neighbor_start[i + 1]]. The numpy kernels
+# reduce over the pair columns, the compiled ones walk the rows.
+
+
+class NeighborList:
+    def __init__(self, particle_count=0, pair_array=None):
+        if pair_array is None:
+            pair_array = np.zeros((0, 2), dtype=np.int64)
+        self.particle_count = particle_count
+        self.pair_array = pair_array
+        self.neighbor_idx = np.ascontiguousarray(pair_array[:, 1])
+        self.neighbor_start = np.searchsorted(pair_array[:, 0], np.arange(particle_count + 1))
+
+
+def build_neighbor_list(kernels, location, radius, executor=None):
+    return NeighborList(location.shape[0], kernels.neighbor_pairs(location, radius, executor))
+
+
+class NeighborSearch:
+    # Verlet lists shared by every pair consumer of a particle system, within a step and across the solver
+    # stages. A list holds the pairs within radius + skin and is reused until some particle has moved more
+    # than skin / 2 since it was built, before that no pair can have closed in by more than skin. Every query
+    # cuts the padded pairs back to radius, so consumers get the same pairs as a fresh search
+    def __init__(self, skin=0.5):
+        self.skin = skin
+        self.reset_neighbor()
+
+    def reset_neighbor(self):
+        # One entry per (radius, all rows or a subset)
+        self.entry_dict = {}
+        self.build_count = 0
+        self.reuse_count = 0
+
+    def is_valid(self, entry, location, row_idx):
+        if entry['location'].shape != location.shape:
+            return False
+        if (entry['row_idx'] is None) != (row_idx is None):
+            return False
+        if row_idx is not None and not np.array_equal(entry['row_idx'], row_idx):
+            return False
+        displacement = location - entry['location']
+        return float(np.einsum('ij,ij->i', displacement, displacement).max(initial=0.0)) <= (0.5 * self.skin) ** 2
+
+    def get_neighbor_list(self, particle_system, location, radius, row_idx=None):
+        # NeighborList of location within radius. location are the rows row_idx of the system, None for all of them
+        key = (float(radius), row_idx is None)
+        entry = self.entry_dict.get(key)
+        if entry == None or not self.is_valid(entry, location, row_idx):
+            if len(self.entry_dict) >= 8:
+                self.entry_dict = {}
+            entry = {
+                'location': location.copy(),
+                'row_idx': None if row_idx is None else row_idx.copy(),
+                'pair_array': particle_system.kernels.neighbor_pairs(location, radius + self.skin, particle_system.executor),
+            }
+            self.entry_dict[key] = entry
+            self.build_count += 1
+        else:
+            self.reuse_count += 1
+        pair_array = entry['pair_array']
+        if self.skin > 0.0:
+            delta = location[pair_array[:, 0]] - location[pair_array[:, 1]]
+            pair_array = pair_array[np.einsum('ij,ij->i', delta, delta) <= radius * radius]
+        if particle_system.deterministic:
+            # The order within a row depends on the backend, the threads and the location the list was
+            # built from, and the pair forces are summed in that order
+            pair_array = pair_array[np.lexsort((pair_array[:, 1], pair_array[:, 0]))]
+        return NeighborList(location.shape[0], pair_array)
+
+    def save_neighbor(self):
+        json_data = {}
+        json_data['skin'] = self.skin
+        return json_data
+
+    def load_neighbor(self, json_data):
+        self.skin = json_data['skin']
+        self.reset_neighbor()
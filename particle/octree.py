@@ -0,0 +1,158 @@
+import numpy as np
+
+# Octree over the particles for Barnes-Hut sums, rebuilt from the locations on every force evaluation.
+# Particles are sorted by the Morton code of their cell so every node owns a contiguous range of them,
+# the nodes of a level are the distinct code prefixes of that level. Nodes are stored level by level in
+# flat arrays, the children of a node are a contiguous run of the next level. Queries walk the tree for
+# a block of particles at once, one level per loop iteration as in bvh.py.
+MAX_DEPTH = 16
+BLOCK_SIZE = 1024
+
+
+def spread_bits(value):
+    # Puts two zero bits between each of the low 21 bits of value
+    value = value.astype(np.uint64) & np.uint64(0x1fffff)
+    for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                        (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+        value = (value | (value << np.uint64(shift))) & np.uint64(mask)
+    return value
+
+
+def morton_code(cell):
+    return (spread_bits(cell[:, 0]) << np.uint64(2)) | (spread_bits(cell[:, 1]) << np.uint64(1)) | spread_bits(cell[:, 2])
+
+
+def expand_ranges(first, count):
+    # (repeat index, first + k) for k in range(count) of every row
+    repeat_idx = np.repeat(np.arange(first.shape[0]), count)
+    offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    return repeat_idx, first[repeat_idx] + offset
+
+
+def accumulate(field, row, vector):
+    for axis in range(3):
+        field[:, axis] += np.bincount(row, vector[:, axis], minlength=field.shape[0])
+
+
+class Octree:
+    def __init__(self, location, mass, leaf_size=8, max_depth=MAX_DEPTH):
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+        self.build(location, mass)
+
+    def build(self, location, mass):
+        location = np.asarray(location, dtype=np.float64).reshape(-1, 3)
+        mass = np.asarray(mass, dtype=np.float64).reshape(-1)
+        particle_count = location.shape[0]
+        min_location = np.zeros(3)
+        root_size = 0.0
+        if particle_count > 0:
+            min_location = location.min(axis=0)
+            root_size = float((location.max(axis=0) - min_location).max())
+        if root_size <= 0.0:
+            root_size = 1.0
+        cell_count = 1 << self.max_depth
+        cell = np.clip(np.floor((location - min_location) / root_size * cell_count), 0, cell_count - 1).astype(np.int64)
+        code = morton_code(cell)
+        self.order = np.argsort(code, kind='stable')
+        sorted_code = code[self.order]
+        self.sorted_location = location[self.order]
+        self.sorted_mass = mass[self.order]
+
+        node_start_list = [np.zeros(1, dtype=np.int64)]
+        node_end_list = [np.full(1, particle_count, dtype=np.int64)]
+        node_level_list = [np.zeros(1, dtype=np.int64)]
+        child_start_list = []
+        child_count_list = []
+        node_count = 1
+        level = 0
+        while True:
+            node_start = node_start_list[-1]
+            node_end = node_end_list[-1]
+            is_split = (node_end - node_start > self.leaf_size) & (level < self.max_depth)
+            child_start = np.zeros(node_start.shape[0], dtype=np.int64)
+            child_count = np.zeros(node_start.shape[0], dtype=np.int64)
+            child_start_list.append(child_start)
+            child_count_list.append(child_count)
+            if not is_split.any():
+                break
+            # Rows of the split nodes, cut where the code prefix of the next level changes. The prefixes of
+            # a level refine the ones of the level above, so a cut never crosses a node boundary
+            is_covered = np.zeros(particle_count + 1, dtype=np.int64)
+            np.add.at(is_covered, node_start[is_split], 1)
+            np.add.at(is_covered, node_end[is_split], -1)
+            is_covered = np.cumsum(is_covered[:-1]) > 0
+            prefix = sorted_code >> np.uint64(3 * (self.max_depth - level - 1))
+            is_cut = np.ones(particle_count, dtype=bool)
+            is_cut[1:] = prefix[1:] != prefix[:-1]
+            cut = np.flatnonzero(is_cut)
+            cut_end = np.append(cut[1:], particle_count)
+            is_child = is_covered[cut]
+            level_start = cut[is_child]
+            level_end = cut_end[is_child]
+            # Children are in the order of their parents, the first child of a node is where its start lands
+            parent_idx = np.searchsorted(node_start, level_start, side='right') - 1
+            child_count[:] = np.bincount(parent_idx, minlength=node_start.shape[0])
+            child_start[:] = node_count + np.cumsum(child_count) - child_count
+            node_start_list.append(level_start)
+            node_end_list.append(level_end)
+            node_level_list.append(np.full(level_start.shape[0], level + 1, dtype=np.int64))
+            node_count += level_start.shape[0]
+            level += 1
+
+        self.node_start = np.concatenate(node_start_list)
+        self.node_end = np.concatenate(node_end_list)
+        self.child_start = np.concatenate(child_start_list)
+        self.child_count = np.concatenate(child_count_list)
+        self.node_size = root_size / 2.0 ** np.concatenate(node_level_list)
+        # Mass and center of mass of every node from running sums over the sorted particles
+        mass_sum = np.concatenate(([0.0], np.cumsum(self.sorted_mass)))
+        moment_sum = np.concatenate((np.zeros((1, 3)), np.cumsum(self.sorted_location * self.sorted_mass[:, None], axis=0)))
+        self.node_mass = mass_sum[self.node_end] - mass_sum[self.node_start]
+        moment = moment_sum[self.node_end] - moment_sum[self.node_start]
+        self.node_center = np.divide(moment, self.node_mass[:, None], out=np.zeros_like(moment), where=self.node_mass[:, None] != 0.0)
+
+    def get_block_field(self, start, end, theta, softening):
+        # sum_j m_j (x_j - x_i) / (|x_j - x_i|^2 + softening^2)^1.5 over all j != i for the sorted particles
+        # [start, end). A node that doesn't hold i and whose size is below theta times its distance counts as one
+        # particle at its center of mass, other leaves are summed particle by particle and other nodes are opened
+        field = np.zeros((end - start, 3))
+        softening_square = softening * softening
+        theta_square = theta * theta
+        target_idx = np.arange(start, end)
+        node_idx = np.zeros(end - start, dtype=np.int64)
+        while target_idx.shape[0] > 0:
+            delta = self.node_center[node_idx] - self.sorted_location[target_idx]
+            distance_square = np.einsum('ij,ij->i', delta, delta)
+            is_inside = (self.node_start[node_idx] <= target_idx) & (target_idx < self.node_end[node_idx])
+            is_far = ~is_inside & (self.node_size[node_idx] ** 2 < theta_square * distance_square)
+            is_leaf = ~is_far & (self.child_count[node_idx] == 0)
+            scale = self.node_mass[node_idx[is_far]] / (distance_square[is_far] + softening_square) ** 1.5
+            accumulate(field, target_idx[is_far] - start, scale[:, None] * delta[is_far])
+
+            leaf_target_idx = target_idx[is_leaf]
+            leaf_node_idx = node_idx[is_leaf]
+            pair_idx, source_idx = expand_ranges(self.node_start[leaf_node_idx], self.node_end[leaf_node_idx] - self.node_start[leaf_node_idx])
+            pair_target_idx = leaf_target_idx[pair_idx]
+            is_other = source_idx != pair_target_idx
+            pair_target_idx = pair_target_idx[is_other]
+            source_idx = source_idx[is_other]
+            pair_delta = self.sorted_location[source_idx] - self.sorted_location[pair_target_idx]
+            pair_distance_square = np.einsum('ij,ij->i', pair_delta, pair_delta) + softening_square
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = np.where(pair_distance_square > 0.0, self.sorted_mass[source_idx] / pair_distance_square ** 1.5, 0.0)
+            accumulate(field, pair_target_idx - start, scale[:, None] * pair_delta)
+
+            is_open = ~is_far & ~is_leaf
+            open_node_idx = node_idx[is_open]
+            pair_idx, node_idx = expand_ranges(self.child_start[open_node_idx], self.child_count[open_node_idx])
+            target_idx = target_idx[is_open][pair_idx]
+        return field
+
+    def get_field(self, theta, softening, field, start=0, end=None):
+        # Adds the field of the sorted particles [start, end) to the rows of field they came from
+        if end == None:
+            end = self.order.shape[0]
+        for block_start in range(start, end, BLOCK_SIZE):
+            block_end = min(block_start + BLOCK_SIZE, end)
+            field[self.order[block_start:block_end]] += self.get_block_field(block_start, block_end, theta, softening)
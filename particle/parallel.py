@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Thread pool over index chunks. The work handed to it by a ParticleSystem is nogil numba kernels,
+# which release the GIL, so the chunks really run side by side. With the numpy backend the system
+# keeps a single thread, see ParticleSystem.set_num_threads.
+
+
+class ChunkExecutor:
+    def __init__(self, num_threads=1, min_chunk_size=4096):
+        self.num_threads = max(int(num_threads), 1)
+        self.min_chunk_size = min_chunk_size
+        self.pool = None
+        # Per chunk scratch arrays, reused between calls so reductions don't allocate every step
+        self.buffer_dict = {}
+
+    def split(self, count):
+        # [(chunk_idx, start, end)], a single chunk when threading wouldn't pay off
+        chunk_count = min(self.num_threads, count // self.min_chunk_size)
+        if chunk_count <= 1:
+            return [(0, 0, count)]
+        bounds = np.linspace(0, count, chunk_count + 1).astype(np.int64)
+        return [(i, int(bounds[i]), int(bounds[i + 1])) for i in range(chunk_count)]
+
+    def map(self, func, chunk_list):
+        # Results come back in chunk order whatever order the threads finish in
+        if len(chunk_list) == 1:
+            return [func(*chunk_list[0])]
+        if self.pool == None:
+            self.pool = ThreadPoolExecutor(max_workers=self.num_threads)
+        return list(self.pool.map(lambda chunk: func(*chunk), chunk_list))
+
+    def get_buffer(self, name, chunk_idx, shape, dtype=np.float64):
+        buffer = self.buffer_dict.get((name, chunk_idx))
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            self.buffer_dict[(name, chunk_idx)] = buffer
+        return buffer
+
+    def shutdown(self):
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+        self.buffer_dict = {}
+
+
+class ParticleChunk:
+    # Stands in for a ParticleSystem restricted to the rows [start, end), enough for the
+    # per particle forces in apply_force.py which only touch these arrays
+    def __init__(self, particle_system, start, end):
+        self.location = particle_system.location[start:end]
+        self.velocity = particle_system.velocity[start:end]
+        self.force = particle_system.force[start:end]
+        self.mass = particle_system.mass[start:end]
+        self.kernels = particle_system.kernels
+
+
+class ParticleRows:
+    # ParticleChunk for any rows row_idx, with copies of the rows and a zeroed force to write back
+    def __init__(self, particle_system, row_idx):
+        self.location = particle_system.location[row_idx]
+        self.velocity = particle_system.velocity[row_idx]
+        self.force = np.zeros_like(self.location)
+        self.mass = particle_system.mass[row_idx]
+        self.kernels = particle_system.kernels
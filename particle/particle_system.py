@@ -1,70 +1,86 @@
-import bpy
-from mathutils import Vector, Matrix
-from .utils import getParticleSystem, create_collection, create_sphere, create_connect_line, create_plane
-from .apply_force import ConstantForce, SpringTwoParticleForce, GravityForce, DampingForce, SpringForce
-from .solver import ForwardEulerSolver, SecondOrderRKSolver, FourthOrderRKSolver, VerletSolver, LeapfrogSolver, BackwardEulerSolver
-from .constraint import PinConstraint, AxisConstraint, PlaneConstraint, AngularConstraint
-from .collision import ParticleCollision, WallCollision
-from .custom_prop import ParticleProp
+try:
+    import bpy
+    from mathutils import Vector, Matrix
+    from .utils import getParticleSystem, create_collection, create_sphere, create_connect_line
+    from .custom_prop import ParticleProp
+except ImportError:
+    # Headless bakes load and simulate scenes without blender, see bake_queue.py
+    bpy = None
+from .apply_force import ConstantForce, SpringTwoParticleForce, GravityForce, DampingForce, SpringForce, FORCE_TYPES, COHERENT_FORCE_TYPES
+from .solver import ForwardEulerSolver, SOLVER_TYPES
+from .constraint import PinConstraint, AxisConstraint, PlaneConstraint, AngularConstraint, BatchAngularConstraint, CONSTRAINT_TYPES
+from .collision import ParticleCollision, WallCollision, COLLISION_TYPES
+from .cache import FrameCacheWriter, FrameCacheReader, FRAME_HASH_FILENAME, write_frame_hash
+from .profiler import StageProfiler, stage_name
+from .state import ParticleState, ParticleList
+from .kernels import NumpyKernels, get_kernels
+from .parallel import ChunkExecutor, ParticleChunk
+from .emitter import ParticlePool, EMITTER_TYPES
+from .scene_file import store_array, write_scene, read_scene
+from .sleep import ParticleSleep
+from .neighbor import NeighborSearch
+from .domain import DomainBake
+from .lod import ClothProxy, PROXY_FILENAME
 import numpy as np
 import math
 import json
+import os
 
-class Particle:
-    def __init__(self, location=Vector((0.0, 0.0, 0.0)), velocity=Vector((0.0, 0.0, 0.0)), force=Vector((0.0, 0.0, 0.0)), mass=1.0):
-        # location and velocity is visible to outer
-        self.location = location
-        self.velocity = velocity
-        self.force = force
-        self.mass = mass
-
-    def clear_force(self):
-        self.force = Vector((0.0, 0.0, 0.0))
-
-    def apply_force(self, force):
-        self.force += force
-
-    def derivative_eval(self):
-        return self.velocity, self.force / self.mass
-
-    def get_state(self):
-        return self.location, self.velocity
-
-    def save_particle(self):
-        json_data = {}
-        json_data["location"] = [self.location.x, self.location.y, self.location.z]
-        json_data["velocity"] = [self.velocity.x, self.velocity.y, self.velocity.z]
-        json_data["mass"] = self.mass
-        return json_data
+# Float type of the simulated state per precision setting, the initial state always stays double
+PRECISION_DTYPES = {
+    'double': np.float64,
+    'single': np.float32,
+}
+# Smallest initial mass the batch editor writes
+MIN_MASS = 1e-6
 
-    def load_particle(self, json_data):
-        self.location = Vector((json_data["location"][0], json_data["location"][1], json_data["location"][2]))
-        self.velocity = Vector((json_data["velocity"][0], json_data["velocity"][1], json_data["velocity"][2]))
-        self.mass = json_data["mass"]
 
-    def set_state(self, particle_state):
-        self.location[0] = particle_state[0]
-        self.location[1] = particle_state[1]
-        self.location[2] = particle_state[2]
-        self.velocity[0] = particle_state[3]
-        self.velocity[1] = particle_state[4]
-        self.velocity[2] = particle_state[5]
+class StepCache:
+    # What stays fixed while the solver runs its stages, built by ParticleSystem.begin_step
+    def __init__(self, particle_system):
+        self.particle_count = particle_system.state.count
+        self.inverse_mass = 1.0 / particle_system.state.mass[:, None]
+        self.alive_idx = particle_system.find_alive_idx()
 
-    def is_collision(self, another_particle):
-        return (self.location - another_particle.location).length_squared <= (self.mass + another_particle.mass)**2
 
 class ParticleSystem:
     instance = None
     def __init__(self):
-        self.init_particle_list = []
-        self.particle_list = []
+        self.init_state = ParticleState()
+        self.state = ParticleState()
+        self.init_particle_list = ParticleList(self.init_state)
+        self.particle_list = ParticleList(self.state)
         self.force_list = []
         self.coherent_force_list = []
         self.constraint_list = []
         self.collision_detect_list = []
+        self.emitter_list = []
+        self.pool = ParticlePool()
+        self.sleep = ParticleSleep()
+        self.neighbor_search = NeighborSearch()
         self.time_step = 0.0
+        # Locations at the start of the current step, kept while a continuous collision needs them
+        self.previous_location = None
+        self.step_cache = None
         self.collection = None
         self.solver = ForwardEulerSolver()
+        self.profiler = StageProfiler()
+        self.num_threads = 1
+        self.executor = ChunkExecutor()
+        self.set_backend('numpy')
+        self.precision = 'double'
+        # Fixes the order of every reduction so the results don't depend on the thread count, see set_deterministic
+        self.deterministic = False
+        # [frame, state hash] of the frames of the last bake or frame calculation
+        self.frame_hash_list = []
+        # Worker processes of a domain decomposed bake, 1 bakes in this process, see domain.py
+        self.num_processes = 1
+        self.domain = None
+        # Set when the particles are the coarse proxy of a mesh, see lod.py
+        self.cloth_proxy = None
+        # Bumped whenever the particle, force or constraint lists change, caches built from them (the panel
+        # enums) compare against this
+        self.revision = 0
 
     @classmethod
     def get_instance(cls):
@@ -79,111 +95,136 @@ class ParticleSystem:
             cls.instance = None
 
     @classmethod
-    def save_init_system(cls, filepath='init_part.json'):
+    def save_init_system(cls, filepath='init_part.json', compact=True):
         if cls.instance != None:
-            self = cls.instance
-            json_data = {}
+            cls.instance.save_system(filepath, compact)
+
+    def save_system(self, filepath, compact=True):
+        # compact writes the particles and index tables to a .npz next to the json header
+        array_dict = {} if compact else None
+        json_data = {}
+        if compact:
+            json_data["location"] = store_array(array_dict, 'location', self.init_state.location)
+            json_data["velocity"] = store_array(array_dict, 'velocity', self.init_state.velocity)
+            json_data["mass"] = store_array(array_dict, 'mass', self.init_state.mass)
+        else:
             json_data["particle_list"] = []
             for init_particle in self.init_particle_list:
                 json_data["particle_list"].append(init_particle.save_particle())
 
-            json_data["force_list"] = []
-            for force in self.force_list:
-                json_data["force_list"].append(force.save_force())
-
-            json_data["coherent_force_list"] = []
-            for coherent_force in self.coherent_force_list:
-                json_data["coherent_force_list"].append(coherent_force.save_force(self))
-
-            json_data["constraint_list"] = []
-            for constraint in self.constraint_list:
-                json_data["constraint_list"].append(constraint.save_constraint(self))
-
-            json_data["collision_list"] = []
-            for collision in self.collision_detect_list:
-                json_data["collision_list"].append(collision.save_collision())
-
-            json_data["solver"] = self.solver.save_solver()
+        json_data["force_list"] = []
+        for force in self.force_list:
+            json_data["force_list"].append(force.save_force())
 
-            if not filepath.endswith('.json'):
-                filepath += '.json'
+        json_data["coherent_force_list"] = []
+        for coherent_force in self.coherent_force_list:
+            json_data["coherent_force_list"].append(coherent_force.save_force(self, array_dict))
 
-            with open(filepath, 'w') as fp:
-                json.dump(json_data, fp)
+        json_data["constraint_list"] = []
+        for constraint in self.constraint_list:
+            json_data["constraint_list"].append(constraint.save_constraint(self, array_dict))
+
+        json_data["collision_list"] = []
+        for collision in self.collision_detect_list:
+            json_data["collision_list"].append(collision.save_collision())
+
+        json_data["emitter_list"] = []
+        for emitter in self.emitter_list:
+            json_data["emitter_list"].append(emitter.save_emitter())
+        json_data["pool_capacity"] = self.pool.capacity
+
+        json_data["solver"] = self.solver.save_solver()
+        json_data["backend"] = self.backend
+        json_data["num_threads"] = self.get_num_threads()
+        json_data["precision"] = self.precision
+        json_data["deterministic"] = self.deterministic
+        json_data["num_processes"] = self.num_processes
+        json_data["sleep"] = self.sleep.save_sleep()
+        json_data["neighbor"] = self.neighbor_search.save_neighbor()
+        if self.cloth_proxy != None:
+            json_data["cloth_proxy"] = self.cloth_proxy.save_proxy(array_dict)
+
+        write_scene(filepath, json_data, array_dict)
 
     @classmethod
     def load_init_system(cls, filepath='init_part.json'):
         if cls.instance == None:
             cls.instance = ParticleSystem()
+        cls.instance.load_system(filepath)
+
+    def load_system(self, filepath):
+        self.load_scene_data(*read_scene(filepath))
+
+    def load_scene_data(self, json_data, array_dict=None):
+        self.clear_particles()
+        if array_dict != None:
+            self.add_particles(array_dict[json_data["location"]], array_dict[json_data["velocity"]], array_dict[json_data["mass"]])
+        elif len(json_data["particle_list"]) > 0:
+            self.add_particles(np.array([particle_data["location"] for particle_data in json_data["particle_list"]], dtype=np.float64),
+                               np.array([particle_data["velocity"] for particle_data in json_data["particle_list"]], dtype=np.float64),
+                               np.array([particle_data["mass"] for particle_data in json_data["particle_list"]], dtype=np.float64))
+        self.reset_state()
+
+        # Types missing from the registries (files from newer versions) are skipped
+        self.force_list = []
+        for force_data in json_data["force_list"]:
+            force_type = FORCE_TYPES.get(force_data['force_name'])
+            if force_type != None:
+                self.add_force(force_type()).load_force(force_data)
 
-        self = cls.instance
-        with open(filepath, 'r') as fp:
-            json_data = json.load(fp)
-
-            self.init_particle_list = []
-            self.particle_list = []
-            for init_particle_data in json_data["particle_list"]:
-                self.add_particle().load_particle(init_particle_data)
-
-            self.force_list = []
-            for force_data in json_data["force_list"]:
-                if force_data['force_name'] == 'constant_force':
-                    self.add_force(ConstantForce()).load_force(force_data)
-                elif force_data['force_name'] == 'damping_force':
-                    self.add_force(DampingForce()).load_force(force_data)
-                elif force_data['force_name'] == 'spring_force':
-                    self.add_force(SpringForce()).load_force(force_data)
-                elif force_data['force_name'] == 'gravity_force':
-                    self.add_force(GravityForce()).load_force(force_data)
-
-            self.coherent_force_list = []
-            for coherent_force_data in json_data["coherent_force_list"]:
-                # TODO
-                if coherent_force_data['coherent_force_name'] == 'spring_two_particle_force':
-                    self.add_coherent_force(SpringTwoParticleForce()).load_force(coherent_force_data, self)
-
-            self.constraint_list = []
-            for constraint_data in json_data["constraint_list"]:
-                if constraint_data['constraint_name'] == 'pin_constraint':
-                    self.add_constraint(PinConstraint()).load_constraint(constraint_data, self)
-                elif constraint_data['collision_name'] == 'axis_constraint':
-                    self.add_constraint(AxisConstraint()).load_constraint(constraint_data, self)
-                elif constraint_data['collision_name'] == 'plane_constraint':
-                    self.add_constraint(PlaneConstraint()).load_constraint(constraint_data, self)
-                elif constraint_data['collision_name'] == 'angular_constraint':
-                    self.add_constraint(AngularConstraint()).load_constraint(constraint_data, self)
-
-            self.collision_detect_list = []
-            for collision_data in json_data["collision_list"]:
-                if collision_data['collision_name'] == 'wall_collision':
-                    current_collection = bpy.data.collections.get("Collision")
-                    if current_collection == None:
-                        current_collection = create_collection(bpy.context.scene.collection, "Collision")
-                    plane_ob = create_plane(current_collection, 'Wall collision', Vector((0.0, 0.0, -4.0)))
-                    self.add_collision(WallCollision(plane_ob)).load_collision(collision_data)
-                elif collision_data['collision_name'] == 'particle_collision':
-                    self.add_collision(ParticleCollision()).load_collision(collision_data)
-
-            if json_data['solver'] == 'forward_euler_solver':
-                self.solver = ForwardEulerSolver()
-            elif json_data['solver'] == 'second_order_rk_solver':
-                self.solver = SecondOrderRKSolver()
-            elif json_data['solver'] == 'fourth_order_rk_solver':
-                self.solver = FourthOrderRKSolver()
-            elif json_data['solver'] == 'verlet_solver':
-                self.solver = VerletSolver()
-            elif json_data['solver'] == 'leap_frog_solver':
-                self.solver = LeapfrogSolver()
-            elif json_data['solver'] == 'backward_euler_solver':
-                self.solver = BackwardEulerSolver()
+        self.coherent_force_list = []
+        for coherent_force_data in json_data["coherent_force_list"]:
+            coherent_force_type = COHERENT_FORCE_TYPES.get(coherent_force_data['coherent_force_name'])
+            if coherent_force_type != None:
+                self.add_coherent_force(coherent_force_type()).load_force(coherent_force_data, self, array_dict)
 
+        self.constraint_list = []
+        for constraint_data in json_data["constraint_list"]:
+            constraint_type = CONSTRAINT_TYPES.get(constraint_data['constraint_name'])
+            if constraint_type != None:
+                self.add_constraint(constraint_type()).load_constraint(constraint_data, self, array_dict)
 
+        self.collision_detect_list = []
+        for collision_data in json_data["collision_list"]:
+            collision_type = COLLISION_TYPES.get(collision_data['collision_name'])
+            if collision_type != None:
+                self.add_collision(collision_type()).load_collision(collision_data)
+
+        self.emitter_list = []
+        for emitter_data in json_data.get("emitter_list", []):
+            emitter_type = EMITTER_TYPES.get(emitter_data['emitter_name'])
+            if emitter_type != None:
+                self.add_emitter(emitter_type()).load_emitter(emitter_data)
+        self.set_pool_capacity(json_data.get("pool_capacity", 0))
+
+        if json_data['solver'] in SOLVER_TYPES:
+            self.solver = SOLVER_TYPES[json_data['solver']]()
+
+        self.set_backend(json_data.get('backend', 'numpy'))
+        self.set_num_threads(json_data.get('num_threads', 1))
+        self.set_precision(json_data.get('precision', 'double'))
+        self.set_deterministic(json_data.get('deterministic', False))
+        self.set_num_processes(json_data.get('num_processes', 1))
+        if "sleep" in json_data:
+            self.sleep.load_sleep(json_data["sleep"])
+        if "neighbor" in json_data:
+            self.neighbor_search.load_neighbor(json_data["neighbor"])
+        if "cloth_proxy" in json_data:
+            self.cloth_proxy = ClothProxy()
+            self.cloth_proxy.load_proxy(json_data["cloth_proxy"], array_dict)
 
     def draw(self, context, layout, particle_idx):
         row = layout.row()
-        bpy.context.scene.particle_property.init_location.foreach_set(self.init_particle_list[particle_idx].location)
-        bpy.context.scene.particle_property.init_velocity.foreach_set(self.init_particle_list[particle_idx].velocity)
-        bpy.context.scene.particle_property.init_mass.foreach_set((self.init_particle_list[particle_idx].mass, ))
+        # Writing the fields runs their update callback, they are only written when another particle is
+        # shown or the particles changed since
+        draw_key = (id(self), particle_idx, self.revision)
+        if ParticleProp.draw_key != draw_key:
+            # The update callback would write them into the particle shown before
+            ParticleProp.particle_reference = None
+            bpy.context.scene.particle_property.init_location.foreach_set(self.init_state.location[particle_idx].tolist())
+            bpy.context.scene.particle_property.init_velocity.foreach_set(self.init_state.velocity[particle_idx].tolist())
+            bpy.context.scene.particle_property.init_mass.foreach_set((float(self.init_state.mass[particle_idx]), ))
+            ParticleProp.draw_key = draw_key
 
         row.label(text="Initialize property")
         row.operator('particle.sync_init', text="Sync initial state")
@@ -193,151 +234,451 @@ class ParticleSystem:
         row.prop(context.scene.particle_property, "init_mass", text="Mass")
         ParticleProp.particle_reference = self.init_particle_list[particle_idx]
 
-    def get_particle_idx(self, particle):
-        return self.particle_list.index(particle)
+    @property
+    def location(self):
+        return self.state.location
+
+    @property
+    def velocity(self):
+        return self.state.velocity
+
+    @property
+    def force(self):
+        return self.state.force
+
+    @property
+    def mass(self):
+        return self.state.mass
+
+    def set_backend(self, backend):
+        # Kernel backend used by springs, collisions and angular constraints, see kernels.py
+        self.backend = backend
+        self.kernels = get_kernels(backend)
+        self.set_num_threads(self.num_threads)
+
+    def set_num_threads(self, num_threads):
+        # Worker threads for the chunked force, spring and collision passes, 1 runs everything inline.
+        # Only the nogil numba kernels run side by side, numpy holds the GIL between its short calls and
+        # gains nothing from threads, so the numpy backend always runs inline
+        self.num_threads = max(int(num_threads), 1)
+        self.executor.shutdown()
+        self.executor = ChunkExecutor(self.num_threads if self.kernels is not NumpyKernels else 1)
+
+    def get_num_threads(self):
+        return self.num_threads
+
+    def set_precision(self, precision):
+        # 'single' runs the state, the forces and the solvers in float32, which halves the memory
+        # traffic of large scenes at the cost of some drift, see benchmark.check_precision_drift
+        self.precision = precision if precision in PRECISION_DTYPES else 'double'
+        self.state.set_dtype(PRECISION_DTYPES[self.precision])
+        # Arrays kept from the old state are in the old precision
+        self.solver.reset_solver(self)
+        self.neighbor_search.reset_neighbor()
+        self.sleep.reset_sleep()
+        self.step_cache = None
+
+    def set_deterministic(self, deterministic):
+        # Springs scatter their forces in edge order and neighbor lists are sorted, so bakes are bitwise equal
+        # whatever the thread count or the neighbor rebuild history. Compare runs with the frame hashes
+        self.deterministic = deterministic
+        self.neighbor_search.reset_neighbor()
+
+    def set_num_processes(self, num_processes):
+        self.num_processes = max(int(num_processes), 1)
+
+    def start_domain(self):
+        # Bakes spread over worker processes when asked to. Sleeping islands span slabs and need every
+        # particle, scenes with sleep enabled bake in this process
+        if self.num_processes <= 1 or self.sleep.enabled:
+            return
+        self.domain = DomainBake(self.num_processes)
+        self.domain.start(self)
+
+    def stop_domain(self):
+        if self.domain != None:
+            self.domain.stop(self)
+            self.domain = None
+
+    def record_frame_hash(self, frame):
+        self.frame_hash_list.append([frame, self.state.get_hash()])
+
+    def save_frame_hash(self, filepath):
+        write_frame_hash(filepath, self.frame_hash_list)
+
+    def apply_force_chunk(self, chunk_idx, start, end):
+        particle_chunk = ParticleChunk(self, start, end)
+        particle_chunk.force[:] = 0.0
+        for force in self.force_list:
+            force.apply_force(particle_chunk)
 
-    def add_particle(self, location=Vector((0.0, 0.0, 0.0)), velocity=Vector((0.0, 0.0, 0.0)), force=Vector((0.0, 0.0, 0.0)), mass=1.0):
-        particle = Particle(location, velocity, force, mass)
-        init_particle = Particle(location, velocity, force, mass)
-        self.particle_list.append(particle)
-        self.init_particle_list.append(init_particle)
-        return init_particle
+    def get_particle_idx(self, particle):
+        return particle.idx
+
+    def edit_init_particles(self, particle_idx_array, location=None, velocity=None, mass=None, mode='set'):
+        # One vectorized write of the initial state of many particles. mode 'set' assigns the values, 'scale'
+        # multiplies by them and 'offset' adds them, None leaves a field alone. Returns the rows edited
+        particle_idx_array = np.unique(np.asarray(particle_idx_array, dtype=np.int64))
+        particle_idx_array = particle_idx_array[(particle_idx_array >= 0) & (particle_idx_array < self.init_state.count)]
+        for array, value in ((self.init_state.location, location), (self.init_state.velocity, velocity), (self.init_state.mass, mass)):
+            if value is None:
+                continue
+            if mode == 'scale':
+                array[particle_idx_array] *= value
+            elif mode == 'offset':
+                array[particle_idx_array] += value
+            else:
+                array[particle_idx_array] = value
+        if mass is not None:
+            # Forces are divided by the mass
+            self.init_state.mass[particle_idx_array] = np.maximum(self.init_state.mass[particle_idx_array], MIN_MASS)
+        self.revision += 1
+        return particle_idx_array
+
+    def add_particle(self, location=(0.0, 0.0, 0.0), velocity=(0.0, 0.0, 0.0), force=(0.0, 0.0, 0.0), mass=1.0):
+        idx = self.add_particles(np.reshape(location, (1, 3)), np.reshape(velocity, (1, 3)), mass, np.reshape(force, (1, 3)))[0]
+        return self.init_particle_list[idx]
+
+    def add_particles(self, location_array, velocity_array=0.0, mass_array=1.0, force_array=0.0):
+        # Bulk add_particle, velocity, mass and force broadcast against the locations. Returns the new indices.
+        # The state rows go in front of the emitted particles so that state row i stays initial particle i
+        start_idx = self.init_state.add_array(location_array, velocity_array, force_array, mass_array)
+        add_count = self.init_state.count - start_idx
+        emitted_count = self.state.count - start_idx
+        self.state.insert_array(start_idx, location_array, velocity_array, force_array, mass_array)
+        self.pool.move_base(self.pool.base_count + add_count)
+        self.revision += 1
+        if emitted_count > 0:
+            idx_map = np.arange(start_idx + emitted_count)
+            idx_map[start_idx:] += add_count
+            self.remap_particles(idx_map)
+        elif self.sleep.is_active():
+            self.sleep.refresh(self)
+        return np.arange(start_idx, self.init_state.count)
 
     def remove_particle(self, i):
-        self.particle_list.pop(i)
-        self.init_particle_list.pop(i)
+        self.remove_particles([i])
+
+    def remove_particles(self, particle_idx_array):
+        # Compacts the particle arrays and renumbers every index table, entries that referenced a
+        # removed particle are dropped
+        particle_count = self.init_state.count
+        keep_mask = np.ones(particle_count, dtype=bool)
+        keep_mask[np.asarray(particle_idx_array, dtype=np.int64)] = False
+        # Rows of emitted particles after the initial ones are kept and move down with them
+        state_keep_mask = np.ones(self.state.count, dtype=bool)
+        state_keep_mask[:particle_count] = keep_mask
+        idx_map = np.full(self.state.count, -1, dtype=np.int64)
+        idx_map[state_keep_mask] = np.arange(np.count_nonzero(state_keep_mask))
+        self.state.compact(state_keep_mask)
+        self.init_state.compact(keep_mask)
+        self.pool.move_base(self.pool.base_count - (particle_count - self.init_state.count))
+        self.remap_particles(idx_map)
+
+    def remap_particles(self, idx_map):
+        # idx_map[old index] is the new index or -1, remap_particles returns False for entries that no longer apply
+        self.revision += 1
+        self.coherent_force_list = [coherent_force for coherent_force in self.coherent_force_list if coherent_force.remap_particles(idx_map)]
+        self.constraint_list = [constraint for constraint in self.constraint_list if constraint.remap_particles(idx_map)]
+        self.collision_detect_list = [collision for collision in self.collision_detect_list if collision.remap_particles(idx_map)]
+        self.solver.remap_particles(idx_map)
+        if self.cloth_proxy != None and not self.cloth_proxy.remap_particles(idx_map):
+            self.cloth_proxy = None
+        self.neighbor_search.reset_neighbor()
+        self.sleep.refresh(self)
+
+    def clear_particles(self):
+        # Every particle is removed from the index tables as well, springs and pins left empty are dropped
+        idx_map = np.full(max(self.state.count, self.init_state.count), -1, dtype=np.int64)
+        self.state.resize(0)
+        self.init_state.resize(0)
+        self.remap_particles(idx_map)
+        self.pool.reset_pool(0)
+        self.cloth_proxy = None
 
     def add_force(self, force):
         self.force_list.append(force)
+        self.revision += 1
         return force
 
+    def remove_force(self, force_idx):
+        self.revision += 1
+        return self.force_list.pop(force_idx)
+
+    def set_force(self, force):
+        # add_force in place of the forces of the same class, builders that run again don't stack them
+        self.force_list = [old_force for old_force in self.force_list if type(old_force) != type(force)]
+        return self.add_force(force)
+
     def add_coherent_force(self, coherent_force):
         self.coherent_force_list.append(coherent_force)
+        self.revision += 1
         return coherent_force
 
     def add_constraint(self, constraint):
         self.constraint_list.append(constraint)
+        self.revision += 1
         return constraint
 
+    def remove_constraint(self, constraint_idx):
+        self.revision += 1
+        return self.constraint_list.pop(constraint_idx)
+
     def add_collision(self, collision):
         self.collision_detect_list.append(collision)
         return collision
 
+    def add_emitter(self, emitter):
+        self.emitter_list.append(emitter)
+        return emitter
+
+    def set_pool_capacity(self, capacity):
+        # Rows reserved for emitted particles, emission beyond it is dropped
+        self.pool = ParticlePool(capacity)
+        self.reset_state()
+
+    @property
+    def alive(self):
+        return self.state.alive
+
+    def find_alive_idx(self):
+        # None while every row is alive, which is always the case without emitters
+        if self.pool.capacity == 0 or self.state.alive.all():
+            return None
+        return np.flatnonzero(self.state.alive)
+
+    def get_alive_idx(self):
+        # Rows only die or spawn between steps, the solver stages share the rows found in begin_step
+        step_cache = self.get_step_cache()
+        if step_cache != None:
+            return step_cache.alive_idx
+        return self.find_alive_idx()
+
+    def get_step_cache(self):
+        # None outside of simulate_step
+        if self.step_cache != None and self.step_cache.particle_count != self.state.count:
+            self.step_cache = None
+        return self.step_cache
+
+    def get_awake_idx(self):
+        # Alive rows that aren't asleep, None for all rows
+        if not self.sleep.is_active():
+            return self.get_alive_idx()
+        return np.flatnonzero(self.state.alive & ~self.sleep.sleep_mask)
+
+    def get_collision_idx(self):
+        # Rows the particle collision works on, None for all of them. With sleeping particles these are
+        # the awake rows and the sleeping ones they touch, see ParticleSleep.get_contact_idx
+        if self.sleep.is_active():
+            return self.sleep.get_contact_idx(self)
+        return self.get_alive_idx()
+
     def get_dim(self):
         return 6 * len(self.particle_list)
 
     def get_state(self):
-        particle_state = np.zeros((len(self.particle_list), 6))
-        for i in range(len(self.particle_list)):
-            location, velocity = self.particle_list[i].get_state()
-            particle_state[i, 0] = location[0]
-            particle_state[i, 1] = location[1]
-            particle_state[i, 2] = location[2]
-            particle_state[i, 3] = velocity[0]
-            particle_state[i, 4] = velocity[1]
-            particle_state[i, 5] = velocity[2]
+        with self.profiler.stage('solver/get_state'):
+            particle_state = np.hstack((self.state.location, self.state.velocity))
         return particle_state
 
     def set_state(self, particle_state):
-        for i in range(len(self.particle_list)):
-            self.particle_list[i].set_state(particle_state[i, 0:6])
+        with self.profiler.stage('solver/set_state'):
+            self.state.location[:] = particle_state[:, 0:3]
+            self.state.velocity[:] = particle_state[:, 3:6]
 
     def derivative_eval(self):
-        for particle in self.particle_list:
-            particle.clear_force()
-
-        for force in self.force_list:
-            for particle in self.particle_list:
-                force.apply_force(particle)
-
-        for coherent_force in self.coherent_force_list:
-            coherent_force.apply_force(self)
-
-        for constraint in self.constraint_list:
-            if constraint.type == 'pre':
-                constraint.apply_constraint(self)
-
-        particle_deriv_state = np.zeros((len(self.particle_list), 6))
-        for i in range(len(self.particle_list)):
-            velocity, acceleration = self.particle_list[i].derivative_eval()
-            particle_deriv_state[i, 0] = velocity[0]
-            particle_deriv_state[i, 1] = velocity[1]
-            particle_deriv_state[i, 2] = velocity[2]
-            particle_deriv_state[i, 3] = acceleration[0]
-            particle_deriv_state[i, 4] = acceleration[1]
-            particle_deriv_state[i, 5] = acceleration[2]
+        profiler = self.profiler
+        with profiler.stage('derivative_eval'):
+            chunk_list = self.executor.split(len(self.particle_list))
+            if self.domain != None:
+                # The workers add the per particle forces and the forces that split, see domain.py
+                self.domain.apply_forces(self)
+            elif len(chunk_list) > 1:
+                # Per particle forces only touch their own rows, each thread runs all of them on its chunk
+                with profiler.stage('derivative_eval/force'):
+                    self.executor.map(self.apply_force_chunk, chunk_list)
+            else:
+                with profiler.stage('derivative_eval/clear_force'):
+                    self.state.force[:] = 0.0
+
+                for i, force in enumerate(self.force_list):
+                    with profiler.stage(stage_name('derivative_eval/force', i, force)):
+                        force.apply_force(self)
+
+            if self.domain == None:
+                for i, coherent_force in enumerate(self.coherent_force_list):
+                    with profiler.stage(stage_name('derivative_eval/coherent_force', i, coherent_force)):
+                        coherent_force.apply_force(self)
+
+            step_cache = self.get_step_cache()
+            for i, constraint in enumerate(self.constraint_list):
+                if constraint.type == 'pre':
+                    with profiler.stage(stage_name('derivative_eval/pre_constraint', i, constraint)):
+                        if step_cache != None:
+                            constraint.apply_stage(self)
+                        else:
+                            constraint.apply_constraint(self)
+
+            with profiler.stage('derivative_eval/gather'):
+                if step_cache != None:
+                    particle_deriv_state = np.hstack((self.state.velocity, self.state.force * step_cache.inverse_mass))
+                else:
+                    particle_deriv_state = np.hstack((self.state.velocity, self.state.force / self.state.mass[:, None]))
 
         return particle_deriv_state
 
-    def save_animation(self, animation_dir):
-        particle_count = len(self.particle_list)
-        while particle_count < len(self.init_particle_list):
-            self.particle_list.pop()
-            particle_count = particle_count-1
-        while particle_count > len(self.init_particle_list):
-            self.particle_list.append(Particle())
-            particle_count = particle_count+1
+    def reset_state(self):
+        self.state.copy_from(self.init_state)
+        self.pool.reset(self)
+        for emitter in self.emitter_list:
+            emitter.reset_emitter()
+        self.sleep.reset_sleep()
+        self.neighbor_search.reset_neighbor()
+        self.step_cache = None
+        self.frame_hash_list = []
+
+    def simulate_step(self, step):
+        # Phases of a step: begin (gather what holds over the step), solve (force evaluation and
+        # integration, once per solver stage), project the post constraints, collide and commit
+        self.begin_step(step)
+        with self.profiler.stage('solve_step'):
+            self.solver.solve_step(self, step)
+        self.project_constraints()
+        self.collide()
+        self.commit_step(step)
+
+    def begin_step(self, step):
+        with self.profiler.stage('begin_step'):
+            self.time_step = step
+            if any(collision.continuous for collision in self.collision_detect_list):
+                self.previous_location = self.location.copy()
+            for constraint in self.constraint_list:
+                if constraint.type == 'pre':
+                    constraint.prepare_step(self)
+            self.step_cache = StepCache(self)
+            if self.domain != None:
+                self.domain.split(self)
+
+    def project_constraints(self):
+        profiler = self.profiler
+        for i, constraint in enumerate(self.constraint_list):
+            if constraint.type == 'post':
+                with profiler.stage(stage_name('post_constraint', i, constraint)):
+                    constraint.apply_constraint(self)
+        if self.sleep.is_active():
+            with profiler.stage('sleep/freeze'):
+                self.sleep.freeze(self)
 
-        for j in range(len(self.init_particle_list)):
-            self.particle_list[j].location = self.init_particle_list[j].location.copy()
-            self.particle_list[j].velocity = self.init_particle_list[j].velocity.copy()
-            self.particle_list[j].mass = self.init_particle_list[j].mass
+    def collide(self):
+        for i, collision in enumerate(self.collision_detect_list):
+            with self.profiler.stage(stage_name('collision', i, collision)):
+                collision.project_collision(self)
+
+    def commit_step(self, step):
+        # Rows spawn and die from here on, the step cache no longer holds
+        profiler = self.profiler
+        self.step_cache = None
+        if self.pool.capacity > 0:
+            with profiler.stage('emit'):
+                self.pool.park(self)
+                self.pool.expire(self, step)
+                for emitter in self.emitter_list:
+                    emitter.emit(self, step)
+        if self.sleep.enabled:
+            with profiler.stage('sleep/update'):
+                self.sleep.update(self)
+
+    def save_animation(self, animation_dir, frame_start=None, frame_end=None, frame_callback=None):
+        # The frame range defaults to the one of the scene, headless bakes pass it in. frame_callback is
+        # called with every solved frame
+        if frame_start == None:
+            frame_start = bpy.context.scene.frame_start
+        if frame_end == None:
+            frame_end = bpy.context.scene.frame_end
+        self.reset_state()
 
         json_data = {}
         json_data["particle_list"] = []
-        json_data["frame_start"] = bpy.context.scene.frame_start
-        json_data["frame_end"] = bpy.context.scene.frame_end
+        json_data["frame_start"] = frame_start
+        json_data["frame_end"] = frame_end
         for particle in self.particle_list:
-            particle_data = {}
-            particle_data["location"] = [particle.location.x, particle.location.y, particle.location.z]
-            particle_data["velocity"] = [particle.velocity.x, particle.velocity.y, particle.velocity.z]
-            particle_data["mass"] = particle.mass
-            json_data["particle_list"].append(particle_data)
+            json_data["particle_list"].append(particle.save_particle())
 
         init_animation_filepath = animation_dir + "config.json"
         with open(init_animation_filepath, 'w') as fp:
             json.dump(json_data, fp)
 
-        self.solver.reset_solver(self)
-        self.save_particle_animation(animation_dir, 0)
-        for i in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end):
-            self.solver.solve_step(self, 0.05)
-            # Constraint reapply
-            for constraint in self.constraint_list:
-                if constraint.type == 'post':
-                    constraint.apply_constraint(self)
-            for collision in self.collision_detect_list:
-                collision.project_collision(self)
-            self.save_particle_animation(animation_dir, i)
-
-    def save_particle_animation(self, output_dir, frame):
-        json_data = {}
-        json_data["particle_list"] = []
-        for particle in self.particle_list:
-            particle_data = {}
-            particle_data["location"] = [particle.location.x, particle.location.y, particle.location.z]
-            json_data["particle_list"].append(particle_data)
+        # Emitted particles take columns after the initial particles, up to the pool capacity
+        frame_cache = FrameCacheWriter(animation_dir, frame_start, frame_end, len(self.particle_list) + self.pool.capacity,
+                                       record_ids=self.pool.capacity > 0)
+        is_finished = False
+        try:
+            self.solver.reset_solver(self)
+            self.save_particle_animation(animation_dir, 0, frame_cache)
+            self.start_domain()
+            for i in range(frame_start, frame_end):
+                self.simulate_step(0.05)
+                self.save_particle_animation(animation_dir, i, frame_cache)
+                if frame_callback != None:
+                    frame_callback(i)
+            is_finished = True
+        finally:
+            self.stop_domain()
+            if is_finished:
+                frame_cache.close()
+            else:
+                # Without its cache and config the directory doesn't load as a bake
+                frame_cache.discard()
+                os.remove(init_animation_filepath)
+        self.save_frame_hash(animation_dir + FRAME_HASH_FILENAME)
+        if self.cloth_proxy != None:
+            # Playback rebuilds the mesh from the cached proxy frames
+            self.save_cloth_proxy(animation_dir + PROXY_FILENAME)
+
+    def save_cloth_proxy(self, filepath):
+        array_dict = {}
+        write_scene(filepath, {"cloth_proxy": self.cloth_proxy.save_proxy(array_dict)}, array_dict)
+
+    def save_particle_animation(self, output_dir, frame, frame_cache=None):
+        with self.profiler.stage('output/cache'):
+            self.record_frame_hash(frame)
+            json_data = {}
+            json_data["state_hash"] = self.frame_hash_list[-1][1]
+            json_data["particle_list"] = [{"location": location} for location in self.state.location.tolist()]
+            if self.pool.capacity > 0:
+                # Dead rows have id -1
+                json_data["alive_count"] = self.pool.get_alive_count(self)
+                json_data["particle_id"] = np.where(self.state.alive, self.state.particle_id, -1).tolist()
+            if self.sleep.enabled:
+                json_data["awake_count"] = self.sleep.get_awake_count(self)
+
+            animation_filepath = output_dir + str(frame) + ".json"
+            with open(animation_filepath, 'w') as fp:
+                json.dump(json_data, fp)
 
-        animation_filepath = output_dir + str(frame) + ".json"
-        with open(animation_filepath, 'w') as fp:
-            json.dump(json_data, fp)
+            if frame_cache != None:
+                frame_cache.write_frame(frame, self.state.location, np.where(self.state.alive, self.state.particle_id, -1))
 
-    def load_animation(self, input_dir):
+    def load_animation_config(self, input_dir):
         init_animation_filepath = input_dir + 'config.json'
         current_collection = bpy.data.collections.get("Custom Particle System")
         if current_collection == None:
             current_collection = create_collection(bpy.context.scene.collection, "Custom Particle System")
 
-        bpy.context.scene.frame_set(0)
         with open(init_animation_filepath, 'r') as fp:
             json_data = json.load(fp)
 
             frame_start = json_data["frame_start"]
             frame_end = json_data["frame_end"]
-            self.init_particle_list = []
-            self.particle_list = []
+            # The config holds the particles the forces and constraints were made for, their tables stay
+            self.state.resize(0)
+            self.init_state.resize(0)
+            self.pool.reset_pool(0)
+            self.cloth_proxy = None
+            self.revision += 1
             for init_particle_data in json_data["particle_list"]:
                 self.add_particle().load_particle(init_particle_data)
+            self.reset_state()
 
             object_count = len(current_collection.objects)
             while object_count < len(self.init_particle_list):
@@ -351,16 +692,38 @@ class ParticleSystem:
             particle_ob = current_collection.objects.get(str(j))
             particle_ob.scale = Vector(
                 (self.init_particle_list[j].mass, self.init_particle_list[j].mass, self.init_particle_list[j].mass))
+        return current_collection, frame_start, frame_end
+
+    def load_animation(self, input_dir):
+        AnimationPlayback.stop()
+        bpy.context.scene.frame_set(0)
+        current_collection, frame_start, frame_end = self.load_animation_config(input_dir)
 
         for i in range(frame_start, frame_end):
             animation_filepath = input_dir + str(i) + '.json'
             with open(animation_filepath, 'r') as fp:
                 json_data = json.load(fp)
-                for j in range(len(self.particle_list)):
+                for j in range(len(self.init_particle_list)):
                     particle_ob = current_collection.objects.get(str(j))
                     particle_ob.location = Vector((json_data['particle_list'][j]['location'][0], json_data['particle_list'][j]['location'][1], json_data['particle_list'][j]['location'][2]))
                     particle_ob.keyframe_insert(data_path="location", frame=i)
 
+    def update_init_objects(self, particle_idx_array):
+        # Moves the objects of the given particles to their initial state and refreshes the view once,
+        # the other objects and the selection are left alone
+        current_collection = bpy.data.collections.get("Custom Particle System")
+        if current_collection == None:
+            return
+        particle_idx_array = np.asarray(particle_idx_array, dtype=np.int64)
+        location_list = self.init_state.location[particle_idx_array].tolist()
+        mass_list = self.init_state.mass[particle_idx_array].tolist()
+        for j, location, mass in zip(particle_idx_array.tolist(), location_list, mass_list):
+            particle_ob = current_collection.objects.get(str(j))
+            if particle_ob != None:
+                particle_ob.location = location
+                particle_ob.scale = (mass, mass, mass)
+        bpy.context.view_layer.update()
+
     def update_to_object(self, context, calculate_frame=False):
         current_collection = bpy.data.collections.get("Custom Particle System")
         if current_collection == None:
@@ -373,144 +736,329 @@ class ParticleSystem:
             current_collection.objects.unlink(current_collection.objects.get(str(object_count-1)))
             object_count = object_count-1
 
-        particle_count = len(self.particle_list)
-        while particle_count < len(self.init_particle_list):
-            self.particle_list.pop()
-            particle_count = particle_count-1
-        while particle_count > len(self.init_particle_list):
-            self.particle_list.append(Particle())
-            particle_count = particle_count+1
-
         if calculate_frame == False:
             for i in range(len(self.init_particle_list)):
                 particle_ob = current_collection.objects.get(str(i))
                 particle_ob.location = self.init_particle_list[i].location
         else:
+            AnimationPlayback.stop()
             bpy.context.scene.frame_set(0)
+            self.reset_state()
             for j in range(len(self.init_particle_list)):
-                self.particle_list[j].location = self.init_particle_list[j].location.copy()
-                self.particle_list[j].velocity = self.init_particle_list[j].velocity.copy()
-                self.particle_list[j].mass = self.init_particle_list[j].mass
                 particle_ob = current_collection.objects.get(str(j))
                 particle_ob.scale = Vector((self.init_particle_list[j].mass, self.init_particle_list[j].mass, self.init_particle_list[j].mass))
 
             self.solver.reset_solver(self)
-            for i in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end):
-                self.solver.solve_step(self, 0.05)
-                # Constraint reapply
-                print("frame ", i)
-                for constraint in self.constraint_list:
-                    if constraint.type == 'post':
-                        constraint.apply_constraint(self)
-                for collision in self.collision_detect_list:
-                    collision.project_collision(self)
-                for j in range(len(self.particle_list)):
-                    particle_ob = current_collection.objects.get(str(j))
-                    particle_ob.location = self.particle_list[j].location
-                    particle_ob.keyframe_insert(data_path="location", frame=i)
-
-class MassSpringSystem:
-    def __init__(self, advance=False):
-        self.row = 7
-        self.col = 7
-        self.stiffness_constant = 0.2
-        self.rest_length = 4.0
+            self.record_frame_hash(0)
+            try:
+                self.start_domain()
+                for i in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end):
+                    print("frame ", i)
+                    self.simulate_step(0.05)
+                    self.record_frame_hash(i)
+                    with self.profiler.stage('output/keyframe'):
+                        # Only the initial particles have objects, emitted ones are in the bake cache
+                        for j, location in enumerate(self.state.location[:len(self.init_particle_list)].tolist()):
+                            particle_ob = current_collection.objects.get(str(j))
+                            particle_ob.location = location
+                            particle_ob.keyframe_insert(data_path="location", frame=i)
+            finally:
+                self.stop_domain()
+
+class AnimationPlayback:
+    # Streams a baked animation to the particle objects from frame_change_pre instead of keyframing every frame
+    reader = None
+    particle_ob_list = []
+    # Mesh rebuilt from the proxy particles of a level of detail bake, see lod.py
+    cloth_proxy = None
+    proxy_mesh = None
+    proxy_inverse_matrix = None
+    proxy_rest_co = None
 
+    @classmethod
+    def start(cls, input_dir):
+        cls.stop()
         p_system = ParticleSystem.get_instance()
-        particle_amount = self.row * self.col
-        HORIZONTAL_LENGTH = 3.0
-        VERTICAL_LENGTH = 3.0
-        while len(p_system.init_particle_list) < particle_amount:
-            p_system.add_particle()
-        while len(p_system.init_particle_list) > particle_amount:
-            p_system.remove_particle(len(p_system.init_particle_list) - 1)
+        current_collection, frame_start, frame_end = p_system.load_animation_config(input_dir)
+
+        cls.reader = FrameCacheReader(input_dir)
+        cls.particle_ob_list = []
+        for j in range(cls.reader.particle_count):
+            particle_ob = current_collection.objects.get(str(j))
+            # Keyframes from an eager load would override the handler
+            particle_ob.animation_data_clear()
+            cls.particle_ob_list.append(particle_ob)
+
+        proxy_filepath = input_dir + PROXY_FILENAME
+        if os.path.exists(proxy_filepath):
+            json_data, array_dict = read_scene(proxy_filepath)
+            cloth_proxy = ClothProxy()
+            cloth_proxy.load_proxy(json_data["cloth_proxy"], array_dict)
+            proxy_ob = bpy.data.objects.get(cloth_proxy.object_name)
+            if proxy_ob != None and proxy_ob.type == 'MESH' and len(proxy_ob.data.vertices) == cloth_proxy.weight.shape[0]:
+                cls.cloth_proxy = cloth_proxy
+                cls.proxy_mesh = proxy_ob.data
+                # Put back when playback stops
+                cls.proxy_rest_co = np.empty(len(proxy_ob.data.vertices) * 3, dtype=np.float32)
+                proxy_ob.data.vertices.foreach_get("co", cls.proxy_rest_co)
+                # Particles are in world space, the vertices in object space
+                cls.proxy_inverse_matrix = np.linalg.inv(np.array(proxy_ob.matrix_world))
+
+        bpy.app.handlers.frame_change_pre.append(animation_playback_handler)
+        animation_playback_handler(bpy.context.scene)
+
+    @classmethod
+    def stop(cls):
+        if animation_playback_handler in bpy.app.handlers.frame_change_pre:
+            bpy.app.handlers.frame_change_pre.remove(animation_playback_handler)
+        cls.reader = None
+        cls.particle_ob_list = []
+        if cls.proxy_mesh != None:
+            cls.proxy_mesh.vertices.foreach_set("co", cls.proxy_rest_co)
+            cls.proxy_mesh.update()
+        cls.cloth_proxy = None
+        cls.proxy_mesh = None
+        cls.proxy_inverse_matrix = None
+        cls.proxy_rest_co = None
+
+    @classmethod
+    def is_playing(cls):
+        return cls.reader != None
+
+def animation_playback_handler(scene, depsgraph=None):
+    reader = AnimationPlayback.reader
+    if reader == None:
+        return
+    locations = reader.read_frame(scene.frame_current)
+    for particle_ob, location in zip(AnimationPlayback.particle_ob_list, locations):
+        particle_ob.location = location
+    if AnimationPlayback.cloth_proxy != None:
+        inverse_matrix = AnimationPlayback.proxy_inverse_matrix
+        vertex_location = AnimationPlayback.cloth_proxy.get_fine_location(locations) @ inverse_matrix[:3, :3].T + inverse_matrix[:3, 3]
+        AnimationPlayback.proxy_mesh.vertices.foreach_set("co", vertex_location.astype(np.float32).ravel())
+        AnimationPlayback.proxy_mesh.update()
+
+def grid_spring_edges(row, col, row_offset, col_offset):
+    # (i, j) - (i + row_offset, j + col_offset) for every pair inside a row x col grid, each edge once
+    i, j = np.meshgrid(np.arange(row), np.arange(col), indexing='ij')
+    i_end = i + row_offset
+    j_end = j + col_offset
+    is_inside = (i_end >= 0) & (i_end < row) & (j_end >= 0) & (j_end < col)
+    return np.stack((i[is_inside] * col + j[is_inside], i_end[is_inside] * col + j_end[is_inside]), axis=1)
+
+def parse_index_ranges(text, count):
+    # Particle indices from text like "0-9, 20, 30-": ranges include both ends and an open end runs to the
+    # last particle, indices past count are dropped. Raises ValueError on anything else
+    idx_array_list = [np.zeros(0, dtype=np.int64)]
+    for part in text.replace(' ', '').split(','):
+        if part == '':
+            continue
+        start, separator, end = part.partition('-')
+        start = int(start) if start != '' else 0
+        if separator == '':
+            end = start
+        else:
+            end = int(end) if end != '' else count - 1
+        idx_array_list.append(np.arange(max(start, 0), min(end, count - 1) + 1, dtype=np.int64))
+    return np.unique(np.concatenate(idx_array_list))
+
+def grid_pin_idx(row, col, pin_pattern):
+    if pin_pattern == 'top_corners':
+        return np.array([0, col - 1], dtype=np.int64)
+    elif pin_pattern == 'corners':
+        return np.array([0, col - 1, (row - 1) * col, row * col - 1], dtype=np.int64)
+    elif pin_pattern == 'top_row':
+        return np.arange(col, dtype=np.int64)
+    elif pin_pattern == 'none':
+        return np.zeros(0, dtype=np.int64)
+    # Explicit particle indices
+    return np.asarray(pin_pattern, dtype=np.int64)
+
+class MassSpringSystem:
+    # (row offset, col offset) of the springs of each family, rest length scales with the offset length
+    SPRING_FAMILIES = {
+        'structural': ((1, 0), (0, 1)),
+        'shear': ((1, 1), (1, -1)),
+        'flexion': ((2, 0), (0, 2)),
+    }
+
+    def __init__(self, advance=False, row=7, col=7, spacing=3.0, rest_length=4.0, spring_constant=8.0,
+                 pin_pattern='top_corners', spring_families=None, create_objects=True, create_lines=False, p_system=None):
+        self.row = row
+        self.col = col
+        self.spacing = spacing
+        self.rest_length = rest_length
+        # The old builder added every edge twice with a constant of 4.0
+        self.spring_constant = spring_constant
+        self.pin_pattern = pin_pattern
+        if spring_families == None:
+            spring_families = ('structural', 'shear', 'flexion') if advance == True else ('structural',)
+        self.spring_families = spring_families
+        if p_system == None:
+            p_system = ParticleSystem.get_instance()
+        self.build(p_system)
+
+        if create_objects == True:
+            p_system.update_to_object(bpy.context, False)
+        # One hooked line object per spring, too slow for anything but small grids
+        if create_lines == True:
+            current_collection = bpy.data.collections.get("Custom Particle System")
+            line_collection = bpy.data.collections.get("Line Connection")
+            if line_collection == None:
+                line_collection = create_collection(bpy.context.scene.collection, "Line Connection")
+            for particle_idx_1, particle_idx_2 in p_system.coherent_force_list[self.structural_force_idx].coherent_particle_list:
+                create_connect_line(line_collection, current_collection.objects.get(str(particle_idx_1)), current_collection.objects.get(str(particle_idx_2)))
+
+    def build(self, p_system):
+        i, j = np.meshgrid(np.arange(self.row), np.arange(self.col), indexing='ij')
+        location_array = np.stack((self.spacing * j.ravel(), np.zeros(self.row * self.col), -self.spacing * i.ravel()), axis=1)
+        p_system.clear_particles()
+        p_system.add_particles(location_array)
 
         pin_constraint = PinConstraint()
-        for i in range(self.row):
-            for j in range(self.col):
-                particle_idx = i*self.col + j
-                location = Vector((HORIZONTAL_LENGTH * j, 0.0, -VERTICAL_LENGTH * i))
-                p_system.init_particle_list[particle_idx].location = location
-                if i == 0 and (j == 0 or j == self.col-1):
-                    pin_constraint.add_pin(p_system.particle_list[particle_idx], location)
+        pin_idx_array = grid_pin_idx(self.row, self.col, self.pin_pattern)
+        pin_constraint.add_pin_array(pin_idx_array, location_array[pin_idx_array])
         p_system.add_constraint(pin_constraint)
-        p_system.update_to_object(bpy.context, False)
 
-        current_collection = bpy.data.collections.get("Custom Particle System")
-        line_collection = bpy.data.collections.get("Line Connection")
-        if line_collection == None:
-            line_collection = create_collection(bpy.context.scene.collection, "Line Connection")
-        # Structural force
-
-        structural_force = SpringTwoParticleForce()
-        # FIXME rest_length determine
-        structural_rest_length = self.rest_length
-        for i in range(self.row):
-            for j in range(self.col):
-                if i-1 >= 0:
-                    create_connect_line(line_collection, current_collection.objects.get(str((i-1)*self.col+j)), current_collection.objects.get(str(i*self.col+j)))
-                    structural_force.add_coherent((p_system.particle_list[(i-1)*self.col+j], p_system.particle_list[i*self.col+j]), structural_rest_length)
-                if i+1 < self.row:
-                    create_connect_line(line_collection, current_collection.objects.get(str(i*self.col+j)), current_collection.objects.get(str((i+1)*self.col+j)))
-                    structural_force.add_coherent((p_system.particle_list[i*self.col+j], p_system.particle_list[(i+1)*self.col+j]), structural_rest_length)
-                if j-1 >= 0:
-                    create_connect_line(line_collection, current_collection.objects.get(str(i*self.col+j-1)), current_collection.objects.get(str(i*self.col+j)))
-                    structural_force.add_coherent((p_system.particle_list[i*self.col+j-1], p_system.particle_list[i*self.col+j]), structural_rest_length)
-                if j+1 < self.col:
-                    create_connect_line(line_collection, current_collection.objects.get(str(i*self.col+j)), current_collection.objects.get(str(i*self.col+j+1)))
-                    structural_force.add_coherent((p_system.particle_list[i*self.col+j], p_system.particle_list[i*self.col+j+1]), structural_rest_length)
-        p_system.add_coherent_force(structural_force)
-
-        if advance == True:
-            # Shear force
-            shear_force = SpringTwoParticleForce()
-            shear_rest_length = self.rest_length * math.sqrt(2)
-            for i in range(self.row):
-                for j in range(self.col):
-                    if i - 1 >= 0 and j-1 >= 0:
-                        shear_force.add_coherent(
-                            (p_system.particle_list[(i - 1) * self.col + j-1], p_system.particle_list[i * self.col + j]),
-                            shear_rest_length)
-                    if i + 1 < self.row and j-1 >= 0:
-                        shear_force.add_coherent(
-                            (p_system.particle_list[i * self.col + j], p_system.particle_list[(i + 1) * self.col + j-1]),
-                            shear_rest_length)
-                    if i-1 >= 0 and j + 1 < self.col:
-                        shear_force.add_coherent(
-                            (p_system.particle_list[(i-1) * self.col + j + 1], p_system.particle_list[i * self.col + j]),
-                            shear_rest_length)
-                    if i+1 < self.row and j + 1 < self.col:
-                        shear_force.add_coherent(
-                            (p_system.particle_list[i * self.col + j], p_system.particle_list[(i+1) * self.col + j + 1]),
-                            shear_rest_length)
-
-            # Flexion force
-            flexion_force = SpringTwoParticleForce()
-            flexion_rest_length = 2 * self.rest_length
-            for i in range(self.row):
-                for j in range(self.col):
-                    if i - 2 >= 0:
-                        flexion_force.add_coherent(
-                            (p_system.particle_list[(i - 2) * self.col + j], p_system.particle_list[i * self.col + j]),
-                            flexion_rest_length)
-                    if i + 2 < self.row:
-                        flexion_force.add_coherent(
-                            (p_system.particle_list[i * self.col + j], p_system.particle_list[(i + 2) * self.col + j]),
-                            flexion_rest_length)
-                    if j - 2 >= 0:
-                        flexion_force.add_coherent(
-                            (p_system.particle_list[i * self.col + j - 2], p_system.particle_list[i * self.col + j]),
-                            flexion_rest_length)
-                    if j + 2 < self.col:
-                        flexion_force.add_coherent(
-                            (p_system.particle_list[i * self.col + j], p_system.particle_list[i * self.col + j + 2]),
-                            flexion_rest_length)
-
-            p_system.add_coherent_force(shear_force)
-            p_system.add_coherent_force(flexion_force)
+        self.structural_force_idx = None
+        for family in self.spring_families:
+            spring_force = SpringTwoParticleForce()
+            spring_force.spring_constant = self.spring_constant
+            for row_offset, col_offset in self.SPRING_FAMILIES[family]:
+                spring_force.add_coherent_array(grid_spring_edges(self.row, self.col, row_offset, col_offset),
+                                                self.rest_length * math.sqrt(row_offset ** 2 + col_offset ** 2))
+            if family == 'structural':
+                self.structural_force_idx = len(p_system.coherent_force_list)
+            p_system.add_coherent_force(spring_force)
 
         gravity_force = GravityForce()
-        p_system.add_force(gravity_force)
+        p_system.set_force(gravity_force)
 
         damping_force = DampingForce()
-        p_system.add_force(damping_force)
\ No newline at end of file
+        p_system.set_force(damping_force)
+
+def face_bending_pairs(loop_vertex_array, loop_start_array, loop_total_array, vertex_count):
+    # Bending springs across every edge shared by exactly two faces. Each end of the edge is paired with
+    # its neighbours along the two faces, for triangles both pairs are the two opposite vertices and for
+    # quads they continue the rows over the edge. Returned as unique (B, 2) index rows
+    loop_count = loop_vertex_array.shape[0]
+    polygon_start = np.repeat(loop_start_array, loop_total_array)
+    polygon_total = np.repeat(loop_total_array, loop_total_array)
+    loop_offset = np.arange(loop_count) - polygon_start
+    vertex_1 = loop_vertex_array
+    vertex_2 = loop_vertex_array[polygon_start + (loop_offset + 1) % polygon_total]
+    neighbour_1 = loop_vertex_array[polygon_start + (loop_offset - 1) % polygon_total]
+    neighbour_2 = loop_vertex_array[polygon_start + (loop_offset + 2) % polygon_total]
+    # Faces run over a shared edge in opposite directions, sort the neighbours by the edge end they belong to
+    is_forward = vertex_1 < vertex_2
+    low_neighbour = np.where(is_forward, neighbour_1, neighbour_2)
+    high_neighbour = np.where(is_forward, neighbour_2, neighbour_1)
+    edge_key = np.minimum(vertex_1, vertex_2) * vertex_count + np.maximum(vertex_1, vertex_2)
+
+    order = np.argsort(edge_key, kind='stable')
+    edge_key = edge_key[order]
+    key_start = np.flatnonzero(np.r_[True, edge_key[1:] != edge_key[:-1]])
+    key_total = np.diff(np.r_[key_start, edge_key.shape[0]])
+    # Boundary edges have one face and non manifold edges more than two, neither gets a bending spring
+    manifold_start = key_start[key_total == 2]
+    bending_list = []
+    for neighbour in (low_neighbour[order], high_neighbour[order]):
+        bending_list.append(np.stack((neighbour[manifold_start], neighbour[manifold_start + 1]), axis=1))
+    bending_array = np.concatenate(bending_list)
+    bending_array = bending_array[bending_array[:, 0] != bending_array[:, 1]]
+    return np.unique(np.sort(bending_array, axis=1), axis=0).reshape(-1, 2)
+
+class MeshSpringSystem:
+    # Mass spring system from a mesh object, one particle per vertex, structural springs on the edges
+    # and bending springs across the faces, vertices of the pin group are pinned
+    def __init__(self, ob=None, pin_group_name='', spring_constant=8.0, bending_constant=2.0, mass=1.0, create_objects=True, p_system=None):
+        self.spring_constant = spring_constant
+        self.bending_constant = bending_constant
+        self.mass = mass
+        if p_system == None:
+            p_system = ParticleSystem.get_instance()
+        # Without an object nothing is built, build takes the mesh arrays directly
+        if ob == None:
+            return
+        location_array, edge_array, bending_array, pin_idx_array = self.read_mesh(ob, pin_group_name)
+        self.build(p_system, location_array, edge_array, bending_array, pin_idx_array)
+        if create_objects == True:
+            p_system.update_to_object(bpy.context, False)
+
+    def read_mesh(self, ob, pin_group_name=''):
+        mesh = ob.data
+        vertex_count = len(mesh.vertices)
+        location_array = np.empty(vertex_count * 3)
+        mesh.vertices.foreach_get("co", location_array)
+        location_array = location_array.reshape(-1, 3)
+        # World space, the particles don't inherit the object transform
+        matrix_world = np.array(ob.matrix_world)
+        location_array = location_array @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+
+        edge_array = np.empty(len(mesh.edges) * 2, dtype=np.int64)
+        mesh.edges.foreach_get("vertices", edge_array)
+        edge_array = edge_array.reshape(-1, 2)
+
+        loop_vertex_array = np.empty(len(mesh.loops), dtype=np.int64)
+        mesh.loops.foreach_get("vertex_index", loop_vertex_array)
+        loop_start_array = np.empty(len(mesh.polygons), dtype=np.int64)
+        mesh.polygons.foreach_get("loop_start", loop_start_array)
+        loop_total_array = np.empty(len(mesh.polygons), dtype=np.int64)
+        mesh.polygons.foreach_get("loop_total", loop_total_array)
+        bending_array = face_bending_pairs(loop_vertex_array, loop_start_array, loop_total_array, vertex_count)
+
+        pin_idx_array = np.zeros(0, dtype=np.int64)
+        vertex_group = ob.vertex_groups.get(pin_group_name) if pin_group_name != '' else None
+        if vertex_group != None:
+            # Group weights have no foreach access, half weight or more counts as pinned
+            group_idx = vertex_group.index
+            pin_idx_array = np.array([vertex.index for vertex in mesh.vertices
+                                      if any(group.group == group_idx and group.weight >= 0.5 for group in vertex.groups)], dtype=np.int64)
+        return location_array, edge_array, bending_array, pin_idx_array
+
+    def build(self, p_system, location_array, edge_array, bending_array, pin_idx_array):
+        p_system.clear_particles()
+        p_system.add_particles(location_array, 0.0, self.mass)
+
+        if pin_idx_array.shape[0] > 0:
+            pin_constraint = PinConstraint()
+            pin_constraint.add_pin_array(pin_idx_array, location_array[pin_idx_array])
+            p_system.add_constraint(pin_constraint)
+
+        # Rest lengths are the lengths in the mesh
+        for spring_constant, spring_edge_array in ((self.spring_constant, edge_array), (self.bending_constant, bending_array)):
+            if spring_edge_array.shape[0] == 0:
+                continue
+            spring_force = SpringTwoParticleForce()
+            spring_force.spring_constant = spring_constant
+            location_vec = location_array[spring_edge_array[:, 0]] - location_array[spring_edge_array[:, 1]]
+            spring_force.add_coherent_array(spring_edge_array, np.sqrt(np.einsum('ij,ij->i', location_vec, location_vec)))
+            p_system.add_coherent_force(spring_force)
+
+        gravity_force = GravityForce()
+        p_system.set_force(gravity_force)
+
+        damping_force = DampingForce()
+        p_system.set_force(damping_force)
+
+class ProxyMeshSpringSystem(MeshSpringSystem):
+    # Mass spring system on a coarse proxy of a mesh object, see lod.py. Only the proxy particles are
+    # simulated, bakes keep the interpolation weights and playback moves the mesh vertices with the proxy
+    def __init__(self, ob=None, cell_size=1.0, pin_group_name='', spring_constant=8.0, bending_constant=2.0, mass=1.0, neighbor_count=4,
+                 create_objects=True, p_system=None):
+        self.spring_constant = spring_constant
+        self.bending_constant = bending_constant
+        self.mass = mass
+        if p_system == None:
+            p_system = ParticleSystem.get_instance()
+        if ob == None:
+            return
+        location_array, edge_array, bending_array, pin_idx_array = self.read_mesh(ob, pin_group_name)
+        self.build_proxy(p_system, location_array, edge_array, pin_idx_array, cell_size, neighbor_count, ob.name)
+        if create_objects == True:
+            p_system.update_to_object(bpy.context, False)
+
+    def build_proxy(self, p_system, location_array, edge_array, pin_idx_array, cell_size=1.0, neighbor_count=4, object_name=''):
+        self.cloth_proxy = ClothProxy(cell_size, neighbor_count, object_name)
+        self.build(p_system, *self.cloth_proxy.build(location_array, edge_array, pin_idx_array))
+        p_system.cloth_proxy = self.cloth_proxy
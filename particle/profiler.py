@@ -0,0 +1,79 @@
+import time
+import json
+
+# Opt in wall time accounting for the simulation step, stage names are '/' separated paths
+# such as 'derivative_eval/force' or 'collision/0 WallCollision'.
+
+
+class StageTimer:
+    __slots__ = ('profiler', 'name', 'start_time')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add_sample(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+def stage_name(stage, idx, instance):
+    # Same "<idx> <ClassName>" naming as the force and constraint lists in the panel
+    return stage + '/' + str(idx) + ' ' + type(instance).__name__
+
+
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        # name -> [total seconds, call count], insertion ordered so the table follows the step
+        self.stage_dict = {}
+
+    def reset(self):
+        self.stage_dict = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+    def add_sample(self, name, seconds):
+        sample = self.stage_dict.get(name)
+        if sample == None:
+            self.stage_dict[name] = [seconds, 1]
+        else:
+            sample[0] += seconds
+            sample[1] += 1
+
+    def get_table(self):
+        # (name, calls, total seconds, mean seconds per call)
+        return [(name, calls, seconds, seconds / calls) for name, (seconds, calls) in self.stage_dict.items()]
+
+    def to_json(self):
+        json_data = {}
+        for name, calls, seconds, mean_seconds in self.get_table():
+            json_data[name] = {"calls": calls, "seconds": seconds, "mean_seconds": mean_seconds}
+        return json_data
+
+    def save(self, filepath):
+        if not filepath.endswith('.json'):
+            filepath += '.json'
+        with open(filepath, 'w') as fp:
+            json.dump(self.to_json(), fp, indent=2)
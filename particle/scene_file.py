@@ -0,0 +1,39 @@
+import numpy as np
+import os
+import json
+
+# Compact scene files: a json header with the force, constraint and solver settings, and the
+# particle state and the large index tables in a .npz file next to it. The header refers to
+# the arrays by key, so loading a big cloth is a handful of array reads instead of a json
+# object per particle and per spring.
+SCENE_ARRAY_SUFFIX = '.npz'
+
+
+def store_array(array_dict, name, array):
+    # Adds array under a key not used yet and returns the key to keep in the json header
+    key = name + '_' + str(len(array_dict))
+    array_dict[key] = np.ascontiguousarray(array)
+    return key
+
+
+def write_scene(filepath, json_data, array_dict=None):
+    if not filepath.endswith('.json'):
+        filepath += '.json'
+    if array_dict != None:
+        array_path = filepath[:-len('.json')] + SCENE_ARRAY_SUFFIX
+        json_data['array_file'] = os.path.basename(array_path)
+        np.savez(array_path, **array_dict)
+    with open(filepath, 'w') as fp:
+        json.dump(json_data, fp)
+    return filepath
+
+
+def read_scene(filepath):
+    # (json_data, array_dict), array_dict is None for plain json scenes
+    with open(filepath, 'r') as fp:
+        json_data = json.load(fp)
+    if 'array_file' not in json_data:
+        return json_data, None
+    with np.load(os.path.join(os.path.dirname(filepath), json_data['array_file'])) as array_file:
+        array_dict = {key: array_file[key] for key in array_file.files}
+    return json_data, array_dict
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .apply_force import SpringTwoParticleForce
+
+# Particles that stay still for sleep_frames steps in a row are put to sleep, a whole island
+# (particles connected by springs) at a time. Sleeping rows are put back where they fell asleep after
+# every solver step, their springs are skipped and the particle collision only sees them through a
+# tree that is rebuilt when the sleeping set changes. An island wakes up when the force on one of its
+# particles changes or an awake particle touches it.
+
+
+class ParticleSleep:
+    def __init__(self, enabled=False, velocity_threshold=0.05, force_threshold=0.5, sleep_frames=10):
+        # velocity_threshold is a speed, force_threshold a change of force / mass from one step to the next.
+        # Resting contact under gravity keeps a constant net force, so it is its change that is tested
+        self.enabled = enabled
+        self.velocity_threshold = velocity_threshold
+        self.force_threshold = force_threshold
+        self.sleep_frames = sleep_frames
+        # Bumped whenever the sleeping set changes, caches built from it compare against this
+        self.revision = 0
+        self.island_source = None
+        self.reset_sleep()
+
+    def reset_sleep(self):
+        self.revision += 1
+        self.sleep_mask = np.zeros(0, dtype=bool)
+        self.sleep_idx = np.zeros(0, dtype=np.int64)
+        self.sleep_location = np.zeros((0, 3))
+        self.last_acceleration = None
+        self.sleep_tree = None
+        self.awake_count_list = []
+
+    def is_active(self):
+        return self.enabled and self.sleep_idx.shape[0] > 0
+
+    def get_island(self, particle_system):
+        # (island label per particle, island count), rebuilt when the springs change
+        edge_array_list = [coherent_force.get_edge_array()[0] for coherent_force in particle_system.coherent_force_list
+                           if isinstance(coherent_force, SpringTwoParticleForce)]
+        particle_count = particle_system.state.count
+        island_source = (particle_count, edge_array_list)
+        if self.island_source == None or self.island_source[0] != particle_count or len(self.island_source[1]) != len(edge_array_list) \
+                or any(old is not new for old, new in zip(self.island_source[1], edge_array_list)):
+            edge_array = np.concatenate([np.zeros((0, 2), dtype=np.int64)] + edge_array_list)
+            graph = coo_matrix((np.ones(edge_array.shape[0]), (edge_array[:, 0], edge_array[:, 1])), shape=(particle_count, particle_count))
+            self.island_count, self.island_label = connected_components(graph, directed=False)
+            self.island_source = island_source
+        return self.island_label, self.island_count
+
+    def get_sleep_mask(self, particle_system):
+        # An island sleeps when every alive particle of it has been still long enough
+        state = particle_system.state
+        island_label, island_count = self.get_island(particle_system)
+        island_still_frames = np.full(island_count, np.iinfo(np.int64).max)
+        np.minimum.at(island_still_frames, island_label[state.alive], state.still_frames[state.alive])
+        return state.alive & (island_still_frames[island_label] >= self.sleep_frames)
+
+    def get_awake_count(self, particle_system):
+        return int(np.count_nonzero(particle_system.state.alive)) - self.sleep_idx.shape[0]
+
+    def refresh(self, particle_system):
+        sleep_mask = self.get_sleep_mask(particle_system)
+        if sleep_mask.shape == self.sleep_mask.shape and np.array_equal(sleep_mask, self.sleep_mask):
+            return
+        if self.last_acceleration is not None and self.last_acceleration.shape[0] == sleep_mask.shape[0] == self.sleep_mask.shape[0]:
+            # Rows that fell asleep or woke up gain or lose their springs, their next force has nothing to compare with
+            self.last_acceleration[sleep_mask != self.sleep_mask] = np.nan
+        else:
+            self.last_acceleration = None
+        self.revision += 1
+        self.sleep_mask = sleep_mask
+        self.sleep_idx = np.flatnonzero(sleep_mask)
+        self.sleep_location = particle_system.location[self.sleep_idx].copy()
+        self.sleep_tree = None
+
+    def wake(self, particle_system, particle_idx_array):
+        # Wakes the islands of the given particles
+        particle_system.state.still_frames[particle_idx_array] = 0
+        self.refresh(particle_system)
+
+    def freeze(self, particle_system):
+        # Undoes the step for the sleeping rows
+        if self.sleep_idx.shape[0] == 0:
+            return
+        particle_system.location[self.sleep_idx] = self.sleep_location
+        particle_system.velocity[self.sleep_idx] = 0.0
+        particle_system.solver.spawn_particles(particle_system, self.sleep_idx)
+
+    def get_contact_idx(self, particle_system):
+        # Awake rows plus the sleeping rows within reach of one of them, whose islands are woken up
+        awake_idx = np.flatnonzero(particle_system.state.alive & ~self.sleep_mask)
+        if awake_idx.shape[0] == 0:
+            return awake_idx
+        if self.sleep_tree == None:
+            self.sleep_tree = cKDTree(self.sleep_location)
+        awake_mass = particle_system.mass[awake_idx]
+        sleep_mass = particle_system.mass[self.sleep_idx]
+        # Spheres of radius mass as in the particle collision
+        pair_array = self.sleep_tree.sparse_distance_matrix(cKDTree(particle_system.location[awake_idx]), float(awake_mass.max() + sleep_mass.max()),
+                                                            output_type='ndarray')
+        is_touching = pair_array['v'] <= sleep_mass[pair_array['i']] + awake_mass[pair_array['j']]
+        touched_idx = self.sleep_idx[np.unique(pair_array['i'][is_touching])]
+        if touched_idx.shape[0] == 0:
+            return awake_idx
+        self.wake(particle_system, touched_idx)
+        return np.flatnonzero(particle_system.state.alive & ~self.sleep_mask)
+
+    def update(self, particle_system):
+        # End of step: count still steps, wake rows whose force changed and record the awake count
+        state = particle_system.state
+        acceleration = state.force / state.mass[:, None]
+        is_still = state.alive & (np.einsum('ij,ij->i', state.velocity, state.velocity) <= self.velocity_threshold ** 2)
+        if self.last_acceleration is not None and self.last_acceleration.shape == acceleration.shape:
+            change = acceleration - self.last_acceleration
+            change_square = np.einsum('ij,ij->i', change, change)
+            is_still &= (change_square <= self.force_threshold ** 2) | np.isnan(change_square)
+        state.still_frames[is_still] += 1
+        state.still_frames[~is_still] = 0
+        self.last_acceleration = acceleration
+        self.refresh(particle_system)
+        self.awake_count_list.append(self.get_awake_count(particle_system))
+
+    def save_sleep(self):
+        json_data = {}
+        json_data['enabled'] = self.enabled
+        json_data['velocity_threshold'] = self.velocity_threshold
+        json_data['force_threshold'] = self.force_threshold
+        json_data['sleep_frames'] = self.sleep_frames
+        return json_data
+
+    def load_sleep(self, json_data):
+        self.enabled = json_data['enabled']
+        self.velocity_threshold = json_data['velocity_threshold']
+        self.force_threshold = json_data['force_threshold']
+        self.sleep_frames = json_data['sleep_frames']
+        self.reset_sleep()
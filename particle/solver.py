@@ -7,6 +7,12 @@ class Solver:
     def reset_solver(self, particle_system):
         pass
 
+    def remap_particles(self, idx_map):
+        pass
+
+    def spawn_particles(self, particle_system, particle_idx_array):
+        pass
+
     def save_solver(self):
         pass
 
@@ -79,6 +85,25 @@ class LeapfrogSolver(Solver):
         self.half_velocity = None
         self.first = True
 
+    def remap_particles(self, idx_map):
+        # Rows added since the last step have no half velocity yet, they are picked up in solve_step
+        if self.half_velocity is None:
+            return
+        idx_map = idx_map[:self.half_velocity.shape[0]]
+        is_kept = idx_map >= 0
+        if np.array_equal(idx_map[is_kept], np.arange(np.count_nonzero(is_kept))):
+            self.half_velocity = self.half_velocity[is_kept]
+        else:
+            # Particles were added in front of emitted ones, the next step starts over from the velocities
+            self.half_velocity = None
+            self.first = True
+
+    def spawn_particles(self, particle_system, particle_idx_array):
+        # Recycled rows start over from their new velocity, rows past the end are picked up in solve_step
+        if self.half_velocity is not None:
+            particle_idx_array = particle_idx_array[particle_idx_array < self.half_velocity.shape[0]]
+            self.half_velocity[particle_idx_array] = particle_system.velocity[particle_idx_array]
+
     def solve_step(self, particle_system, step):
         # https://github.com/runiteking1/sph/blob/master/leapfrog.c
         num_particles = len(particle_system.particle_list)
@@ -93,11 +118,14 @@ class LeapfrogSolver(Solver):
             self.first = False
         else:
             origin_state = particle_system.get_state()
+            if self.half_velocity.shape[0] < num_particles:
+                # Particles added since the last step start from their current velocity
+                self.half_velocity = np.vstack((self.half_velocity, origin_state[self.half_velocity.shape[0]:, 3:6]))
             derivative_state = particle_system.derivative_eval()
             self.half_velocity += step * derivative_state[:, 3:6]
             origin_state[:, 3:6] = self.half_velocity.copy()
             origin_state[:, 3:6] += step / 2.0 * derivative_state[:, 3:6]
-            origin_state[:, 0:6] += step * self.half_velocity
+            origin_state[:, 0:3] += step * self.half_velocity
             particle_system.set_state(origin_state)
 
     def save_solver(self):
@@ -115,3 +143,12 @@ class BackwardEulerSolver(Solver):
 
     def save_solver(self):
         return "backward_euler_solver"
+
+SOLVER_TYPES = {
+    'forward_euler_solver': ForwardEulerSolver,
+    'second_order_rk_solver': SecondOrderRKSolver,
+    'fourth_order_rk_solver': FourthOrderRKSolver,
+    'verlet_solver': VerletSolver,
+    'leap_frog_solver': LeapfrogSolver,
+    'backward_euler_solver': BackwardEulerSolver,
+}
@@ -0,0 +1,244 @@
+import numpy as np
+import hashlib
+
+# Structure of arrays storage of particles, the buffers grow geometrically so adding
+# particles one at a time stays amortized O(1). Only the first count rows are in use, rows of
+# expired emitted particles stay in place with alive cleared until the pool recycles them.
+
+
+class ParticleState:
+    def __init__(self, dtype=np.float64):
+        # dtype of location, velocity, force and mass
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.location_buffer = np.zeros((0, 3), dtype=self.dtype)
+        self.velocity_buffer = np.zeros((0, 3), dtype=self.dtype)
+        self.force_buffer = np.zeros((0, 3), dtype=self.dtype)
+        self.mass_buffer = np.zeros((0,), dtype=self.dtype)
+        self.alive_buffer = np.zeros((0,), dtype=bool)
+        # Ids stay with a particle when rows are compacted or recycled, next_id is never reused
+        self.id_buffer = np.zeros((0,), dtype=np.int64)
+        self.next_id = 0
+        # Steps in a row the particle has been still, see sleep.py
+        self.still_buffer = np.zeros((0,), dtype=np.int64)
+
+    @property
+    def location(self):
+        return self.location_buffer[:self.count]
+
+    @property
+    def velocity(self):
+        return self.velocity_buffer[:self.count]
+
+    @property
+    def force(self):
+        return self.force_buffer[:self.count]
+
+    @property
+    def mass(self):
+        return self.mass_buffer[:self.count]
+
+    @property
+    def alive(self):
+        return self.alive_buffer[:self.count]
+
+    @property
+    def particle_id(self):
+        return self.id_buffer[:self.count]
+
+    @property
+    def still_frames(self):
+        return self.still_buffer[:self.count]
+
+    def new_ids(self, count):
+        id_array = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        return id_array
+
+    def get_capacity(self):
+        return self.mass_buffer.shape[0]
+
+    def get_hash(self):
+        # Digest of the simulated rows, two states hash the same only when they are bitwise equal
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (self.location, self.velocity, self.alive, self.particle_id):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def get_buffer(self, name):
+        return getattr(self, name + '_buffer')
+
+    def set_buffer(self, name, buffer):
+        # Swaps the storage of a field for another array of the same capacity, such as a view of shared
+        # memory (see domain.py). The state must not grow past it
+        setattr(self, name + '_buffer', buffer)
+
+    def set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.location_buffer = self.location_buffer.astype(self.dtype)
+        self.velocity_buffer = self.velocity_buffer.astype(self.dtype)
+        self.force_buffer = self.force_buffer.astype(self.dtype)
+        self.mass_buffer = self.mass_buffer.astype(self.dtype)
+
+    def reserve(self, capacity):
+        if capacity <= self.get_capacity():
+            return
+        location_buffer = np.zeros((capacity, 3), dtype=self.dtype)
+        velocity_buffer = np.zeros((capacity, 3), dtype=self.dtype)
+        force_buffer = np.zeros((capacity, 3), dtype=self.dtype)
+        mass_buffer = np.ones((capacity,), dtype=self.dtype)
+        alive_buffer = np.ones((capacity,), dtype=bool)
+        id_buffer = np.zeros((capacity,), dtype=np.int64)
+        still_buffer = np.zeros((capacity,), dtype=np.int64)
+        location_buffer[:self.count] = self.location
+        velocity_buffer[:self.count] = self.velocity
+        force_buffer[:self.count] = self.force
+        mass_buffer[:self.count] = self.mass
+        alive_buffer[:self.count] = self.alive
+        id_buffer[:self.count] = self.particle_id
+        still_buffer[:self.count] = self.still_frames
+        self.location_buffer = location_buffer
+        self.velocity_buffer = velocity_buffer
+        self.force_buffer = force_buffer
+        self.mass_buffer = mass_buffer
+        self.alive_buffer = alive_buffer
+        self.id_buffer = id_buffer
+        self.still_buffer = still_buffer
+
+    def resize(self, count):
+        if count > self.get_capacity():
+            self.reserve(max(count, 2 * self.get_capacity()))
+        if count > self.count:
+            self.location_buffer[self.count:count] = 0.0
+            self.velocity_buffer[self.count:count] = 0.0
+            self.force_buffer[self.count:count] = 0.0
+            self.mass_buffer[self.count:count] = 1.0
+            self.alive_buffer[self.count:count] = True
+            self.id_buffer[self.count:count] = self.new_ids(count - self.count)
+            self.still_buffer[self.count:count] = 0
+        self.count = count
+
+    def add(self, location=(0.0, 0.0, 0.0), velocity=(0.0, 0.0, 0.0), force=(0.0, 0.0, 0.0), mass=1.0):
+        idx = self.count
+        self.resize(self.count + 1)
+        self.location_buffer[idx] = location
+        self.velocity_buffer[idx] = velocity
+        self.force_buffer[idx] = force
+        self.mass_buffer[idx] = mass
+        return idx
+
+    def add_array(self, location, velocity=0.0, force=0.0, mass=1.0):
+        # Appends len(location) rows at once, the other arguments broadcast against them
+        start_idx = self.count
+        self.resize(self.count + len(location))
+        self.location_buffer[start_idx:self.count] = location
+        self.velocity_buffer[start_idx:self.count] = velocity
+        self.force_buffer[start_idx:self.count] = force
+        self.mass_buffer[start_idx:self.count] = mass
+        return start_idx
+
+    def insert_array(self, idx, location, velocity=0.0, force=0.0, mass=1.0):
+        # add_array before row idx, the rows from idx on move up and keep their ids
+        old_count = self.count
+        self.resize(self.count + len(location))
+        end_idx = idx + len(location)
+        id_array = self.id_buffer[old_count:self.count].copy()
+        for buffer in (self.location_buffer, self.velocity_buffer, self.force_buffer, self.mass_buffer, self.alive_buffer, self.id_buffer, self.still_buffer):
+            buffer[end_idx:self.count] = buffer[idx:old_count]
+        self.location_buffer[idx:end_idx] = location
+        self.velocity_buffer[idx:end_idx] = velocity
+        self.force_buffer[idx:end_idx] = force
+        self.mass_buffer[idx:end_idx] = mass
+        self.alive_buffer[idx:end_idx] = True
+        self.id_buffer[idx:end_idx] = id_array
+        self.still_buffer[idx:end_idx] = 0
+        return idx
+
+    def compact(self, keep_mask):
+        # Keeps the rows where keep_mask is set, in order
+        count = int(np.count_nonzero(keep_mask))
+        for buffer in (self.location_buffer, self.velocity_buffer, self.force_buffer, self.mass_buffer, self.alive_buffer, self.id_buffer, self.still_buffer):
+            buffer[:count] = buffer[:self.count][keep_mask]
+        self.count = count
+
+    def copy_from(self, other):
+        self.resize(other.count)
+        self.location[:] = other.location
+        self.velocity[:] = other.velocity
+        self.force[:] = 0.0
+        self.mass[:] = other.mass
+        self.alive[:] = other.alive
+        self.particle_id[:] = other.particle_id
+        self.still_frames[:] = 0
+        self.next_id = other.next_id
+
+
+class Particle:
+    # View of one row of a ParticleState, reads return views and writes go straight to the arrays
+    def __init__(self, state, idx):
+        self.state = state
+        self.idx = idx
+
+    @property
+    def location(self):
+        return self.state.location[self.idx]
+
+    @location.setter
+    def location(self, location):
+        self.state.location[self.idx] = location
+
+    @property
+    def velocity(self):
+        return self.state.velocity[self.idx]
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self.state.velocity[self.idx] = velocity
+
+    @property
+    def force(self):
+        return self.state.force[self.idx]
+
+    @force.setter
+    def force(self, force):
+        self.state.force[self.idx] = force
+
+    @property
+    def mass(self):
+        return float(self.state.mass[self.idx])
+
+    @mass.setter
+    def mass(self, mass):
+        self.state.mass[self.idx] = mass
+
+    def save_particle(self):
+        json_data = {}
+        json_data["location"] = self.location.tolist()
+        json_data["velocity"] = self.velocity.tolist()
+        json_data["mass"] = self.mass
+        return json_data
+
+    def load_particle(self, json_data):
+        self.location = json_data["location"]
+        self.velocity = json_data["velocity"]
+        self.mass = json_data["mass"]
+
+
+class ParticleList:
+    # Read only sequence of Particle views, kept for code that works per particle (UI, file io)
+    def __init__(self, state):
+        self.state = state
+
+    def __len__(self):
+        return self.state.count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.state.count
+        if idx < 0 or idx >= self.state.count:
+            raise IndexError('particle index out of range')
+        return Particle(self.state, idx)
+
+    def __iter__(self):
+        for idx in range(self.state.count):
+            yield Particle(self.state, idx)
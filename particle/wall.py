@@ -1,5 +1,10 @@
-import bpy
-from mathutils import geometry, Vector, Matrix
+try:
+    import bpy
+    from mathutils import geometry, Vector, Matrix
+except ImportError:
+    bpy = None
+import numpy as np
+
 class Wall:
     def __init__(self, reference_ob):
         # Assume its plane
@@ -17,10 +22,35 @@ class Wall:
     def set_normal(self, normal):
         self.reference_ob.rotation_euler = Vector((0.0, 0.0, 1.0)).rotation_difference(normal).to_euler()
 
+    def get_unit_normal(self):
+        return self.get_normal().normalized()
+
     def is_collision(self, point_location, point_vector):
         location = self.get_location()
         normal = self.get_normal()
         if point_vector.dot(normal) < 1e-9:
             return False, Vector((0, 0, 0))
         projection_location = geometry.intersect_line_plane(location, location+normal, point_location, point_vector)
-        return True, projection_location
\ No newline at end of file
+        return True, projection_location
+
+
+class FixedWall:
+    # Plane without a reference object, stands in for Wall when scenes are baked outside of blender
+    def __init__(self, location=(0.0, 0.0, 0.0), normal=(0.0, 0.0, 1.0)):
+        self.set_location(location)
+        self.set_normal(normal)
+
+    def get_location(self):
+        return self.location
+
+    def set_location(self, location):
+        self.location = np.array(location, dtype=np.float64)
+
+    def get_normal(self):
+        return self.normal
+
+    def set_normal(self, normal):
+        self.normal = np.array(normal, dtype=np.float64)
+
+    def get_unit_normal(self):
+        return self.normal / np.linalg.norm(self.normal)
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# The particle package is imported from the addon directory, as blender and the bake workers do
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ADDON_DIR)
+
+
+class AddonDirectory:
+    # The addon __init__ imports bpy, its directory is collected as a plain directory so that pytest
+    # doesn't import it as a package
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collect_directory(self, path, parent):
+        if str(path) == ADDON_DIR:
+            return pytest.Dir.from_parent(parent, path=path)
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(AddonDirectory())
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from particle.benchmark import BACKEND_KERNEL_NAMES, build_kernel_inputs, run_kernel, build_grid_scene, build_fluid_scene, STEP
+from particle.kernels import NumpyKernels, get_kernels, HAS_NUMBA
+from particle.parallel import ChunkExecutor
+
+requires_numba = pytest.mark.skipif(not HAS_NUMBA, reason='numba is not installed')
+
+
+@pytest.fixture(scope='module')
+def kernel_inputs():
+    return build_kernel_inputs(500, seed=0)
+
+
+@pytest.fixture(scope='module')
+def executor():
+    # Several chunks, the compiled contact and neighbor searches are split over them
+    executor = ChunkExecutor(4, min_chunk_size=64)
+    yield executor
+    executor.shutdown()
+
+
+def test_numba_falls_back_to_numpy():
+    assert get_kernels('numpy') is NumpyKernels
+    if not HAS_NUMBA:
+        assert get_kernels('numba') is NumpyKernels
+
+
+@requires_numba
+@pytest.mark.parametrize('name', BACKEND_KERNEL_NAMES)
+def test_backends_agree(name, kernel_inputs, executor):
+    numpy_output = run_kernel(NumpyKernels, name, kernel_inputs, executor)
+    numba_output = run_kernel(get_kernels('numba'), name, kernel_inputs, executor)
+    np.testing.assert_allclose(numba_output, numpy_output, rtol=1e-9, atol=1e-9)
+
+
+@requires_numba
+@pytest.mark.parametrize('build_scene', [build_grid_scene, build_fluid_scene])
+def test_backends_agree_over_steps(build_scene):
+    location_list = []
+    for backend in ('numpy', 'numba'):
+        p_system = build_scene(400)
+        p_system.set_backend(backend)
+        for step_idx in range(10):
+            p_system.simulate_step(STEP)
+        location_list.append(p_system.location.copy())
+    np.testing.assert_allclose(location_list[1], location_list[0], rtol=1e-7, atol=1e-7)
@@ -0,0 +1,15 @@
+import numpy as np
+from particle.benchmark import check_precision_drift, build_grid_scene, DRIFT_TOLERANCE, STEP
+
+
+def test_single_precision_state():
+    p_system = build_grid_scene(100)
+    p_system.set_precision('single')
+    p_system.simulate_step(STEP)
+    assert p_system.location.dtype == np.float32
+    assert p_system.velocity.dtype == np.float32
+
+
+def test_single_precision_drift():
+    drift = check_precision_drift()
+    assert drift['max_distance'] < DRIFT_TOLERANCE